@@ -0,0 +1,95 @@
+"""
+Client benchmark: throughput of many concurrent writers and readers using one request per
+call over a shared httpx client, compared with KVClient, which batches concurrent calls,
+and with KVClient plus a near cache. Reads go to a hot set of keys. Needs a running cluster (docker-compose up).
+
+Usage: python benchmark_client.py [num_ops] [concurrency]
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+
+from kv_client import KVClient
+from near_cache import NearCache
+
+LEADER_URL = "http://localhost:8000"
+FOLLOWERS = [
+    "http://localhost:8001",
+    "http://localhost:8002",
+    "http://localhost:8003",
+    "http://localhost:8004",
+    "http://localhost:8005",
+]
+
+DEFAULT_OPS = 2000
+DEFAULT_CONCURRENCY = 50
+HOT_KEYS = 100
+
+
+async def run_workers(num_ops: int, concurrency: int, operation) -> float:
+    """Ops/s for `num_ops` calls of `operation(i)` from `concurrency` workers."""
+    counter = iter(range(num_ops))
+
+    async def worker():
+        for i in counter:
+            await operation(i)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return num_ops / (time.perf_counter() - start_time)
+
+
+async def bench_plain(num_ops: int, concurrency: int):
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+        async def write(i):
+            response = await client.post(f"{LEADER_URL}/keys", json={"key": f"bench_{i}", "value": f"v{i}"})
+            response.raise_for_status()
+
+        async def read(i):
+            response = await client.get(f"{FOLLOWERS[i % len(FOLLOWERS)]}/keys/bench_{i % HOT_KEYS}")
+            assert response.status_code in (200, 404)
+
+        return await run_workers(num_ops, concurrency, write), await run_workers(num_ops, concurrency, read)
+
+
+async def bench_client(num_ops: int, concurrency: int, near_cache: NearCache = None):
+    async with KVClient(LEADER_URL, FOLLOWERS, consistency="eventual", near_cache=near_cache) as kv:
+        async def write(i):
+            await kv.set(f"bench_{i}", f"v{i}")
+
+        async def read(i):
+            await kv.get(f"bench_{i % HOT_KEYS}")
+
+        if near_cache is not None:
+            # Connect the change stream first, or every read bypasses the cache
+            await kv.get("bench_0")
+            while not kv.watch_connected:
+                await asyncio.sleep(0.01)
+        writes = await run_workers(num_ops, concurrency, write)
+        reads = await run_workers(num_ops, concurrency, read)
+        return writes, reads, kv.stats["requests"], kv.cache_stats()
+
+
+async def main():
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OPS
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CONCURRENCY
+    print("=" * 70)
+    print("Client Benchmark")
+    print("=" * 70)
+    print(f"{num_ops} writes then {num_ops} reads of {HOT_KEYS} hot keys from {concurrency} concurrent callers")
+    print("-" * 70)
+    print(f"{'Client':<20} {'Write/s':<12} {'Read/s':<12} {'HTTP requests':<14} {'Cache hit rate':<14}")
+    print("-" * 70)
+    writes, reads = await bench_plain(num_ops, concurrency)
+    print(f"{'httpx per call':<20} {writes:<12.0f} {reads:<12.0f} {2 * num_ops:<14} {'-':<14}")
+    writes, reads, requests, _ = await bench_client(num_ops, concurrency)
+    print(f"{'KVClient':<20} {writes:<12.0f} {reads:<12.0f} {requests:<14} {'-':<14}")
+    writes, reads, requests, cache = await bench_client(num_ops, concurrency, NearCache())
+    print(f"{'KVClient + cache':<20} {writes:<12.0f} {reads:<12.0f} {requests:<14} {cache['hit_rate']:<14.1%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
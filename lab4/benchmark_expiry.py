@@ -0,0 +1,106 @@
+"""
+TTL expiration benchmark: cost of keeping expiry metadata for millions of keys, of an expiry
+tick when few keys are due (the common case), and of deleting due keys, compared with
+finding due keys by scanning every key. Each size runs in a fresh process so RSS is
+measured in isolation. Runs in-process, no docker-compose needed.
+
+Usage: python benchmark_expiry.py [num_keys ...]
+"""
+import multiprocessing
+import resource
+import sys
+import time
+from typing import Dict
+
+from kvstore import KVStore
+
+DEFAULT_SIZES = [1_000_000, 3_000_000]
+TICKS = 1000
+EXPIRE_BATCH = 1000
+TTL_SPREAD_S = 3600.0
+
+
+def current_rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def run(num_keys: int, with_ttl: bool, results):
+    store = KVStore()
+    now = time.time()
+    baseline_rss = current_rss_bytes()
+
+    start_time = time.perf_counter()
+    for i in range(num_keys):
+        # Expiries spread over an hour, in no particular order
+        expires_at = now + (i * 7919 % num_keys) / num_keys * TTL_SPREAD_S if with_ttl else 0.0
+        store.write(f"key_{i}", f"value_{i}", expires_at)
+    write_elapsed = time.perf_counter() - start_time
+    bytes_per_key = (current_rss_bytes() - baseline_rss) / num_keys
+
+    result = {
+        "ttl": with_ttl,
+        "keys": num_keys,
+        "bytes_per_key": bytes_per_key,
+        "write_ops": num_keys / write_elapsed,
+    }
+    if with_ttl:
+        # Ticks at the current time: nothing is due yet, as between expirations
+        start_time = time.perf_counter()
+        for _ in range(TICKS):
+            store.expire_due(now, EXPIRE_BATCH)
+        result["idle_tick_us"] = (time.perf_counter() - start_time) / TICKS * 1e6
+
+        # What a full scan for due keys costs per tick
+        start_time = time.perf_counter()
+        due = [key for key, expires_at in store.expiries.items() if expires_at <= now]
+        result["scan_tick_us"] = (time.perf_counter() - start_time) * 1e6
+        assert not due
+
+        # Ten minutes later: delete everything due, one tick-sized batch at a time
+        later = now + 600.0
+        deleted = 0
+        start_time = time.perf_counter()
+        while True:
+            expired = store.expire_due(later, EXPIRE_BATCH)
+            deleted += len(expired)
+            if len(expired) < EXPIRE_BATCH:
+                break
+        result["expire_ops"] = deleted / (time.perf_counter() - start_time)
+        result["expired"] = deleted
+    results.put(result)
+
+
+def measure(num_keys: int, with_ttl: bool) -> Dict:
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run, args=(num_keys, with_ttl, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print("=" * 90)
+    print("TTL Expiration Benchmark")
+    print("=" * 90)
+    print(f"Expiries spread over {TTL_SPREAD_S:.0f}s, expiry batch {EXPIRE_BATCH}, dict engine")
+    print("-" * 90)
+    print(f"{'Keys':<10} {'TTL':<5} {'B/key':<7} {'Write/s':<9} {'Idle tick (us)':<15} "
+          f"{'Scan tick (us)':<15} {'Expire/s':<9} {'Expired':<8}")
+    print("-" * 90)
+    for num_keys in sizes:
+        for with_ttl in (False, True):
+            r = measure(num_keys, with_ttl)
+            if with_ttl:
+                extra = (f"{r['idle_tick_us']:<15.1f} {r['scan_tick_us']:<15.0f} "
+                         f"{r['expire_ops']:<9.0f} {r['expired']:<8}")
+            else:
+                extra = f"{'-':<15} {'-':<15} {'-':<9} {'-':<8}"
+            print(f"{r['keys']:<10} {'yes' if with_ttl else 'no':<5} {r['bytes_per_key']:<7.0f} "
+                  f"{r['write_ops']:<9.0f} {extra}")
+
+
+if __name__ == "__main__":
+    main()
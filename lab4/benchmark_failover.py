@@ -0,0 +1,180 @@
+"""
+Failover benchmark: starts a leader and four followers as local processes, keeps writing
+through KVClient, then kills the leader (SIGKILL) and measures how long writes are
+unavailable until a follower is elected and clients have moved to it: the longest gap
+between two acknowledged writes around the kill. Afterwards every acknowledged write is
+read back from the new leader.
+
+Repeated for several election timeouts; the leader's heartbeat interval is a fifth of the
+timeout. A trial in which the followers already held an election before the kill (a
+heartbeat delayed past the timeout on a busy machine) is discarded, counted and repeated.
+
+Usage: python benchmark_failover.py [trials_per_timeout]
+"""
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from kv_client import KVClient
+
+BASE_PORT = 8400
+NUM_FOLLOWERS = 4
+WRITE_QUORUM = 2
+ELECTION_TIMEOUTS_MS = [250, 500, 1000]
+DEFAULT_TRIALS = 3
+CONCURRENCY = 10
+WRITE_SECONDS_BEFORE_KILL = 2.0
+WRITE_SECONDS_AFTER_KILL = 1.0
+MAX_DELAY_MS = os.getenv("MAX_DELAY_MS", "20")
+
+LEADER_URL = f"http://localhost:{BASE_PORT}"
+FOLLOWER_URLS = [f"http://localhost:{BASE_PORT + i}" for i in range(1, NUM_FOLLOWERS + 1)]
+
+
+def start_cluster(election_timeout_ms: int) -> Dict[str, subprocess.Popen]:
+    heartbeat_ms = str(max(election_timeout_ms // 5, 10))
+    processes = {}
+    for i, url in enumerate(FOLLOWER_URLS, start=1):
+        env = dict(os.environ, FOLLOWER_PORT=str(BASE_PORT + i), FOLLOWER_ID=f"follower{i}", FOLLOWER_URL=url,
+                   LEADER_URL=LEADER_URL, PEERS=",".join(peer for peer in FOLLOWER_URLS if peer != url),
+                   ELECTION_TIMEOUT_MS=str(election_timeout_ms), HEARTBEAT_INTERVAL_MS=heartbeat_ms,
+                   MIN_DELAY_MS="0", MAX_DELAY_MS=MAX_DELAY_MS, WORKERS="1")
+        processes[url] = subprocess.Popen([sys.executable, "follower.py"], env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ, LEADER_PORT=str(BASE_PORT), LEADER_URL=LEADER_URL, FOLLOWERS=",".join(FOLLOWER_URLS),
+               WRITE_QUORUM=str(WRITE_QUORUM), HEARTBEAT_INTERVAL_MS=heartbeat_ms, WORKERS="1")
+    processes[LEADER_URL] = subprocess.Popen([sys.executable, "leader.py"], env=env,
+                                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return processes
+
+
+def stop_cluster(processes: Dict[str, subprocess.Popen]):
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for process in processes.values():
+        process.wait()
+
+
+async def wait_for_cluster():
+    async with httpx.AsyncClient() as client:
+        for url in [LEADER_URL, *FOLLOWER_URLS]:
+            for _ in range(200):
+                try:
+                    if (await client.get(f"{url}/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"{url} did not start")
+        # Followers learn the term from the first heartbeat
+        for url in FOLLOWER_URLS:
+            while (await client.get(f"{url}/")).json()["leader_url"] != LEADER_URL:
+                await asyncio.sleep(0.05)
+
+
+async def watch_for_leader(killed_at: List[float]) -> Optional[float]:
+    """Seconds from the kill until a follower reports itself leader."""
+    async with httpx.AsyncClient(timeout=0.5) as client:
+        while True:
+            for url in FOLLOWER_URLS:
+                try:
+                    if (await client.get(f"{url}/")).json()["role"] == "leader":
+                        return time.perf_counter() - killed_at[0]
+                except (httpx.HTTPError, ValueError):
+                    pass
+            await asyncio.sleep(0.005)
+
+
+async def max_follower_term() -> int:
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        return max([(await client.get(f"{url}/")).json()["term"] for url in FOLLOWER_URLS])
+
+
+async def run_trial(election_timeout_ms: int, trial: int) -> Optional[Dict]:
+    processes = start_cluster(election_timeout_ms)
+    try:
+        await wait_for_cluster()
+        # Retry every 10-50ms for as long as the failover takes
+        kv = KVClient(LEADER_URL, FOLLOWER_URLS, retries=1000, backoff_base_s=0.01, backoff_max_s=0.05,
+                      timeout=5.0)
+        acked: Dict[str, str] = {}
+        ack_times: List[float] = []
+        killed_at: List[float] = []
+        stop_at = [float("inf")]
+        counter = iter(range(10 ** 9))
+
+        async def writer():
+            while time.perf_counter() < stop_at[0]:
+                key = f"failover_{election_timeout_ms}_{trial}_{next(counter)}"
+                value = f"value_of_{key}"
+                await kv.set(key, value)
+                acked[key] = value
+                ack_times.append(time.perf_counter())
+
+        writers = [asyncio.create_task(writer()) for _ in range(CONCURRENCY)]
+        await asyncio.sleep(WRITE_SECONDS_BEFORE_KILL)
+        if await max_follower_term() > 1:
+            stop_at[0] = 0.0
+            await asyncio.gather(*writers)
+            await kv.close()
+            return None
+        processes[LEADER_URL].send_signal(signal.SIGKILL)
+        killed_at.append(time.perf_counter())
+        promotion = await watch_for_leader(killed_at)
+        stop_at[0] = time.perf_counter() + WRITE_SECONDS_AFTER_KILL
+        await asyncio.gather(*writers)
+
+        # Responses already received when the leader died may be handled just after the kill,
+        # so the outage is the longest gap between acks rather than the time since the kill
+        around_kill = sorted(t for t in ack_times if t >= killed_at[0] - WRITE_SECONDS_BEFORE_KILL / 2)
+        unavailable = max(later - earlier for earlier, later in zip(around_kill, around_kill[1:]))
+        values = await kv.get_many(list(acked), consistency="strong")
+        lost = sum(1 for key, value in acked.items() if values.get(key) != value)
+        new_leader = kv.leader_url
+        await kv.close()
+        return {"promotion_ms": promotion * 1000, "unavailable_ms": unavailable * 1000,
+                "acked": len(acked), "lost": lost, "new_leader": new_leader}
+    finally:
+        stop_cluster(processes)
+
+
+async def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TRIALS
+    print("=" * 80)
+    print("Failover Benchmark")
+    print("=" * 80)
+    print(f"1 leader + {NUM_FOLLOWERS} followers, quorum {WRITE_QUORUM}, {CONCURRENCY} concurrent writers, "
+          f"{trials} trials per election timeout")
+    print(f"{'Timeout ms':<12} {'Elected ms (p50/max)':<22} {'Unavailable ms (p50/max)':<26} "
+          f"{'Acked':<8} {'Lost':<6} {'Discarded':<9}")
+    print("-" * 90)
+    for election_timeout_ms in ELECTION_TIMEOUTS_MS:
+        results, discarded = [], 0
+        while len(results) < trials and discarded < 3 * trials:
+            result = await run_trial(election_timeout_ms, len(results) + discarded)
+            if result is None:
+                discarded += 1
+            else:
+                results.append(result)
+        if not results:
+            print(f"{election_timeout_ms:<12} every trial had an election before the kill")
+            continue
+        promotions = [r["promotion_ms"] for r in results]
+        windows = [r["unavailable_ms"] for r in results]
+        print(f"{election_timeout_ms:<12} "
+              f"{statistics.median(promotions):>7.0f} / {max(promotions):<12.0f} "
+              f"{statistics.median(windows):>7.0f} / {max(windows):<16.0f} "
+              f"{sum(r['acked'] for r in results):<8} {sum(r['lost'] for r in results):<6} {discarded:<9}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""
+Read path benchmark: the leader's real GET /keys/{key} under a concurrent write load.
+Reads take no lock, so they should not queue behind writes holding a key lock; this
+measures read latency with no writes, with the default 5% writes and with 50% writes,
+against the leader in one process and with its store in a separate owner process as
+with WORKERS > 1. There every store call is a round trip to the owner, and a write holds
+its key lock across it. The leader has no followers and a quorum of 0, and its ASGI app
+is called directly by concurrent clients. Runs in-process, no docker-compose needed.
+
+With --http it instead starts leader.py as a local process with WORKERS=1 and with
+WORKERS=4, and sends the same load over HTTP, to compare worker counts end to end.
+
+Usage: python benchmark_reads.py [--http] [ops_per_client]
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import numpy as np
+
+from benchmark_serialization import NODE_ENV, call
+from kvstore import STORE_SOCKET_ENV, start_store_owner
+from simulator import load_node
+
+NUM_CLIENTS = 100
+OPS_PER_CLIENT = 200
+WRITE_RATIOS = [0.0, 0.05, 0.5]
+NUM_KEYS = 1000
+HTTP_PORT = 8600
+HTTP_WORKERS = [1, 4]
+
+# Sends one request and returns its status
+Send = Callable[[str, str, bytes], Awaitable[int]]
+
+
+async def run_workload(send: Send, write_ratio: float, ops_per_client: int, seed: int = 42) -> Dict:
+    rng = random.Random(seed)
+    plans = [
+        [(rng.random() >= write_ratio, f"key_{rng.randrange(NUM_KEYS)}") for _ in range(ops_per_client)]
+        for _ in range(NUM_CLIENTS)
+    ]
+    read_latencies: List[float] = []
+    write_latencies: List[float] = []
+
+    async def client(plan):
+        for is_read, key in plan:
+            start_time = time.perf_counter()
+            if is_read:
+                status = await send("GET", f"/keys/{key}", b"")
+                read_latencies.append(time.perf_counter() - start_time)
+            else:
+                status = await send("POST", "/keys", json.dumps({"key": key, "value": "value"}).encode())
+                write_latencies.append(time.perf_counter() - start_time)
+            if status != 200:
+                raise RuntimeError(f"{'read' if is_read else 'write'} of {key} returned {status}")
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client(plan) for plan in plans))
+    elapsed = time.perf_counter() - start_time
+
+    reads = np.array(read_latencies) * 1000
+    writes = np.array(write_latencies) * 1000
+    return {
+        "throughput": (len(reads) + len(writes)) / elapsed,
+        "read_p50_ms": np.median(reads),
+        "read_p99_ms": np.percentile(reads, 99),
+        "write_p99_ms": np.percentile(writes, 99) if len(writes) else float("nan"),
+    }
+
+
+async def run_all(send: Send, ops_per_client: int) -> Dict[float, Dict]:
+    for key in range(NUM_KEYS):
+        await send("POST", "/keys", json.dumps({"key": f"key_{key}", "value": "value"}).encode())
+    return {write_ratio: await run_workload(send, write_ratio, ops_per_client) for write_ratio in WRITE_RATIOS}
+
+
+async def run_node(node, ops_per_client: int) -> Dict[float, Dict]:
+    async def send(method: str, path: str, body: bytes) -> int:
+        return await call(node.app, method, path, body)
+
+    async with node.app.router.lifespan_context(node.app):
+        return await run_all(send, ops_per_client)
+
+
+def run_mode(shared: bool, ops_per_client: int) -> Dict[float, Dict]:
+    owner = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if shared:
+                owner = start_store_owner(10, {"write_quorum": 0, "quorum_mode": "all"})
+            node = load_node("leader.py", f"bench_reads_{'shared' if shared else 'local'}", NODE_ENV)
+            return asyncio.run(run_node(node, ops_per_client))
+    finally:
+        os.environ.pop(STORE_SOCKET_ENV, None)
+        if owner:
+            owner.terminate()
+            owner.join()
+
+
+async def run_http(url: str, ops_per_client: int) -> Dict[float, Dict]:
+    limits = httpx.Limits(max_connections=NUM_CLIENTS, max_keepalive_connections=NUM_CLIENTS)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        for _ in range(200):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError(f"{url} did not start")
+
+        async def send(method: str, path: str, body: bytes) -> int:
+            headers = {"content-type": "application/json"} if body else None
+            return (await client.request(method, path, content=body or None, headers=headers)).status_code
+
+        return await run_all(send, ops_per_client)
+
+
+def run_workers(workers: int, ops_per_client: int) -> Dict[float, Dict]:
+    env = dict(os.environ, **NODE_ENV, LEADER_PORT=str(HTTP_PORT), WORKERS=str(workers))
+    process = subprocess.Popen([sys.executable, "leader.py"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.run(run_http(f"http://localhost:{HTTP_PORT}", ops_per_client))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    http = "--http" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--http"]
+    ops_per_client = int(args[0]) if args else OPS_PER_CLIENT
+    print("=" * 72)
+    print("Read Path Benchmark: leader reads under a concurrent write load")
+    print("=" * 72)
+    print(f"Clients: {NUM_CLIENTS}, ops per client: {ops_per_client}, keys: {NUM_KEYS}")
+    print("-" * 72)
+    column = "Workers" if http else "Store"
+    print(f"{column:<8} {'Writes':<8} {'Ops/s':<10} {'Read P50':<12} {'Read P99':<12} {'Write P99':<12}")
+    print("-" * 72)
+    runs = ([(str(workers), lambda workers=workers: run_workers(workers, ops_per_client))
+             for workers in HTTP_WORKERS] if http else
+            [(name, lambda shared=shared: run_mode(shared, ops_per_client))
+             for name, shared in [("local", False), ("shared", True)]])
+    for name, run in runs:
+        for write_ratio, r in run().items():
+            print(f"{name:<8} {write_ratio:<8.0%} {r['throughput']:<10.0f} "
+                  f"{r['read_p50_ms']:<12.3f} {r['read_p99_ms']:<12.3f} {r['write_p99_ms']:<12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Replication transport benchmark: JSON over HTTP/1.1 (httpx, as the leader uses it) versus
+the binary replication stream. Starts one follower process with no simulated delay and
+replicates the same items through both transports.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from replication_stream import StreamReplicator
+
+FOLLOWER_PORT = 8101
+REPL_PORT = 9101
+FOLLOWER_URL = f"http://localhost:{FOLLOWER_PORT}"
+NUM_MESSAGES = 5000
+CONCURRENCY = 100
+VALUE_SIZE = 100
+
+
+def start_follower() -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        FOLLOWER_PORT=str(FOLLOWER_PORT),
+        FOLLOWER_ID="bench-follower",
+        REPL_PORT=str(REPL_PORT),
+        MIN_DELAY_MS="0",
+        MAX_DELAY_MS="0",
+        WORKERS="1",
+    )
+    return subprocess.Popen(
+        [sys.executable, "follower.py"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_for_follower():
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                if (await client.get(f"{FOLLOWER_URL}/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Follower did not start")
+
+
+async def run(name: str, replicate, first_version: int) -> Dict:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    value = "x" * VALUE_SIZE
+    latencies: List[float] = []
+
+    async def one(i: int):
+        async with semaphore:
+            start_time = time.perf_counter()
+            assert await replicate(f"bench_key_{i % 1000}", value, first_version + i)
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(NUM_MESSAGES)))
+    elapsed = time.perf_counter() - start_time
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "transport": name,
+        "throughput": NUM_MESSAGES / elapsed,
+        "p50_ms": np.median(latencies_ms),
+        "p99_ms": np.percentile(latencies_ms, 99),
+    }
+
+
+async def main():
+    print("=" * 60)
+    print("Replication Transport Benchmark")
+    print("=" * 60)
+    print(f"Messages: {NUM_MESSAGES}, concurrency: {CONCURRENCY}, value size: {VALUE_SIZE}B")
+    follower = start_follower()
+    try:
+        await wait_for_follower()
+
+        # Same client settings as the leader's shared client
+        limits = httpx.Limits(max_keepalive_connections=10, max_connections=100)
+        async with httpx.AsyncClient(timeout=10.0, limits=limits, http2=False) as client:
+            async def replicate_http(key: str, value: str, version: int) -> bool:
+                response = await client.post(
+                    f"{FOLLOWER_URL}/replicate",
+                    json={"key": key, "value": value, "version": version}
+                )
+                return response.status_code == 200
+
+            http_result = await run("http", replicate_http, 1)
+
+        replicator = StreamReplicator("localhost", REPL_PORT)
+
+        async def replicate_stream(key: str, value: str, version: int) -> bool:
+            return await replicator.replicate([(key, value, version, [], 0.0)])
+
+        stream_result = await run("stream", replicate_stream, NUM_MESSAGES + 1)
+        await replicator.close()
+    finally:
+        follower.terminate()
+        follower.wait()
+
+    print("-" * 60)
+    print(f"{'Transport':<10} {'Msgs/s':<10} {'P50 (ms)':<10} {'P99 (ms)':<10}")
+    print("-" * 60)
+    for r in [http_result, stream_result]:
+        print(f"{r['transport']:<10} {r['throughput']:<10.0f} {r['p50_ms']:<10.3f} {r['p99_ms']:<10.3f}")
+    print(f"\nStream speedup: {stream_result['throughput'] / http_result['throughput']:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
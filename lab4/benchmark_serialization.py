@@ -0,0 +1,131 @@
+"""
+Request serialization benchmark: the hot endpoints through FastAPI's Pydantic models and
+through the lean path of fast_path.py (FAST_PATH). Each node's ASGI app is called directly,
+one request at a time, with no server or client in between, so the numbers are the app's
+own cost per request: requests per second on one core. The leader has no followers and a
+quorum of 0 and the follower no network delay, so only request handling and the store are
+measured. Runs in-process, no docker-compose needed.
+
+Usage: python benchmark_serialization.py [num_requests]
+"""
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from simulator import load_node
+
+NUM_REQUESTS = 20000
+NUM_KEYS = 1000
+VALUE_SIZE = 100
+BATCH_SIZE = 20
+NODE_ENV = {
+    "FOLLOWERS": "", "WRITE_QUORUM": "0", "ANTI_ENTROPY_INTERVAL_S": "0", "LOOP_LAG_INTERVAL_MS": "0",
+    "DELAY_MODEL": "constant:0", "PEERS": "", "REPL_PORT": "0"
+}
+
+
+async def call(app, method: str, path: str, body: bytes = b"") -> int:
+    """Send one request straight to an ASGI app and return the response status."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    received = False
+    status = 0
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def requests_for(endpoint: str, num_requests: int) -> List[Tuple[str, str, bytes]]:
+    value = "x" * VALUE_SIZE
+    if endpoint == "write":
+        return [("POST", "/keys", json.dumps({"key": f"key_{n % NUM_KEYS}", "value": value}).encode())
+                for n in range(num_requests)]
+    if endpoint == "replicate":
+        return [("POST", "/replicate", json.dumps({"key": f"key_{n % NUM_KEYS}", "value": value,
+                                                   "version": n + 1, "term": 1}).encode())
+                for n in range(num_requests)]
+    if endpoint == "replicate batch":
+        return [("POST", "/replicate/batch", json.dumps({"items": [
+            {"key": f"key_{(n * BATCH_SIZE + i) % NUM_KEYS}", "value": value, "version": n * BATCH_SIZE + i + 1}
+            for i in range(BATCH_SIZE)
+        ], "term": 1}).encode()) for n in range(num_requests)]
+    return [("GET", f"/keys/key_{n % NUM_KEYS}", b"") for n in range(num_requests)]
+
+
+async def measure(app, requests: List[Tuple[str, str, bytes]]) -> float:
+    # Warm up, and make sure every request is served
+    for method, path, body in requests[:100]:
+        status = await call(app, method, path, body)
+        if status != 200:
+            raise RuntimeError(f"{method} {path} returned {status}")
+    start_time = time.perf_counter()
+    for method, path, body in requests:
+        await call(app, method, path, body)
+    return len(requests) / (time.perf_counter() - start_time)
+
+
+async def run_node(node, endpoints: List[str], num_requests: int) -> Dict[str, float]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with node.app.router.lifespan_context(node.app):
+            results = {}
+            for endpoint in endpoints:
+                results[endpoint] = await measure(node.app, requests_for(endpoint, num_requests))
+            return results
+
+
+def run_mode(fast: bool, num_requests: int) -> Dict[str, float]:
+    env = {**NODE_ENV, "FAST_PATH": str(fast).lower()}
+    mode = "fast" if fast else "models"
+    results = {}
+    node_runs: List[Tuple[str, List[str]]] = [
+        ("leader.py", ["write", "leader read"]),
+        ("follower.py", ["replicate", "follower read"]),
+        # Replication numbers versions from 1, so batches go to a fresh follower
+        ("follower.py", ["replicate batch"]),
+    ]
+    for i, (filename, endpoints) in enumerate(node_runs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            node = load_node(filename, f"bench_{mode}_{i}", env)
+        results.update(asyncio.run(run_node(node, endpoints, num_requests)))
+    return results
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_REQUESTS
+    print("=" * 70)
+    print("Serialization Benchmark: Pydantic models vs lean path (FAST_PATH)")
+    print("=" * 70)
+    print(f"{num_requests} requests per endpoint, {VALUE_SIZE}B values, batches of {BATCH_SIZE}, one core")
+    models = run_mode(False, num_requests)
+    fast = run_mode(True, num_requests)
+    print("-" * 70)
+    print(f"{'Endpoint':<18} {'Models req/s':<14} {'Lean req/s':<14} {'Speedup':<8}")
+    print("-" * 70)
+    for endpoint in models:
+        print(f"{endpoint:<18} {models[endpoint]:<14.0f} {fast[endpoint]:<14.0f} "
+              f"{fast[endpoint] / models[endpoint]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
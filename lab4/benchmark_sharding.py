@@ -0,0 +1,146 @@
+"""
+Sharding benchmark: starts three leader groups (a leader and two followers each) as local
+processes, writes through ShardedKVClient with one group, then adds the other groups one
+at a time. After each addition it rebalances, checks that every key is readable and
+stored only on its owner, and measures write throughput again. All processes share this
+machine's cores, so throughput only grows with groups when there are cores to spare.
+
+Usage: python benchmark_sharding.py [num_keys]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from sharded_client import ShardedKVClient
+
+GROUPS = ["g1", "g2", "g3"]
+BASE_PORT = 8200
+DEFAULT_KEYS = 5000
+CONCURRENCY = 100
+FOLLOWERS_PER_GROUP = 2
+MAX_DELAY_MS = os.getenv("MAX_DELAY_MS", "20")
+
+
+def group_urls(index: int):
+    leader_port = BASE_PORT + 10 * index
+    return f"http://localhost:{leader_port}", [
+        f"http://localhost:{leader_port + i}" for i in range(1, FOLLOWERS_PER_GROUP + 1)
+    ]
+
+
+def start_group(index: int) -> List[subprocess.Popen]:
+    leader_url, follower_urls = group_urls(index)
+    leader_port = BASE_PORT + 10 * index
+    processes = []
+    for i in range(1, FOLLOWERS_PER_GROUP + 1):
+        env = dict(os.environ, FOLLOWER_PORT=str(leader_port + i), FOLLOWER_ID=f"{GROUPS[index]}-follower{i}",
+                   LEADER_URL=leader_url, MIN_DELAY_MS="0", MAX_DELAY_MS=MAX_DELAY_MS, WORKERS="1")
+        processes.append(subprocess.Popen([sys.executable, "follower.py"], env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    env = dict(os.environ, LEADER_PORT=str(leader_port), FOLLOWERS=",".join(follower_urls),
+               WRITE_QUORUM=str(FOLLOWERS_PER_GROUP), WORKERS="1")
+    processes.append(subprocess.Popen([sys.executable, "leader.py"], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    return processes
+
+
+async def wait_for_groups():
+    urls = [url for index in range(len(GROUPS)) for url in [group_urls(index)[0], *group_urls(index)[1]]]
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            for _ in range(200):
+                try:
+                    if (await client.get(f"{url}/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"{url} did not start")
+
+
+async def write_keys(kv: ShardedKVClient, keys: List[str]) -> float:
+    counter = iter(keys)
+
+    async def worker():
+        for key in counter:
+            await kv.set(key, f"value_of_{key}")
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return len(keys) / (time.perf_counter() - start_time)
+
+
+async def keys_on_groups(kv: ShardedKVClient) -> Dict[str, List[str]]:
+    placement = {}
+    async with httpx.AsyncClient() as client:
+        for name, group in kv.clients.items():
+            keys, start_after = [], None
+            while True:
+                params = {"limit": 10000, **({"start_after": start_after} if start_after else {})}
+                page = (await client.get(f"{group.leader_url}/keys", params=params)).json()
+                keys.extend(page["keys"])
+                start_after = page["next_start_after"]
+                if start_after is None:
+                    break
+            placement[name] = keys
+    return placement
+
+
+async def verify(kv: ShardedKVClient, keys: List[str]):
+    values = await kv.get_many(keys, consistency="strong")
+    assert values == {key: f"value_of_{key}" for key in keys}, "keys lost or changed"
+    for name, stored in (await keys_on_groups(kv)).items():
+        misplaced = [key for key in stored if kv.ring.owner(key) != name]
+        assert not misplaced, f"{len(misplaced)} keys left on {name}"
+
+
+async def run(num_keys: int):
+    leader_url, follower_urls = group_urls(0)
+    async with ShardedKVClient({"g1": (leader_url, follower_urls)}) as kv:
+        keys: List[str] = []
+        print(f"{'Groups':<8} {'Write/s':<10} {'Keys moved':<12} {'Moved %':<9} {'Rebalance s':<12} {'Key share':<30}")
+        print("-" * 80)
+        for count in range(1, len(GROUPS) + 1):
+            moved, moved_pct, seconds = "-", "-", "-"
+            if count > 1:
+                kv.add_group(GROUPS[count - 1], *group_urls(count - 1))
+                stats = await kv.rebalance()
+                moved = str(stats["moved"])
+                moved_pct = f"{stats['moved'] / len(keys):.1%}"
+                seconds = f"{stats['seconds']:.2f}"
+                await verify(kv, keys)
+            new_keys = [f"shard_key_{count}_{i}" for i in range(num_keys)]
+            throughput = await write_keys(kv, new_keys)
+            keys.extend(new_keys)
+            share = " ".join(f"{name}={fraction:.0%}" for name, fraction in kv.ring.ownership().items())
+            print(f"{count:<8} {throughput:<10.0f} {moved:<12} {moved_pct:<9} {seconds:<12} {share:<30}")
+        await verify(kv, keys)
+        print(f"All {len(keys)} keys readable and stored only on their owner group")
+
+
+async def main():
+    num_keys = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_KEYS
+    print("=" * 80)
+    print("Sharding Benchmark")
+    print("=" * 80)
+    print(f"{len(GROUPS)} groups of 1 leader + {FOLLOWERS_PER_GROUP} followers, quorum {FOLLOWERS_PER_GROUP}, "
+          f"{num_keys} new keys per step, {CONCURRENCY} concurrent writers")
+    processes = [process for index in range(len(GROUPS)) for process in start_group(index)]
+    try:
+        await wait_for_groups()
+        await run(num_keys)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
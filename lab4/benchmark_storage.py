@@ -0,0 +1,103 @@
+"""
+Storage engine benchmark: memory per key and operation throughput of a whole KVStore with
+the dict and with the compact engine, Merkle tree, key index and the rest included, at
+500k and 1M keys. The engine alone is measured too, to show how much of a key's cost it
+accounts for. Each run happens in a fresh process so peak RSS is measured in isolation.
+The defaults stop at 1M keys: 10M keys of the whole store take 2.4-3.4 GB plus the peaks
+of dict resizes. Runs in-process, no docker-compose needed.
+
+Usage: python benchmark_storage.py [num_keys ...]
+"""
+import multiprocessing
+import random
+import resource
+import sys
+import time
+from typing import Dict
+
+from kvstore import KVStore
+from storage import open_engine
+
+DEFAULT_SIZES = [500_000, 1_000_000]
+SCOPES = ("store", "engine")
+NUM_OPS = 200_000
+VALUE_SIZE = 32
+
+
+def current_rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def run_engine(scope: str, engine_name: str, num_keys: int, results):
+    rng = random.Random(42)
+    baseline_rss = current_rss_bytes()
+    engine = open_engine(engine_name)
+    if scope == "store":
+        store = KVStore(engine=engine)
+        put, get = lambda key, value, version: store.write(key, value), store.get
+    else:
+        put, get = engine.put, engine.get
+
+    start_time = time.perf_counter()
+    for i in range(num_keys):
+        # Distinct value objects, as values decoded from requests would be
+        put(f"key_{i}", f"{i:0{VALUE_SIZE}d}", i + 1)
+    insert_elapsed = time.perf_counter() - start_time
+    # ru_maxrss is in KiB on Linux; the peak includes table and arena growth
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    settled_rss = current_rss_bytes()
+
+    keys = [f"key_{rng.randrange(num_keys)}" for _ in range(NUM_OPS)]
+    start_time = time.perf_counter()
+    for key in keys:
+        get(key)
+    get_elapsed = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for i, key in enumerate(keys):
+        put(key, f"{i:0{VALUE_SIZE}d}", num_keys + i + 1)
+    overwrite_elapsed = time.perf_counter() - start_time
+
+    results.put({
+        "scope": scope,
+        "engine": engine_name,
+        "keys": num_keys,
+        "bytes_per_key": (settled_rss - baseline_rss) / num_keys,
+        "peak_mb": (peak_rss - baseline_rss) / 2 ** 20,
+        "insert_ops": num_keys / insert_elapsed,
+        "get_ops": NUM_OPS / get_elapsed,
+        "overwrite_ops": NUM_OPS / overwrite_elapsed,
+    })
+
+
+def measure(scope: str, engine_name: str, num_keys: int) -> Dict:
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_engine, args=(scope, engine_name, num_keys, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print("=" * 88)
+    print("Storage Engine Benchmark")
+    print("=" * 88)
+    print(f"Keys like 'key_123', {VALUE_SIZE}B values, {NUM_OPS} random gets and overwrites")
+    print("-" * 88)
+    print(f"{'Scope':<7} {'Engine':<9} {'Keys':<11} {'B/key':<8} {'Peak MB':<9} {'Insert/s':<11} "
+          f"{'Get/s':<11} {'Overwrite/s':<11}")
+    print("-" * 88)
+    for num_keys in sizes:
+        for scope in SCOPES:
+            for engine_name in ("dict", "compact"):
+                r = measure(scope, engine_name, num_keys)
+                print(f"{r['scope']:<7} {r['engine']:<9} {r['keys']:<11} {r['bytes_per_key']:<8.0f} "
+                      f"{r['peak_mb']:<9.0f} {r['insert_ops']:<11.0f} {r['get_ops']:<11.0f} "
+                      f"{r['overwrite_ops']:<11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Server-sent event change feed for watchers. Each worker pulls changes from the store's
+change log into one shared buffer of events encoded once as SSE frames; every subscriber
+only keeps a position in that buffer, so fan-out costs no per-subscriber copy or encoding.
+
+An event's id is "<epoch>-<seq>": its position in the node's change log, in the order the
+node applied changes. Resuming after an id is therefore exact on every node, including a
+follower that applies replicated writes out of version order. The epoch belongs to the
+store, so an id from another node or an earlier run is recognized instead of misread.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+PULL_BATCH = 1000
+KEEPALIVE_S = 15.0
+
+
+class ChangeEvent:
+    __slots__ = ("seq", "version", "key", "frame")
+
+    def __init__(self, epoch: str, seq: int, version: int, key: str, value: Optional[str]):
+        self.seq = seq
+        self.version = version
+        self.key = key
+        data = {"op": "set" if value is not None else "delete", "key": key, "value": value, "version": version}
+        self.frame = f"id: {epoch}-{seq}\nevent: change\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def parse_event_id(event_id: str) -> Tuple[str, int]:
+    """(epoch, seq) of an event id; ValueError if it is not one."""
+    epoch, separator, seq = event_id.partition("-")
+    if not separator or not epoch:
+        raise ValueError(f"Not an event id: {event_id!r}")
+    return epoch, int(seq)
+
+
+def reset_frame(reason: str, **details) -> bytes:
+    """Tells a watcher it missed changes and has to re-read (e.g. with /scan) before continuing."""
+    return f"event: reset\ndata: {json.dumps({'reason': reason, **details})}\n\n".encode()
+
+
+class ChangeFeed:
+    def __init__(self, store, capacity: int = 10000, poll_interval: float = 0.01):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.events: Deque[ChangeEvent] = deque(maxlen=capacity)
+        self.last_seq = 0
+        self.epoch: Optional[str] = None
+        # True while the buffer still holds every change since the node started
+        self.complete = True
+        self.subscribers = 0
+        self.pump_task: Optional[asyncio.Task] = None
+        self.new_events = asyncio.Event()
+        self.synced = asyncio.Event()
+
+    def _append(self, event: ChangeEvent):
+        if len(self.events) == self.events.maxlen:
+            self.complete = False
+        self.events.append(event)
+
+    async def _pump(self):
+        """Pull new changes from the store while anyone is watching."""
+        try:
+            while self.subscribers > 0:
+                changes, oldest_seq, self.epoch = await self.store.changes_since(self.last_seq, PULL_BATCH)
+                if oldest_seq > self.last_seq + 1:
+                    # The store dropped changes this worker never saw: start over from what it has
+                    self.events.clear()
+                    self.complete = False
+                for seq, version, key, value in changes:
+                    self._append(ChangeEvent(self.epoch, seq, version, key, value))
+                    self.last_seq = seq
+                if changes:
+                    self.new_events.set()
+                    self.new_events = asyncio.Event()
+                self.synced.set()
+                if len(changes) < PULL_BATCH:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            self.pump_task = None
+
+    def _start(self):
+        self.subscribers += 1
+        if self.pump_task is None:
+            # The buffer is stale while nobody was watching: new subscribers wait for a fresh pull
+            self.synced.clear()
+            self.pump_task = asyncio.create_task(self._pump())
+
+    def _position(self, seq: int) -> int:
+        """Index in the buffer of the first event after `seq`, -1 if it was already dropped."""
+        if not self.events:
+            return 0
+        index = seq + 1 - self.events[0].seq
+        return index if index >= 0 else -1
+
+    async def subscribe(self, prefix: str = "", from_version: Optional[int] = None,
+                        after_event: Optional[Tuple[str, int]] = None) -> AsyncIterator[bytes]:
+        """
+        SSE stream of changes to keys starting with `prefix`. With `after_event`, the parsed id
+        of the last event a watcher saw, it first replays the buffered changes applied after
+        that one. `from_version` replays from the first buffered change newer than a version,
+        which is exact only on the leader, where changes are applied in version order. Either
+        sends a reset event instead if some of the changes are no longer buffered.
+        """
+        self._start()
+        try:
+            # Wait for the first pull from the store before deciding what to replay
+            await self.synced.wait()
+            yield b": connected\n\n"
+            position = len(self.events)
+            if after_event is not None:
+                epoch, seq = after_event
+                if epoch != self.epoch or seq > self.last_seq:
+                    yield reset_frame("unknown_event_id")
+                elif seq < self.last_seq and (not self.events or self.events[0].seq > seq + 1):
+                    oldest = self.events[0].version if self.events else None
+                    yield reset_frame("history_truncated", oldest_version=oldest)
+                else:
+                    position = seq + 1 - self.events[0].seq if self.events else 0
+            elif from_version is not None:
+                if not self.complete and (not self.events or self.events[0].version > from_version + 1):
+                    oldest = self.events[0].version if self.events else None
+                    yield reset_frame("history_truncated", oldest_version=oldest)
+                else:
+                    position = next((i for i, event in enumerate(self.events) if event.version > from_version),
+                                    len(self.events))
+            next_seq = self.events[position].seq if position < len(self.events) else self.last_seq + 1
+            while True:
+                events = self.events
+                start = self._position(next_seq - 1)
+                if start < 0:
+                    # Fell behind the buffer: the missed changes are gone
+                    yield reset_frame("watcher_too_slow")
+                    start = 0
+                end = len(events)
+                # New events sit at the right end of the deque, where indexing is cheap
+                frames = []
+                for index in range(start, end):
+                    event = events[index]
+                    if event.key.startswith(prefix):
+                        frames.append(event.frame)
+                if end > start:
+                    next_seq = events[end - 1].seq + 1
+                if frames:
+                    yield b"".join(frames)
+                    continue
+                try:
+                    await asyncio.wait_for(self.new_events.wait(), timeout=KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            self.subscribers -= 1
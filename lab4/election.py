@@ -0,0 +1,128 @@
+"""
+Leader election among followers, in the style of Raft. Every node keeps a term that only
+grows; the leader sends its term with each heartbeat and replication message, and nodes
+refuse messages from a term that is over.
+
+A follower that hears no heartbeat for a randomized election timeout becomes a candidate:
+it moves to the next term, votes for itself and asks its peers for votes. A peer grants one
+vote per term, and only to a candidate that has applied at least as much of the log as
+itself. With votes from a majority of the whole cluster (the old leader included) the
+candidate pulls the writes it is missing from the other followers, then takes over as
+leader. Split votes are resolved by the randomized timeouts of the next round.
+
+The writes are pulled from the peers' change logs, which keep the last MAX_CHANGE_LOG
+changes. A candidate further behind a peer than that cannot learn every write it is missing,
+and taking over would make its anti-entropy delete the rest from the followers. It stands
+down instead, and the peer that is ahead wins a later round.
+
+A write acknowledged by the old leader is on WRITE_QUORUM followers; it survives the
+failover as long as WRITE_QUORUM plus a majority is more than the number of followers, so
+at least one voter holds it.
+"""
+import asyncio
+import random
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+
+class Election:
+    def __init__(self, store, node_id: str, node_url: str, peers: Sequence[str], timeout_s: float):
+        self.store = store
+        self.node_id = node_id
+        self.node_url = node_url
+        self.peers = list(peers)
+        self.timeout_s = timeout_s
+        # The peers, this node and the old leader
+        self.majority = (len(self.peers) + 2) // 2 + 1
+        self.client: Optional[httpx.AsyncClient] = None
+        self.elections = 0
+        self.won = 0
+
+    def election_timeout(self) -> float:
+        """Randomized per round, so followers rarely stand at the same time."""
+        return random.uniform(self.timeout_s, 2 * self.timeout_s)
+
+    async def start(self):
+        self.client = httpx.AsyncClient(timeout=self.timeout_s)
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+
+    async def tick(self) -> bool:
+        """Stand for election if the leader has gone quiet; True if this node won."""
+        started = await self.store.begin_election(self.node_id, self.election_timeout())
+        if started is None:
+            return False
+        term, applied_index = started
+        self.elections += 1
+        print(f"{self.node_id}: leader silent, standing for term {term} at index {applied_index}")
+        if not await self._win_votes(term, applied_index):
+            return False
+        last_version = await self._catch_up(applied_index)
+        if last_version is None:
+            print(f"{self.node_id}: a peer's change log no longer covers index {applied_index}, "
+                  f"standing down in term {term}")
+            return False
+        if not await self.store.promote(term, self.node_url, last_version):
+            return False
+        self.won += 1
+        print(f"{self.node_id}: elected leader of term {term}, versions continue after {last_version}")
+        return True
+
+    async def _win_votes(self, term: int, applied_index: int) -> bool:
+        async def ask(peer: str) -> bool:
+            try:
+                response = await self.client.post(f"{peer}/vote", json={
+                    "term": term, "candidate_id": self.node_id, "applied_index": applied_index
+                })
+                reply = response.json()
+            except (httpx.HTTPError, ValueError):
+                return False
+            if reply["term"] > term:
+                # Someone is ahead: stop standing in a term that is over
+                await self.store.observe_term(reply["term"])
+            return reply["granted"]
+
+        votes = 1
+        requests = [asyncio.create_task(ask(peer)) for peer in self.peers]
+        try:
+            for request in asyncio.as_completed(requests):
+                votes += await request
+                if votes >= self.majority:
+                    return True
+        finally:
+            for request in requests:
+                request.cancel()
+        return False
+
+    async def _catch_up(self, applied_index: int) -> Optional[int]:
+        """
+        Apply the writes other followers hold above this node's applied index. Returns the
+        highest version any of them has applied, or None without applying anything if a
+        follower has dropped some of those writes from its change log.
+        """
+        async def fetch(peer: str) -> Optional[Dict]:
+            try:
+                response = await self.client.get(f"{peer}/replication/entries",
+                                                 params={"after_version": applied_index})
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPError, ValueError):
+                return None
+
+        replies = [reply for reply in await asyncio.gather(*(fetch(peer) for peer in self.peers)) if reply]
+        if not all(reply["complete"] for reply in replies):
+            return None
+        items: List = [
+            (item["key"], item["value"], item["version"], [], item["expires_at"])
+            for reply in replies for item in reply["items"]
+        ]
+        if items:
+            # Older versions of a key from one peer are ignored once a newer one is applied
+            await self.store.apply_many(items)
+        return max([reply["last_version"] for reply in replies], default=0)
+
+    def snapshot(self) -> Dict:
+        return {"peers": self.peers, "majority": self.majority, "elections": self.elections, "won": self.won}
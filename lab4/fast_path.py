@@ -0,0 +1,151 @@
+"""
+Lean request handling for the hot endpoints: writes, replication and reads. The body is
+decoded with orjson and checked against the endpoint's Pydantic model field by field, and
+the response is encoded straight to bytes, skipping model construction, FastAPI's
+dependency solving and `jsonable_encoder`. The models stay the one definition of each
+request: the lean parser reads their fields, types and defaults.
+
+Selected with FAST_PATH=true. The lean routes are put ahead of the Pydantic endpoints for
+the same paths, which keep serving when it is off and still appear in the OpenAPI docs.
+A value of the field's own JSON type is taken as is. Any other scalar goes through
+Pydantic's validator for the field type, so lax coercions ("5" or 5.0 for an int) and
+the errors match the Pydantic endpoints. Malformed requests get the same 422 shape,
+{"detail": [errors]}.
+"""
+import typing
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import orjson
+from fastapi import FastAPI, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from starlette.routing import Route
+
+JSON_HEADERS = {"content-type": "application/json"}
+# Field name -> (JSON type, element type or model for lists/models, nullable, required, default)
+FieldSpec = Tuple[type, Any, bool, bool, Any]
+JSON_TYPE_NAMES = {str: "string", int: "int", float: "float", bool: "bool", list: "list", dict: "dict"}
+
+_specs: Dict[Type[BaseModel], Dict[str, FieldSpec]] = {}
+# Pydantic's lax validators for the scalar field types, used when a value is not of the exact type
+_scalar_adapters: Dict[type, TypeAdapter] = {kind: TypeAdapter(kind) for kind in (str, int, float, bool)}
+
+
+def field_specs(model: Type[BaseModel]) -> Dict[str, FieldSpec]:
+    specs = _specs.get(model)
+    if specs is None:
+        specs = _specs[model] = {}
+        for name, field in model.model_fields.items():
+            annotation, nullable = field.annotation, False
+            if typing.get_origin(annotation) is typing.Union:
+                args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+                annotation, nullable = args[0], True
+            origin = typing.get_origin(annotation)
+            if origin is list:
+                kind, element = list, typing.get_args(annotation)[0]
+            elif origin is dict:
+                kind, element = dict, typing.get_args(annotation)[1]
+            elif isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                kind, element = dict, annotation
+            else:
+                kind, element = annotation, None
+            specs[name] = (kind, element, nullable, field.is_required(),
+                           None if field.is_required() else field.get_default(call_default_factory=True))
+    return specs
+
+
+def type_error(loc: List, kind: type, value: Any) -> Dict:
+    name = JSON_TYPE_NAMES.get(kind, kind.__name__)
+    return {"type": f"{name}_type", "loc": loc, "msg": f"Input should be a valid {name}", "input": value}
+
+
+def coerce_scalar(value: Any, kind: type, loc: List, errors: List[Dict]) -> Any:
+    """`value` converted to `kind` as Pydantic's lax mode does, else record Pydantic's errors."""
+    try:
+        return _scalar_adapters[kind].validate_python(value)
+    except ValidationError as e:
+        errors.extend({"type": error["type"], "loc": loc, "msg": error["msg"], "input": value}
+                      for error in e.errors())
+        return None
+
+
+def check_value(value: Any, kind: type, element: Any, loc: List, errors: List[Dict]) -> Any:
+    """
+    `value` if it has the JSON type `kind`, a scalar coerced like Pydantic does, or lists and
+    dicts checked per element; otherwise record an error.
+    """
+    if isinstance(element, type) and issubclass(element, BaseModel):
+        if kind is dict:
+            return parse_object(element, value, loc, errors)
+        if not isinstance(value, list):
+            errors.append(type_error(loc, list, value))
+            return None
+        return [parse_object(element, item, loc + [i], errors) for i, item in enumerate(value)]
+    if kind is float:
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif kind is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        ok = isinstance(value, kind)
+    if not ok:
+        if kind in _scalar_adapters:
+            return coerce_scalar(value, kind, loc, errors)
+        errors.append(type_error(loc, kind, value))
+        return None
+    if element is not None:
+        if kind is dict:
+            return {key: check_value(item, element, None, loc + [key], errors) for key, item in value.items()}
+        return [check_value(item, element, None, loc + [index], errors) for index, item in enumerate(value)]
+    return value
+
+
+def parse_object(model: Type[BaseModel], data: Any, loc: List, errors: List[Dict]) -> Optional[Dict]:
+    if not isinstance(data, dict):
+        errors.append({"type": "model_attributes_type", "loc": loc, "msg": "Input should be a valid dictionary",
+                       "input": data})
+        return None
+    fields = {}
+    for name, (kind, element, nullable, required, default) in field_specs(model).items():
+        if name not in data:
+            if required:
+                errors.append({"type": "missing", "loc": loc + [name], "msg": "Field required", "input": data})
+            fields[name] = default
+            continue
+        value = data[name]
+        fields[name] = value if value is None and nullable else check_value(value, kind, element, loc + [name], errors)
+    return fields
+
+
+def parse_body(model: Type[BaseModel], body: bytes) -> Dict:
+    """The fields of `model` from a JSON body as a dict, nested models as dicts too; 422 if invalid."""
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ["body", 0], "msg": "JSON decode error",
+                                       "input": {}, "ctx": {"error": str(e)}}])
+    errors: List[Dict] = []
+    fields = parse_object(model, data, ["body"], errors)
+    if errors:
+        raise RequestValidationError(errors)
+    return fields
+
+
+def query_param(request: Request, name: str, kind: type) -> Optional[Any]:
+    """An optional int or float query parameter, parsed as Pydantic does; 422 if it does not parse."""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    errors: List[Dict] = []
+    parsed = coerce_scalar(value, kind, ["query", name], errors)
+    if errors:
+        raise RequestValidationError(errors)
+    return parsed
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    return Response(orjson.dumps(content), status_code=status_code, media_type="application/json")
+
+
+def install(app: FastAPI, routes: List[Tuple[str, str, Callable]]):
+    """Serve (path, method, handler) ahead of the FastAPI endpoints for the same path and method."""
+    app.router.routes[:0] = [Route(path, handler, methods=[method]) for path, method, handler in routes]
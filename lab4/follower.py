@@ -1,31 +1,204 @@
 import os
 import uuid
-import random
-from typing import Dict
-from fastapi import FastAPI, HTTPException
+import time
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
+import orjson
 
-app = FastAPI()
+import fast_path
+from change_feed import ChangeFeed, parse_event_id
+from election import Election
+from key_locks import KeyLocks
+from kvstore import export_ndjson, open_store, start_store_owner
+from metrics import (CONTENT_TYPE, Registry, RequestMetrics, add_runtime_metrics, publish_periodically,
+                     render_workers, start_monitor)
+from network_model import NetworkModel, parse_delay, partition_windows
+from replication_stream import serve_replication
+from write_path import BatchWriteRequest, WritePath, WritePathConfig, WriteRequest
 
-store: Dict[str, str] = {}
-store_lock = asyncio.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await store.connect()
+    monitor = start_monitor(loop_lag, LOOP_LAG_INTERVAL_MS)
+    publisher = asyncio.create_task(publish_periodically(store, registries))
+    replication_server = None
+    if REPL_PORT:
+        replication_server = await serve_replication(REPL_PORT, apply_replicated)
+    election_task = None
+    if election:
+        await election.start()
+        election_task = asyncio.create_task(election_loop())
+    yield
+    publisher.cancel()
+    if election_task:
+        election_task.cancel()
+        await election.close()
+    if write_path:
+        await write_path.stop()
+    if replication_server:
+        replication_server.close()
+    if monitor:
+        monitor.cancel()
+    await store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 FOLLOWER_PORT = int(os.getenv("FOLLOWER_PORT", "8001"))
 FOLLOWER_ID = os.getenv("FOLLOWER_ID", "follower1")
 MIN_DELAY_MS = int(os.getenv("MIN_DELAY_MS", "0"))
 MAX_DELAY_MS = int(os.getenv("MAX_DELAY_MS", "1000"))
+MERKLE_DEPTH = int(os.getenv("MERKLE_DEPTH", "10"))
+# "dict" or "compact", see storage.py
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "dict")
+LEADER_URL = os.getenv("LEADER_URL", "")
+READ_WAIT_MS = int(os.getenv("READ_WAIT_MS", "200"))
+MAX_SCAN_LIMIT = int(os.getenv("MAX_SCAN_LIMIT", "10000"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+WATCH_BUFFER_SIZE = int(os.getenv("WATCH_BUFFER_SIZE", "10000"))
+WATCH_POLL_MS = int(os.getenv("WATCH_POLL_MS", "10"))
+# Port of the binary replication stream, 0 disables it
+REPL_PORT = int(os.getenv("REPL_PORT", "0"))
+# Address clients and peers reach this follower at, announced if it is elected leader
+FOLLOWER_URL = os.getenv("FOLLOWER_URL", f"http://localhost:{FOLLOWER_PORT}")
+# The other followers; with none set this follower never stands for election
+PEERS = [peer.strip() for peer in os.getenv("PEERS", "").split(",") if peer.strip()]
+# Leader silence before an election, randomized up to twice this
+ELECTION_TIMEOUT_MS = int(os.getenv("ELECTION_TIMEOUT_MS", "1000"))
+# Delay distribution of messages from the leader, see network_model.py
+DELAY_MODEL = os.getenv("DELAY_MODEL", f"uniform:{MIN_DELAY_MS}:{MAX_DELAY_MS}")
+# Fraction of messages from the leader that are lost
+LOSS_RATE = float(os.getenv("LOSS_RATE", "0"))
+# How long a lost message keeps the leader waiting before it fails
+LOSS_TIMEOUT_MS = int(os.getenv("LOSS_TIMEOUT_MS", "1000"))
+# "START:DURATION,..." in seconds after startup during which the leader cannot reach us
+PARTITIONS = os.getenv("PARTITIONS", "")
+# How often the event-loop lag metric samples the loop, 0 disables it
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+# Serve reads and replication without Pydantic (see fast_path.py)
+FAST_PATH = os.getenv("FAST_PATH", "true").lower() == "true"
+# Write path settings once elected, as the leader's (WRITE_QUORUM only until a heartbeat names one)
+WRITE_PATH_CONFIG = WritePathConfig()
+
+network = NetworkModel(DELAY_MODEL, LOSS_RATE, LOSS_TIMEOUT_MS, partition_windows(PARTITIONS, time.time()))
+
+metrics = Registry()
+app.add_middleware(RequestMetrics, registry=metrics)
+loop_lag = add_runtime_metrics(metrics)
+lock_wait = metrics.histogram("kv_lock_wait_seconds", "Time writes waited for their key locks")
+apply_latency = metrics.histogram("kv_replication_apply_seconds",
+                                  "Time to apply a replication message once it arrived, lock wait included")
+metrics.counter("kv_network_messages_total", "Messages from the leader by what the network model did with them",
+                lambda: {("delivered",): network.messages - network.lost - network.partitioned,
+                         ("lost",): network.lost, ("partitioned",): network.partitioned},
+                ("outcome",))
+
+
+def initial_config() -> Dict:
+    return {"network": network.settings()}
+
+
+# With several workers the store and the network settings live in a shared owner process
+store = open_store(MERKLE_DEPTH, initial_config(), STORAGE_ENGINE)
+key_locks = KeyLocks(on_wait=lock_wait.observe)
+change_feed = ChangeFeed(store, WATCH_BUFFER_SIZE, WATCH_POLL_MS / 1000.0)
+# Pulsed whenever this worker advances the applied index, to wake waiting reads
+index_advanced = asyncio.Event()
+election = Election(store, FOLLOWER_ID, FOLLOWER_URL, PEERS, ELECTION_TIMEOUT_MS / 1000.0) if PEERS else None
+# The write path while this worker serves writes as the elected leader, otherwise None
+write_path: Optional[WritePath] = None
 
 print(f"Follower {FOLLOWER_ID} initialized on port {FOLLOWER_PORT}")
-print(f"Delay range: [{MIN_DELAY_MS}ms, {MAX_DELAY_MS}ms]")
+print(f"Network: delay {DELAY_MODEL}, loss rate {LOSS_RATE}, partitions {PARTITIONS or 'none'}")
+
+
+def apply_config(config: Dict):
+    network.configure(config["network"])
+
+
+store.on_config(apply_config)
+
 
 class ReplicateRequest(BaseModel):
     key: str
-    value: str
+    # None deletes the key (an expiration)
+    value: Optional[str]
+    version: int
+    # Older versions of the key the leader coalesced into this write
+    superseded: List[int] = []
+    # Absolute expiry time set by the leader, 0 for none
+    expires_at: float = 0.0
+    # Election term of the sending leader
+    term: int = 0
+
+
+class ReplicateBatchRequest(BaseModel):
+    items: List[ReplicateRequest]
+    term: int = 0
+
+
+class MultiGetRequest(BaseModel):
+    keys: List[str]
+
+
+class RepairRequest(BaseModel):
+    entries: Dict[str, str]
+    versions: Dict[str, int] = {}
+    sync_index: int = 0
+    # Keys the leader no longer has -> leader index at which they were gone
+    deletes: Dict[str, int] = {}
+    # Term of the repairing leader; None for a manual repair
+    term: Optional[int] = None
+
+
+class HeartbeatRequest(BaseModel):
+    commit_index: int
+    sent_at: float
+    term: int = 0
+    leader_url: Optional[str] = None
+    write_quorum: Optional[int] = None
+
+
+class VoteRequest(BaseModel):
+    term: int
+    candidate_id: str
+    applied_index: int
+
+
+class MerkleNodesRequest(BaseModel):
+    level: int
+    indices: List[int]
+
+
+class MerkleBucketsRequest(BaseModel):
+    indices: List[int]
+    # Nodes of a level below the leaf buckets; None for the leaf buckets themselves
+    level: Optional[int] = None
+
+
+class NetworkConfigRequest(BaseModel):
+    delay: Optional[str] = None
+    loss_rate: Optional[float] = None
+    timeout_ms: Optional[int] = None
+    # Cut this follower off from the leader for this long from now; 0 heals every partition
+    partition_ms: Optional[int] = None
+
 
 @app.get("/")
 async def root():
-    return {"role": "follower", "id": FOLLOWER_ID}
+    state = await store.election_state()
+    return {
+        "role": state["role"],
+        "id": FOLLOWER_ID,
+        "replication_port": REPL_PORT or None,
+        "term": state["term"],
+        "leader_url": state["leader_url"]
+    }
 
 
 @app.get("/health")
@@ -33,40 +206,424 @@ async def health():
     return {"status": "healthy", "role": "follower", "id": FOLLOWER_ID}
 
 
+@app.get("/storage")
+async def storage_stats():
+    return {"role": "follower", "id": FOLLOWER_ID, "engine": STORAGE_ENGINE, **(await store.storage_stats())}
+
+
+async def wait_for_index(min_version: int) -> bool:
+    deadline = time.monotonic() + READ_WAIT_MS / 1000.0
+    while (await store.replication_status())["applied_index"] < min_version:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        # Other workers apply writes too, so poll as well as waiting for a local pulse
+        try:
+            await asyncio.wait_for(index_advanced.wait(), timeout=min(remaining, 0.01))
+        except asyncio.TimeoutError:
+            pass
+    return True
+
+
+def pulse_index_advanced():
+    index_advanced.set()
+    index_advanced.clear()
+
+
+def redirect_to_leader(path: str, reason: str):
+    if not LEADER_URL:
+        raise HTTPException(status_code=503, detail=f"{reason} and no leader URL configured")
+    # 307 keeps the method and body, so batch reads are replayed on the leader as-is
+    return RedirectResponse(url=f"{LEADER_URL}{path}", status_code=307)
+
+
+async def check_freshness(path: str, min_version: Optional[int], max_staleness_ms: Optional[float]):
+    """Return a redirect to the leader if this follower cannot meet the read's freshness bounds."""
+    if write_path:
+        return None
+    if min_version is not None and not await wait_for_index(min_version):
+        return redirect_to_leader(path, f"Follower has not applied version {min_version}")
+    if max_staleness_ms is not None:
+        staleness_ms = (await store.replication_status())["staleness_ms"]
+        if staleness_ms is None or staleness_ms > max_staleness_ms:
+            return redirect_to_leader(path, f"Follower staler than {max_staleness_ms}ms")
+    return None
+
+
+async def read_entry(key: str) -> Dict:
+    entry = await store.get(key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    value, version = entry
+    return {"key": key, "value": value, "version": version}
+
+
 @app.get("/keys/{key}")
-async def read(key: str):
-    async with store_lock:
-        if key in store:
-            return {"key": key, "value": store[key]}
-        else:
-            raise HTTPException(status_code=404, detail="Key not found")
+async def read(key: str, min_version: Optional[int] = None, max_staleness_ms: Optional[float] = None):
+    redirect = await check_freshness(f"/keys/{key}", min_version, max_staleness_ms)
+    if redirect:
+        return redirect
+    return await read_entry(key)
+
+
+async def lean_read(request: Request) -> Response:
+    key = request.path_params["key"]
+    redirect = await check_freshness(f"/keys/{key}", fast_path.query_param(request, "min_version", int),
+                                     fast_path.query_param(request, "max_staleness_ms", float))
+    if redirect:
+        return redirect
+    return fast_path.json_response(await read_entry(key))
+
+
+@app.post("/keys/mget")
+async def read_many(request: MultiGetRequest, min_version: Optional[int] = None,
+                    max_staleness_ms: Optional[float] = None):
+    redirect = await check_freshness("/keys/mget", min_version, max_staleness_ms)
+    if redirect:
+        return redirect
+    entries = await store.get_many(request.keys)
+    return {
+        "items": {key: {"value": value, "version": version} for key, (value, version) in entries.items()},
+        "missing": [key for key in request.keys if key not in entries]
+    }
+
+
+def check_scan_limit(limit: int):
+    if limit < 1 or limit > MAX_SCAN_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_SCAN_LIMIT}")
 
 
 @app.get("/keys")
-async def list_keys():
-    return {"keys": list(store.keys())}
+async def list_keys(prefix: str = "", start_after: Optional[str] = None, limit: int = 1000):
+    """One page of keys in order; pass `next_start_after` back as `start_after` for the next page."""
+    check_scan_limit(limit)
+    keys, next_start_after = await store.scan_keys(prefix, start_after, limit)
+    return {"keys": keys, "next_start_after": next_start_after}
+
+
+@app.get("/scan")
+async def scan(request: Request, prefix: str = "", start: Optional[str] = None, end: Optional[str] = None,
+               start_after: Optional[str] = None, limit: int = 1000, min_version: Optional[int] = None,
+               max_staleness_ms: Optional[float] = None):
+    """Key/value pairs in key order, from `start` (inclusive) to `end` (exclusive)."""
+    check_scan_limit(limit)
+    redirect = await check_freshness(f"/scan?{request.url.query}", min_version, max_staleness_ms)
+    if redirect:
+        return redirect
+    entries, next_start_after = await store.scan(prefix, start, start_after, end, limit)
+    return {
+        "items": [
+            {"key": key, "value": value, "version": version, "expires_at": expires_at or None}
+            for key, value, version, expires_at in entries
+        ],
+        "next_start_after": next_start_after
+    }
+
+
+async def stale_term() -> HTTPException:
+    """Refusal for a leader whose term is over, naming the current term and leader."""
+    state = await store.election_state()
+    return HTTPException(
+        status_code=409,
+        detail={"error": "Stale term", "term": state["term"], "leader_url": state["leader_url"]}
+    )
+
+
+async def cross_network(delayed: bool = True):
+    """Hold a message from the leader for its network delay, or fail it as lost or partitioned."""
+    fault = network.fault()
+    if fault:
+        # The leader only finds out when its request times out
+        await asyncio.sleep(network.timeout_s)
+        raise HTTPException(status_code=504, detail=f"Message {fault} by the network model")
+    if delayed:
+        await asyncio.sleep(network.delay())
+
+
+async def apply_replicated(items: List[Tuple[str, Optional[str], int, List[int], float]], term: int) -> int:
+    """Apply one replication message from the leader, whichever transport carried it."""
+    await cross_network()
+    
+    start_time = time.perf_counter()
+    async with key_locks.many([item[0] for item in items]):
+        applied = await store.apply_from(term, items)
+    apply_latency.observe(time.perf_counter() - start_time)
+    if applied is None:
+        raise await stale_term()
+    pulse_index_advanced()
+    return applied
 
 
 @app.post("/replicate")
 async def replicate(request: ReplicateRequest):
-    delay_ms = random.uniform(MIN_DELAY_MS, MAX_DELAY_MS)
-    delay_seconds = delay_ms / 1000.0
-    await asyncio.sleep(delay_seconds)
-    
-    async with store_lock:
-        store[request.key] = request.value
-    return {"status": "replicated"}
+    applied = await apply_replicated([(request.key, request.value, request.version, request.superseded,
+                                       request.expires_at)], request.term)
+    return {"status": "replicated", "applied": applied == 1}
+
+
+@app.post("/replicate/batch")
+async def replicate_batch(request: ReplicateBatchRequest):
+    applied = await apply_replicated([(item.key, item.value, item.version, item.superseded, item.expires_at)
+                                      for item in request.items], request.term)
+    return {"status": "replicated", "applied": applied}
+
+
+# Response bodies of /replicate, by whether the write was applied
+REPLICATED = {applied: orjson.dumps({"status": "replicated", "applied": applied}) for applied in (True, False)}
+
+
+async def lean_replicate(request: Request) -> Response:
+    item = fast_path.parse_body(ReplicateRequest, await request.body())
+    applied = await apply_replicated([(item["key"], item["value"], item["version"], item["superseded"],
+                                       item["expires_at"])], item["term"])
+    return Response(REPLICATED[applied == 1], media_type="application/json")
+
+
+async def lean_replicate_batch(request: Request) -> Response:
+    batch = fast_path.parse_body(ReplicateBatchRequest, await request.body())
+    applied = await apply_replicated([(item["key"], item["value"], item["version"], item["superseded"],
+                                       item["expires_at"]) for item in batch["items"]], batch["term"])
+    return fast_path.json_response({"status": "replicated", "applied": applied})
+
+
+@app.post("/repair")
+async def repair(request: RepairRequest):
+    await cross_network()
+
+    if request.term is not None and not await store.observe_term(request.term):
+        raise await stale_term()
+    repaired = await store.repair(request.entries, request.versions, request.sync_index, request.deletes)
+    pulse_index_advanced()
+    return {"status": "repaired", "keys": repaired}
+
+
+def election_timeout() -> float:
+    return election.election_timeout() if election else ELECTION_TIMEOUT_MS / 1000.0
+
+
+@app.post("/heartbeat")
+async def heartbeat(request: HeartbeatRequest):
+    # Heartbeats are lost and partitioned like other messages, but not delayed
+    await cross_network(delayed=False)
+    if not await store.follow_leader(request.term, request.leader_url, request.write_quorum, election_timeout()):
+        raise await stale_term()
+    await store.observe_leader(request.commit_index, request.sent_at)
+    return {"status": "ok"}
+
+
+@app.get("/config/network")
+async def get_network():
+    """Network model settings, and message counts as seen by this worker."""
+    return {"id": FOLLOWER_ID, **network.snapshot()}
+
+
+@app.post("/config/network")
+async def update_network(request: NetworkConfigRequest):
+    settings = network.settings()
+    if request.delay is not None:
+        try:
+            parse_delay(request.delay)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        settings["delay"] = request.delay
+    if request.loss_rate is not None:
+        if not 0 <= request.loss_rate <= 1:
+            raise HTTPException(status_code=400, detail="Loss rate must be between 0 and 1")
+        settings["loss_rate"] = request.loss_rate
+    if request.timeout_ms is not None:
+        if request.timeout_ms < 0:
+            raise HTTPException(status_code=400, detail="Timeout must not be negative")
+        settings["timeout_ms"] = request.timeout_ms
+    if request.partition_ms is not None:
+        now = time.time()
+        if request.partition_ms > 0:
+            # Windows that are over are dropped as new ones come in
+            settings["partitions"] = [window for window in settings["partitions"] if window[1] > now]
+            settings["partitions"].append([now, now + request.partition_ms / 1000.0])
+        else:
+            settings["partitions"] = []
+    # Broadcast through the store so every worker uses the new settings
+    await store.set_config("network", settings)
+    return {"status": "updated", "id": FOLLOWER_ID, **network.settings()}
+
+
+@app.get("/replication")
+async def replication_status():
+    status = await store.replication_status()
+    state = await store.election_state()
+    return {"role": state["role"], "id": FOLLOWER_ID, "term": state["term"], "leader_url": state["leader_url"],
+            "voted_for": state["voted_for"], **status, **({"election": election.snapshot()} if election else {})}
+
+
+def registries() -> List[Registry]:
+    return [metrics, write_path.metrics] if write_path else [metrics]
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of this node summed over its workers, with the leader's write path once elected."""
+    return Response(await render_workers(store, registries()), media_type=CONTENT_TYPE)
+
+
+@app.get("/replication/entries")
+async def replication_entries(after_version: int):
+    """Entries this node changed above a version, pulled by a newly elected leader."""
+    entries, last_version, complete = await store.entries_after(after_version)
+    return {
+        "items": [
+            {"key": key, "value": value, "version": version, "expires_at": expires_at}
+            for key, value, version, expires_at in entries
+        ],
+        "last_version": last_version,
+        # False once changes above after_version fell out of this node's change log
+        "complete": complete
+    }
+
+
+@app.post("/vote")
+async def vote(request: VoteRequest):
+    granted, term = await store.request_vote(request.term, request.candidate_id, request.applied_index,
+                                             ELECTION_TIMEOUT_MS / 1000.0, election_timeout())
+    return {"granted": granted, "term": term}
+
+
+async def sync_role() -> Dict:
+    """
+    Bring this worker in line with the node's election state, which every worker shares
+    through the store: start or stop leading, and point redirects at the current leader.
+    """
+    global write_path, LEADER_URL
+    state = await store.election_state()
+    if state["leader_url"] and state["role"] != "leader":
+        LEADER_URL = state["leader_url"]
+    if state["role"] == "leader" and not write_path:
+        # Writes go to this node's own store and are replicated to the other followers under
+        # the new term
+        write_quorum = max(1, min(state["write_quorum"] or WRITE_PATH_CONFIG.write_quorum, len(PEERS)))
+        write_path = WritePath(store, key_locks, PEERS, FOLLOWER_URL, state["term"], write_quorum,
+                               WRITE_PATH_CONFIG.quorum_mode, WRITE_PATH_CONFIG)
+        await write_path.start()
+        write_path.repair_all_now()
+    elif state["role"] != "leader" and write_path:
+        stopped, write_path = write_path, None
+        await stopped.stop()
+    return state
+
+
+async def election_loop():
+    while True:
+        # Checked ten times per timeout, so an election starts soon after the deadline
+        await asyncio.sleep(ELECTION_TIMEOUT_MS / 10 / 1000.0)
+        try:
+            await election.tick()
+            await sync_role()
+        except Exception as e:
+            print(f"Election error: {e}")
+
+
+async def write_redirect(path: str) -> Optional[RedirectResponse]:
+    """None if this node was elected leader; otherwise a redirect to the current one."""
+    if write_path:
+        return None
+    state = await sync_role()
+    if state["role"] == "leader":
+        return None
+    if election and state["leader_url"] is None:
+        raise HTTPException(status_code=503, detail="Leader election in progress",
+                            headers={"Retry-After": "1"})
+    return redirect_to_leader(path, "Writes go to the leader")
+
+
+@app.post("/keys")
+async def write(request: WriteRequest):
+    return await write_redirect("/keys") or write_path.redirect_if_superseded("/keys") or \
+        await write_path.apply_write(request.key, request.value, request.ttl_ms, request.if_version, request.if_value)
+
+
+@app.post("/keys/batch")
+async def write_batch(request: BatchWriteRequest):
+    return await write_redirect("/keys/batch") or write_path.redirect_if_superseded("/keys/batch") or \
+        await write_path.apply_batch(request)
+
+
+@app.delete("/keys/{key}")
+async def delete(request: Request, key: str, if_version: Optional[int] = None, if_value: Optional[str] = None):
+    path = f"/keys/{key}?{request.url.query}" if request.url.query else f"/keys/{key}"
+    return await write_redirect(path) or write_path.redirect_if_superseded(path) or \
+        await write_path.apply_delete(key, if_version, if_value)
+
+
+@app.get("/merkle")
+async def get_merkle_root():
+    return await store.merkle_root()
+
+
+@app.post("/merkle/nodes")
+async def get_merkle_nodes(request: MerkleNodesRequest):
+    try:
+        hashes = await store.merkle_nodes(request.level, request.indices)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"level": request.level, "hashes": hashes}
+
+
+@app.post("/merkle/buckets")
+async def get_merkle_buckets(request: MerkleBucketsRequest):
+    try:
+        buckets = await store.merkle_buckets(request.indices, request.level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"buckets": buckets}
 
 
 @app.get("/state")
 async def get_state():
-    return {"store": store, "keys_count": len(store), "follower_id": FOLLOWER_ID}
+    snapshot = await store.snapshot()
+    return {"store": snapshot, "keys_count": len(snapshot), "follower_id": FOLLOWER_ID}
+
+
+@app.get("/export")
+async def export():
+    """Full store as NDJSON, streamed from a point-in-time snapshot."""
+    return StreamingResponse(
+        export_ndjson(store, EXPORT_PAGE_SIZE, {"role": "follower", "follower_id": FOLLOWER_ID}),
+        media_type="application/x-ndjson"
+    )
+
+
+def watch_start(after_event: Optional[str]) -> Optional[Tuple[str, int]]:
+    """The id of the last event a watcher saw; a reconnecting EventSource sends it as Last-Event-ID."""
+    if after_event is None:
+        return None
+    try:
+        return parse_event_id(after_event)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Not an event id of this watch stream")
+
+
+@app.get("/watch")
+async def watch(request: Request, prefix: str = "", from_version: Optional[int] = None,
+                after_event: Optional[str] = None):
+    """Server-sent events for every change to keys with `prefix`, optionally replayed after an event or a version."""
+    after = watch_start(request.headers.get("last-event-id", after_event))
+    return StreamingResponse(
+        change_feed.subscribe(prefix, from_version, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+if FAST_PATH:
+    fast_path.install(app, [("/keys/{key}", "GET", lean_read), ("/replicate", "POST", lean_replicate),
+                            ("/replicate/batch", "POST", lean_replicate_batch)])
 
 
 if __name__ == "__main__":
     import uvicorn
     import os
     workers = int(os.getenv("WORKERS", "10"))
+    if workers > 1:
+        start_store_owner(MERKLE_DEPTH, initial_config(), STORAGE_ENGINE)
 
     uvicorn.run("follower:app", host="0.0.0.0", port=FOLLOWER_PORT, workers=workers, loop="asyncio")
 
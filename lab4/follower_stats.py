@@ -0,0 +1,145 @@
+"""
+Per-follower replication latency and failure tracking for the leader.
+Drives latency-aware quorum selection, hedging and temporary ejection of unhealthy followers.
+"""
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 200
+# The p95 is recomputed after this many new latency samples, not on every hedge decision
+P95_REFRESH_SAMPLES = 20
+
+
+class FollowerStats:
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma_latency: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._p95: Optional[float] = None
+        self._samples_since_p95 = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+        self.inflight = 0
+
+    def observe(self, latency: float):
+        self.latencies.append(latency)
+        self._samples_since_p95 += 1
+        # Computed on every sample until the window has enough for a stable estimate
+        if self._samples_since_p95 >= P95_REFRESH_SAMPLES or len(self.latencies) <= P95_REFRESH_SAMPLES:
+            self._p95 = float(np.percentile(self.latencies, 95))
+            self._samples_since_p95 = 0
+
+    def p95(self) -> Optional[float]:
+        return self._p95
+
+    def snapshot(self) -> Dict:
+        p95 = self.p95()
+        return {
+            "ewma_latency_ms": self.ewma_latency * 1000 if self.ewma_latency is not None else None,
+            "p95_latency_ms": p95 * 1000 if p95 is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": self.ejected_until > time.monotonic(),
+            "ejections": self.ejections,
+            "inflight": self.inflight,
+        }
+
+
+class FollowerTracker:
+    """
+    A follower is ejected for `eject_seconds` after `eject_after_failures` consecutive failures.
+    Once that expires one write is let through as a probe: success readmits the follower,
+    failure ejects it again for twice as long.
+    """
+
+    def __init__(self, followers: List[str], eject_after_failures: int = 3, eject_seconds: float = 5.0,
+                 min_hedge_delay: float = 0.005):
+        self.stats: Dict[str, FollowerStats] = {url: FollowerStats(url) for url in followers}
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.min_hedge_delay = min_hedge_delay
+
+    def begin(self, url: str):
+        self.stats[url].inflight += 1
+
+    def end(self, url: str):
+        self.stats[url].inflight -= 1
+
+    def with_capacity(self, max_inflight: int) -> List[str]:
+        """Followers whose replication backlog is below the limit."""
+        return [url for url, stats in self.stats.items() if stats.inflight < max_inflight]
+
+    def record_success(self, url: str, latency: float):
+        stats = self.stats[url]
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.probing = False
+        stats.ejected_until = 0.0
+        stats.observe(latency)
+        if stats.ewma_latency is None:
+            stats.ewma_latency = latency
+        else:
+            stats.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * stats.ewma_latency
+
+    def record_failure(self, url: str):
+        stats = self.stats[url]
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        if stats.probing:
+            stats.probing = False
+            stats.ejections += 1
+            stats.ejected_until = time.monotonic() + self.eject_seconds * 2 ** min(stats.ejections, 6)
+        elif stats.consecutive_failures >= self.eject_after_failures and not stats.ejected_until:
+            stats.ejections += 1
+            stats.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _available(self, stats: FollowerStats, now: float) -> bool:
+        if stats.ejected_until <= now and stats.ejected_until:
+            # Ejection expired: admit exactly one in-flight probe
+            if stats.probing:
+                return False
+            stats.probing = True
+            return True
+        return stats.ejected_until == 0.0
+
+    def candidates(self, quorum: int, max_inflight: int) -> List[str]:
+        """
+        Available followers ordered fastest first (unmeasured followers first, so they get
+        measured). Ejected followers are appended only when needed to reach the quorum.
+        Followers with `max_inflight` replications outstanding are left out entirely.
+        """
+        now = time.monotonic()
+
+        def latency_key(stats: FollowerStats) -> float:
+            return stats.ewma_latency if stats.ewma_latency is not None else 0.0
+
+        with_capacity = [stats for stats in self.stats.values() if stats.inflight < max_inflight]
+        available = sorted(
+            (stats for stats in with_capacity if self._available(stats, now)),
+            key=latency_key
+        )
+        ordered = [stats.url for stats in available]
+        if len(ordered) < quorum:
+            ejected = sorted((stats for stats in with_capacity if stats.url not in ordered),
+                             key=latency_key)
+            ordered.extend(stats.url for stats in ejected[:quorum - len(ordered)])
+        return ordered
+
+    def hedge_delay(self, urls: List[str]) -> Optional[float]:
+        """Time to wait for the selected followers before hedging: the slowest one's p95."""
+        p95s = [self.stats[url].p95() for url in urls]
+        if not p95s or any(p95 is None for p95 in p95s):
+            return None
+        return max(max(p95s), self.min_hedge_delay)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {url: stats.snapshot() for url, stats in self.stats.items()}
@@ -0,0 +1,45 @@
+"""
+Consistent hash ring mapping keys to leader groups. Each group owns `vnodes` points on a
+64-bit ring and every key belongs to the group owning the first point at or after the
+key's hash, so adding a group only takes over about 1/n of the keys from the others.
+"""
+import hashlib
+from bisect import bisect_left
+from typing import Dict, Iterable, List
+
+DEFAULT_VNODES = 128
+RING_SIZE = 2 ** 64
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, groups: Iterable[str], vnodes: int = DEFAULT_VNODES):
+        self.groups: List[str] = sorted(set(groups))
+        if not self.groups:
+            raise ValueError("A hash ring needs at least one group")
+        self.vnodes = vnodes
+        points = sorted((ring_hash(f"{group}#{i}"), group) for group in self.groups for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.owners = [group for _, group in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect_left(self.points, ring_hash(key))
+        return self.owners[index % len(self.points)]
+
+    def with_group(self, group: str) -> "HashRing":
+        return HashRing(self.groups + [group], self.vnodes)
+
+    def without_group(self, group: str) -> "HashRing":
+        return HashRing([name for name in self.groups if name != group], self.vnodes)
+
+    def ownership(self) -> Dict[str, float]:
+        """Fraction of the hash space each group owns."""
+        shares = dict.fromkeys(self.groups, 0)
+        previous = self.points[-1] - RING_SIZE
+        for point, group in zip(self.points, self.owners):
+            shares[group] += point - previous
+            previous = point
+        return {group: share / RING_SIZE for group, share in shares.items()}
@@ -0,0 +1,103 @@
+"""
+Ordered index over the store's keys for prefix and range scans.
+Keys are kept in a list of sorted blocks, so an insert or removal shifts at most one block
+(O(sqrt n)-ish instead of O(n) for a single sorted list) and a scan is a bisect followed by
+a sequential walk.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional
+
+BLOCK_SIZE = 1000
+
+
+class SortedKeyIndex:
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks: List[List[str]] = []
+        # Last key of each block, to find the block a key belongs to
+        self.maxes: List[str] = []
+        self.size = 0
+
+    def _block_for(self, key: str) -> int:
+        return min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+
+    def add(self, key: str):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            return
+        index = self._block_for(key)
+        block = self.blocks[index]
+        position = bisect_left(block, key)
+        if position < len(block) and block[position] == key:
+            return
+        block.insert(position, key)
+        self.maxes[index] = block[-1]
+        self.size += 1
+        if len(block) > 2 * self.block_size:
+            self.blocks[index:index + 1] = [block[:self.block_size], block[self.block_size:]]
+            self.maxes[index:index + 1] = [block[self.block_size - 1], block[-1]]
+
+    def discard(self, key: str):
+        if not self.blocks:
+            return
+        index = self._block_for(key)
+        block = self.blocks[index]
+        position = bisect_left(block, key)
+        if position == len(block) or block[position] != key:
+            return
+        del block[position]
+        self.size -= 1
+        if block:
+            self.maxes[index] = block[-1]
+        else:
+            del self.blocks[index]
+            del self.maxes[index]
+
+    def iter_from(self, start: str = "", inclusive: bool = True) -> Iterator[str]:
+        """Keys in order, beginning at `start` (or just after it when not inclusive)."""
+        if not self.blocks:
+            return
+        index = bisect_left(self.maxes, start) if inclusive else bisect_right(self.maxes, start)
+        if index == len(self.blocks):
+            return
+        block = self.blocks[index]
+        position = bisect_left(block, start) if inclusive else bisect_right(block, start)
+        # Copy each block before yielding from it, so concurrent inserts cannot skip keys
+        for key in block[position:]:
+            yield key
+        for block in self.blocks[index + 1:]:
+            yield from list(block)
+
+    def scan(self, prefix: str = "", start: Optional[str] = None, start_after: Optional[str] = None,
+             end: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        """
+        Up to `limit` keys with `prefix`, from `start` (inclusive) or after `start_after`
+        (exclusive, the pagination cursor), and before `end`.
+        """
+        # Begin at the tightest of the lower bounds; an exclusive bound wins a tie
+        lower, inclusive = prefix, True
+        if start is not None and start > lower:
+            lower = start
+        if start_after is not None and start_after >= lower:
+            lower, inclusive = start_after, False
+        keys = self.iter_from(lower, inclusive)
+        result = []
+        for key in keys:
+            if not key.startswith(prefix) or (end is not None and key >= end):
+                break
+            result.append(key)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, key: str) -> bool:
+        if not self.blocks:
+            return False
+        block = self.blocks[self._block_for(key)]
+        position = bisect_left(block, key)
+        return position < len(block) and block[position] == key
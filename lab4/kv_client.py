@@ -0,0 +1,490 @@
+"""
+Async client for the replicated key-value store.
+
+One pooled HTTP connection set is shared by every call. Concurrent `set`/`get` calls issued
+within `batch_window_ms` of each other are coalesced into one `/keys/batch` write or one
+`/keys/mget` read. Writes go to the leader; reads are routed by consistency level:
+
+    strong   - read from the leader
+    session  - read from a follower that has applied this client's latest write
+               (read-your-writes); the follower redirects to the leader if it cannot
+    bounded  - read from a follower at most `max_staleness_ms` behind the leader
+    eventual - read from any follower, round-robin
+
+Overloaded (503) and connection errors are retried with exponential backoff and jitter,
+honouring Retry-After. Failed follower reads move on to the next follower. When the leader
+cannot be reached the followers are asked which node leads now, so writes move to a newly
+elected leader; a redirect from a follower or a superseded leader does the same.
+
+With a `near_cache`, non-strong reads are served from process memory. The client watches
+the leader's change stream and refreshes or drops cached entries as keys change; while
+that stream is disconnected, reads bypass the cache. Changes made before the stream
+connected never appear on it, so follower reads that fill the cache must have applied the
+leader's commit index at that moment.
+
+    async with KVClient("http://localhost:8000", ["http://localhost:8001"]) as kv:
+        await kv.set("user:1", "alice")
+        value = await kv.get("user:1", consistency="session")
+"""
+import asyncio
+import itertools
+import json
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from near_cache import NearCache
+
+CONSISTENCY_LEVELS = ("strong", "session", "bounded", "eventual")
+
+
+class KVClientError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ConflictError(KVClientError):
+    """A compare-and-set or conditional delete found a different version or value."""
+
+    def __init__(self, key: str, version: int, value: Optional[str]):
+        super().__init__(f"Condition not met for {key!r} (version {version})", 409)
+        self.key = key
+        self.version = version
+        self.value = value
+
+
+class Batcher:
+    """
+    Collects calls for a short window and hands them to `flush` as one list. Each caller
+    waits on its own future, which `flush` resolves with that call's result. At most
+    `max_inflight` batches are outstanding; calls made meanwhile wait for the next one, so
+    batches grow with load instead of splitting into many small requests.
+    """
+
+    def __init__(self, flush: Callable[[List[Tuple[Any, asyncio.Future]]], Awaitable[None]],
+                 window: float, max_size: int, max_inflight: int = 2):
+        self.flush = flush
+        self.window = window
+        self.max_size = max_size
+        self.max_inflight = max_inflight
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+
+    def submit(self, item) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self._send()
+        elif self.timer is None and len(self.tasks) < self.max_inflight:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self._send)
+        return future
+
+    def _send(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.pending and len(self.tasks) < self.max_inflight:
+            batch, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        # Calls queued behind a full pipeline have waited long enough already
+        self._send()
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            await self.flush(batch)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def drain(self):
+        while self.pending or self.tasks:
+            self._send()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class KVClient:
+    def __init__(self, leader_url: str, follower_urls: Sequence[str] = (), consistency: str = "session",
+                 max_staleness_ms: float = 1000.0, batch_window_ms: float = 2.0, max_batch_size: int = 500,
+                 max_inflight_batches: int = 2,
+                 max_connections: int = 100, timeout: float = 15.0, retries: int = 3,
+                 backoff_base_s: float = 0.05, backoff_max_s: float = 2.0,
+                 near_cache: Optional[NearCache] = None):
+        if consistency not in CONSISTENCY_LEVELS:
+            raise ValueError(f"consistency must be one of {CONSISTENCY_LEVELS}")
+        self.leader_url = leader_url.rstrip("/")
+        self.follower_urls = [url.rstrip("/") for url in follower_urls]
+        self.consistency = consistency
+        self.max_staleness_ms = max_staleness_ms
+        self.retries = retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True
+        )
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_inflight_batches = max_inflight_batches
+        self.write_batcher = Batcher(self._flush_writes, self.batch_window, max_batch_size, max_inflight_batches)
+        self.read_batchers: Dict[str, Batcher] = {}
+        self.next_follower = itertools.cycle(range(len(self.follower_urls) or 1))
+        # Highest version this client has written or read, for read-your-writes
+        self.session_version = 0
+        self.stats = {"requests": 0, "retries": 0, "batched_writes": 0, "batched_reads": 0, "leader_changes": 0}
+        self.near_cache = near_cache
+        self.watch_task: Optional[asyncio.Task] = None
+        # True while the change stream is live, so cached entries can be trusted
+        self.watch_connected = False
+        # Leader's commit index when the stream connected; older changes were never on it
+        self.watch_baseline = 0
+        # Bumped on every connect and disconnect, so a request spanning either fills no cache
+        self.watch_session = 0
+        # Id of the last change event applied, to resume the stream after it
+        self.watch_event_id: Optional[str] = None
+
+    async def __aenter__(self) -> "KVClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+            await asyncio.gather(self.watch_task, return_exceptions=True)
+        await self.write_batcher.drain()
+        for batcher in self.read_batchers.values():
+            await batcher.drain()
+        await self.http.aclose()
+
+    def _observe(self, version: int):
+        if version > self.session_version:
+            self.session_version = version
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max_s)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base_s * 2 ** attempt, self.backoff_max_s)
+        return random.uniform(delay / 2, delay)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send one request, retrying connection errors and 503s. Other statuses, including
+        404 and 409, are returned for the caller to interpret.
+        """
+        return await self._send(method, lambda: url, None, **kwargs)
+
+    async def _leader_request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """`_request` to whichever node leads, looking the leader up again if it is unreachable."""
+        response = await self._send(method, lambda: f"{self.leader_url}{path}", self._find_leader, **kwargs)
+        if response.history:
+            # Redirected to the node that leads now
+            self.leader_url = f"{response.url.scheme}://{response.url.netloc.decode()}"
+        return response
+
+    async def _send(self, method: str, url: Callable[[], str],
+                    on_unreachable: Optional[Callable[[], Awaitable[bool]]], **kwargs) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            self.stats["requests"] += 1
+            retry_after = None
+            try:
+                response = await self.http.request(method, url(), **kwargs)
+                if response.status_code != 503:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                error = KVClientError(f"{method} {url()}: {response.text}", 503)
+            except httpx.TransportError as e:
+                error = KVClientError(f"{method} {url()}: {e!r}")
+                if on_unreachable is not None and await on_unreachable():
+                    retry_after = "0"
+            if attempt == self.retries:
+                raise error
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise AssertionError("unreachable")
+
+    async def _find_leader(self) -> bool:
+        """Ask the followers which node leads; True if it is not the one this client used."""
+        async def ask(url: str) -> Optional[Tuple[int, str]]:
+            try:
+                info = (await self.http.get(f"{url}/", timeout=1.0)).json()
+            except (httpx.HTTPError, ValueError):
+                return None
+            return (info["term"], info["leader_url"]) if info.get("leader_url") else None
+
+        answers = [answer for answer in await asyncio.gather(*(ask(url) for url in self.follower_urls)) if answer]
+        if not answers:
+            return False
+        _, leader_url = max(answers)
+        if leader_url.rstrip("/") == self.leader_url:
+            return False
+        self.leader_url = leader_url.rstrip("/")
+        self.stats["leader_changes"] += 1
+        return True
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code == 409:
+            detail = response.json()["detail"]
+            raise ConflictError(detail["key"], detail["version"], detail["value"])
+        if response.status_code >= 400:
+            raise KVClientError(f"{response.request.method} {response.request.url}: {response.text}",
+                                response.status_code)
+
+    # Writes
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None) -> int:
+        """Write a key through the leader; returns its version. Batched with concurrent sets."""
+        session = self._cache_session()
+        version = await self.write_batcher.submit((key, value, ttl_ms))
+        self._cache_put(key, value, version, session)
+        return version
+
+    async def _flush_writes(self, batch: List[Tuple[Tuple[str, str, Optional[int]], asyncio.Future]]):
+        self.stats["batched_writes"] += len(batch)
+        if len(batch) == 1:
+            (key, value, ttl_ms), future = batch[0]
+            response = await self._leader_request("POST", "/keys",
+                                                  json={"key": key, "value": value, "ttl_ms": ttl_ms})
+            self._raise_for_status(response)
+            versions = [response.json()["version"]]
+        else:
+            items = [{"key": key, "value": value, "ttl_ms": ttl_ms} for (key, value, ttl_ms), _ in batch]
+            response = await self._leader_request("POST", "/keys/batch", json={"items": items})
+            self._raise_for_status(response)
+            versions = [result["version"] for result in response.json()["results"]]
+        for (_, future), version in zip(batch, versions):
+            self._observe(version)
+            if not future.done():
+                future.set_result(version)
+
+    async def set_many(self, items: Dict[str, str], ttl_ms: Optional[int] = None) -> Dict[str, int]:
+        """Write many keys at once; returns each key's version."""
+        versions = await asyncio.gather(*(self.set(key, value, ttl_ms) for key, value in items.items()))
+        return dict(zip(items, versions))
+
+    async def compare_and_set(self, key: str, value: str, if_version: Optional[int] = None,
+                              if_value: Optional[str] = None, ttl_ms: Optional[int] = None) -> int:
+        """Conditional write, never batched. Raises ConflictError with the current state."""
+        session = self._cache_session()
+        response = await self._leader_request("POST", "/keys", json={
+            "key": key, "value": value, "ttl_ms": ttl_ms, "if_version": if_version, "if_value": if_value
+        })
+        self._raise_for_status(response)
+        version = response.json()["version"]
+        self._observe(version)
+        self._cache_put(key, value, version, session)
+        return version
+
+    async def write_batch(self, items: Sequence[Dict[str, Any]]) -> List[Dict]:
+        """
+        Apply writes and deletes atomically on the leader as one request, never coalesced with
+        other calls. Each item has a `key` and a `value` (None deletes it), and optionally
+        `ttl_ms`, `if_version` and `if_value`. Returns one result per item: its `status`
+        ("success", "not_found" or "conflict") and `version`, with the current `value` on a
+        conflict.
+        """
+        session = self._cache_session()
+        response = await self._leader_request("POST", "/keys/batch", json={"items": list(items)})
+        self._raise_for_status(response)
+        results = response.json()["results"]
+        for item, result in zip(items, results):
+            if result["status"] != "success":
+                continue
+            self._observe(result["version"])
+            if item["value"] is not None:
+                self._cache_put(item["key"], item["value"], result["version"], session)
+            elif self.near_cache is not None:
+                self.near_cache.apply_change(item["key"], None, result["version"])
+        return results
+
+    async def delete(self, key: str, if_version: Optional[int] = None, if_value: Optional[str] = None) -> bool:
+        """Delete a key; False if it did not exist."""
+        params = {name: value for name, value in (("if_version", if_version), ("if_value", if_value))
+                  if value is not None}
+        response = await self._leader_request("DELETE", f"/keys/{key}", params=params)
+        if response.status_code == 404:
+            return False
+        self._raise_for_status(response)
+        version = response.json()["version"]
+        self._observe(version)
+        if self.near_cache is not None:
+            self.near_cache.apply_change(key, None, version)
+        return True
+
+    # Reads
+
+    async def get(self, key: str, consistency: Optional[str] = None) -> Optional[str]:
+        entry = await self.get_entry(key, consistency)
+        return entry[0] if entry is not None else None
+
+    async def get_entry(self, key: str, consistency: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """(value, version) of a key, or None. Batched with concurrent reads at the same level."""
+        consistency = consistency or self.consistency
+        if consistency not in CONSISTENCY_LEVELS:
+            raise ValueError(f"consistency must be one of {CONSISTENCY_LEVELS}")
+        cached = consistency != "strong" and self._cache_get(key)
+        if cached:
+            return cached
+        batcher = self.read_batchers.get(consistency)
+        if batcher is None:
+            async def flush(batch, consistency=consistency):
+                await self._flush_reads(consistency, batch)
+            batcher = self.read_batchers[consistency] = Batcher(
+                flush, self.batch_window, self.max_batch_size, self.max_inflight_batches
+            )
+        return await batcher.submit(key)
+
+    async def get_many(self, keys: Sequence[str], consistency: Optional[str] = None) -> Dict[str, str]:
+        """Values of the keys that exist."""
+        entries = await asyncio.gather(*(self.get_entry(key, consistency) for key in keys))
+        return {key: entry[0] for key, entry in zip(keys, entries) if entry is not None}
+
+    async def scan(self, prefix: str = "", start: Optional[str] = None, end: Optional[str] = None,
+                   start_after: Optional[str] = None, limit: int = 1000) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of entries from the leader in key order, from `start` (inclusive) to `end`
+        (exclusive). Returns the items (`key`, `value`, `version`, `expires_at`) and the key to
+        pass as `start_after` for the next page, or None after the last page.
+        """
+        params = {name: value for name, value in (("start", start), ("end", end), ("start_after", start_after))
+                  if value is not None}
+        response = await self._leader_request("GET", "/scan", params={"prefix": prefix, "limit": limit, **params})
+        self._raise_for_status(response)
+        page = response.json()
+        return page["items"], page["next_start_after"]
+
+    def _read_targets(self, consistency: str) -> Tuple[List[str], Dict[str, Any]]:
+        """Nodes to try in order, and the freshness parameters to send to followers."""
+        if consistency == "strong" or not self.follower_urls:
+            return [self.leader_url], {}
+        start = next(self.next_follower)
+        followers = self.follower_urls[start:] + self.follower_urls[:start]
+        params = {}
+        if consistency == "session" and self.session_version:
+            params["min_version"] = self.session_version
+        elif consistency == "bounded":
+            params["max_staleness_ms"] = self.max_staleness_ms
+        if self._cache_session() is not None:
+            # A follower behind the stream's start could return a value no change event will replace
+            params["min_version"] = max(params.get("min_version", 0), self.watch_baseline)
+        return followers + [self.leader_url], params
+
+    async def _flush_reads(self, consistency: str, batch: List[Tuple[str, asyncio.Future]]):
+        self.stats["batched_reads"] += len(batch)
+        keys = list(dict.fromkeys(key for key, _ in batch))
+        session = self._cache_session()
+        targets, params = self._read_targets(consistency)
+        error = None
+        for url in targets:
+            try:
+                if url == self.leader_url:
+                    response = await self._leader_request("POST", "/keys/mget", json={"keys": keys})
+                else:
+                    response = await self._request("POST", f"{url}/keys/mget", json={"keys": keys}, params=params)
+                self._raise_for_status(response)
+            except KVClientError as e:
+                # Try the next node; the leader is always last
+                error = e
+                continue
+            items = response.json()["items"]
+            for key, future in batch:
+                item = items.get(key)
+                if item is not None:
+                    self._observe(item["version"])
+                    self._cache_put(key, item["value"], item["version"], session)
+                if not future.done():
+                    future.set_result((item["value"], item["version"]) if item is not None else None)
+            return
+        raise error
+
+    # Near cache
+
+    def _cache_get(self, key: str) -> Optional[Tuple[str, int]]:
+        if self.near_cache is None:
+            return None
+        if self.watch_task is None:
+            self.watch_task = asyncio.create_task(self._watch_changes())
+        if not self.watch_connected:
+            return None
+        return self.near_cache.get(key)
+
+    def _cache_session(self) -> Optional[int]:
+        """The watch session a request issued now may fill the cache in, or None."""
+        return self.watch_session if self.near_cache is not None and self.watch_connected else None
+
+    def _cache_put(self, key: str, value: str, version: int, session: Optional[int]):
+        if session is not None and session == self.watch_session:
+            self.near_cache.put(key, value, version)
+
+    async def _leader_index(self) -> int:
+        response = await self._leader_request("GET", "/replication")
+        self._raise_for_status(response)
+        status = response.json()
+        # A promoted follower reports its commit index as its applied index
+        return status.get("commit_index", status.get("applied_index", 0))
+
+    def cache_stats(self) -> Dict:
+        stats = self.near_cache.stats() if self.near_cache is not None else {}
+        return {**stats, "watch_connected": self.watch_connected}
+
+    def _apply_event(self, event: str, event_id: Optional[str], data: str):
+        payload = json.loads(data)
+        if event == "change":
+            self.near_cache.apply_change(payload["key"], payload["value"], payload["version"])
+            self.watch_event_id = event_id
+        elif event == "reset":
+            # Changes were missed: nothing cached can be trusted any more
+            self.near_cache.clear()
+
+    async def _watch_changes(self):
+        """Keep the near cache coherent from the leader's change stream, reconnecting as needed."""
+        attempt = 0
+        while True:
+            headers = {"Last-Event-ID": self.watch_event_id} if self.watch_event_id is not None else {}
+            try:
+                # The leader sends a keep-alive comment every 15s
+                timeout = httpx.Timeout(self.http.timeout.connect, read=60.0)
+                async with self.http.stream("GET", f"{self.leader_url}/watch", headers=headers,
+                                            timeout=timeout) as response:
+                    if response.status_code != 200:
+                        raise KVClientError(f"Watch failed: {response.status_code}", response.status_code)
+                    event, event_id, data = None, None, None
+                    async for line in response.aiter_lines():
+                        if line.startswith(":"):
+                            if not self.watch_connected:
+                                # Read after the stream started, so every later change is on it
+                                self.watch_baseline = await self._leader_index()
+                                self.watch_session += 1
+                                self.watch_connected = True
+                                attempt = 0
+                        elif line.startswith("event:"):
+                            event = line[len("event:"):].strip()
+                        elif line.startswith("id:"):
+                            event_id = line[len("id:"):].strip()
+                        elif line.startswith("data:"):
+                            data = line[len("data:"):]
+                        elif not line and data is not None:
+                            self._apply_event(event, event_id, data)
+                            event, event_id, data = None, None, None
+            except (httpx.HTTPError, KVClientError):
+                pass
+            finally:
+                if self.watch_connected:
+                    self.watch_session += 1
+                self.watch_connected = False
+            await asyncio.sleep(self._backoff(attempt, None))
+            attempt += 1
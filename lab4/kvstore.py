@@ -0,0 +1,777 @@
+"""
+Key-value state shared by the leader and followers.
+With one uvicorn worker the store lives in-process. With several workers a single owner
+process holds the store and every worker talks to it over a Unix socket, so all workers
+see the same data and the same config.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import struct
+import tempfile
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from key_index import SortedKeyIndex
+from merkle import DEFAULT_DEPTH, MAX_LEVEL, MerkleTree
+from storage import StorageEngine, open_engine
+
+STORE_SOCKET_ENV = "KV_STORE_SOCKET"
+FRAME_HEADER = struct.Struct("!I")
+MAX_LEADER_OBSERVATIONS = 10000
+# Export snapshots not read for this long are dropped, so an abandoned export stops
+# accumulating pre-images
+SNAPSHOT_IDLE_TIMEOUT_S = 60.0
+# Recent changes kept for watchers: (sequence, version, key, value or None for a delete)
+MAX_CHANGE_LOG = 10000
+
+
+class KVStore:
+    """
+    Key/value state (in a pluggable storage engine) with its Merkle tree and runtime config.
+    Every method is synchronous and atomic.
+
+    Each write gets a version from the leader's log index. On the leader `applied_index` is the
+    last assigned version; on a follower it is the highest index below which every write has
+    been applied, which is what read-your-writes tokens are checked against.
+
+    A key with a TTL has an absolute expiry time set by the leader. Expired keys are hidden
+    from reads right away, but only removed when the leader expires them with a versioned
+    delete (`expire_due`) that is replicated like any write, so every replica removes the
+    same keys at the same point in the log.
+
+    Followers also keep the election state (see election.py) here, so every worker of a node
+    agrees on its term, its vote and whether it leads.
+    """
+
+    def __init__(self, merkle_depth: int = DEFAULT_DEPTH, config: Optional[Dict[str, Any]] = None,
+                 engine: Optional[StorageEngine] = None):
+        self.engine = engine if engine is not None else open_engine()
+        self.merkle = MerkleTree(merkle_depth)
+        self.index = SortedKeyIndex()
+        self.config: Dict[str, Any] = dict(config or {})
+        # Latest metric values published by each worker (see metrics.py), by process id
+        self.worker_metrics: Dict[int, Dict[str, Dict[Tuple, Any]]] = {}
+        self.applied_index = 0
+        self.applied_ahead: Set[int] = set()
+        # (leader commit index, leader send time) from heartbeats, oldest first
+        self.leader_observations: Deque[Tuple[int, float]] = deque(maxlen=MAX_LEADER_OBSERVATIONS)
+        self.fresh_as_of = 0.0
+        self.snapshots: Dict[int, ExportSnapshot] = {}
+        self.snapshot_ids = itertools.count(1)
+        # Key -> absolute expiry time, and a min-heap of (expiry, key) that may hold stale
+        # entries for keys rewritten since; those are skipped when popped
+        self.expiries: Dict[str, float] = {}
+        self.expiry_heap: List[Tuple[float, str]] = []
+        # Follower only: version of recently deleted keys, so a delayed older write cannot
+        # bring a key back. Dropped once the applied index passes the delete.
+        self.tombstones: Dict[str, int] = {}
+        self.tombstone_heap: List[Tuple[int, str]] = []
+        # Every change in the order this node applied it; the sequence is local to the node,
+        # and the epoch tells this store's sequences apart from another node's or an earlier run's
+        self.change_log: Deque[Tuple[int, int, str, Optional[str]]] = deque(maxlen=MAX_CHANGE_LOG)
+        self.change_seq = 0
+        self.change_epoch = os.urandom(4).hex()
+        # Highest version among changes dropped from the full change log
+        self.change_log_dropped = 0
+        # Election: latest term seen, the candidate voted for in it, that term's leader, and
+        # this node's role in it. No election starts before a leader has been followed.
+        self.term = 0
+        self.voted_for: Optional[str] = None
+        self.leader_url: Optional[str] = None
+        self.leader_write_quorum: Optional[int] = None
+        self.role = "follower"
+        self.leader_seen_at = 0.0
+        self.election_deadline = float("inf")
+
+    def _expired(self, key: str, now: float) -> bool:
+        expires_at = self.expiries.get(key)
+        return expires_at is not None and expires_at <= now
+
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        if self._expired(key, time.time()):
+            return None
+        return self.engine.get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[str, int]]:
+        now = time.time()
+        entries = {}
+        for key in keys:
+            entry = self.engine.get(key)
+            if entry is not None and not self._expired(key, now):
+                entries[key] = entry
+        return entries
+
+    def _stored_version(self, key: str) -> int:
+        return max(self.engine.version(key), self.tombstones.get(key, 0))
+
+    def _set(self, key: str, value: str, version: int, expires_at: Optional[float] = 0.0):
+        """Store an entry; `expires_at` 0 clears the key's TTL and None keeps it."""
+        for snapshot in self.snapshots.values():
+            snapshot.preserve(key, self.engine)
+        self.engine.put(key, value, version)
+        self.index.add(key)
+        self.merkle.update(key, value)
+        self._record_change(version, key, value)
+        if expires_at:
+            self.expiries[key] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, key))
+            # Rewrites with a TTL leave stale heap entries behind; rebuild before they pile up
+            if len(self.expiry_heap) > 2 * len(self.expiries) + 1024:
+                self.expiry_heap = [(expiry, key) for key, expiry in self.expiries.items()]
+                heapq.heapify(self.expiry_heap)
+        elif expires_at is not None:
+            self.expiries.pop(key, None)
+
+    def _delete(self, key: str, version: int):
+        for snapshot in self.snapshots.values():
+            snapshot.preserve(key, self.engine)
+        if self.engine.delete(key):
+            self.index.discard(key)
+            self.merkle.remove(key)
+            self._record_change(version, key, None)
+        self.expiries.pop(key, None)
+
+    def _record_change(self, version: int, key: str, value: Optional[str]):
+        if len(self.change_log) == MAX_CHANGE_LOG:
+            self.change_log_dropped = max(self.change_log_dropped, self.change_log[0][1])
+        self.change_seq += 1
+        self.change_log.append((self.change_seq, version, key, value))
+
+    def changes_since(self, after_seq: int, limit: int) -> Tuple[List[Tuple[int, int, str, Optional[str]]], int, str]:
+        """
+        Up to `limit` changes with a sequence above `after_seq`, the oldest sequence still in
+        the log (changes before it were dropped) and the log's epoch. Sequences in the log are
+        contiguous.
+        """
+        log = self.change_log
+        if not log:
+            return [], self.change_seq + 1, self.change_epoch
+        oldest_seq = log[0][0]
+        start = max(after_seq + 1 - oldest_seq, 0)
+        return list(itertools.islice(log, start, start + limit)), oldest_seq, self.change_epoch
+
+    def write(self, key: str, value: str, expires_at: float = 0.0) -> int:
+        """Leader write: assign the next log index as the key's version."""
+        self.applied_index += 1
+        self._set(key, value, self.applied_index, expires_at)
+        return self.applied_index
+
+    def write_many(self, items: List[Tuple[str, str, float]]) -> List[int]:
+        return [self.write(key, value, expires_at) for key, value, expires_at in items]
+
+    def compare_and_set(self, key: str, value: Optional[str], expires_at: float, if_version: Optional[int],
+                        if_value: Optional[str]) -> Tuple[bool, int, Optional[str]]:
+        """
+        Leader: write `value` (None deletes the key) only if the key's current version equals
+        `if_version` (0 meaning the key must not exist) and its value equals `if_value`,
+        whichever are given. Returns (applied, version, value): the new version on success,
+        otherwise the current version (0 if absent) and value, so the caller can retry
+        without reading the key again.
+        """
+        current = self.get(key)
+        current_value, current_version = current if current is not None else (None, 0)
+        if (if_version is not None and if_version != current_version) or \
+                (if_value is not None and if_value != current_value):
+            return False, current_version, current_value
+        if value is None:
+            if current is None:
+                return False, 0, None
+            self.applied_index += 1
+            self._delete(key, self.applied_index)
+            return True, self.applied_index, None
+        return True, self.write(key, value, expires_at), value
+
+    def compare_and_set_many(self, items: List[Tuple[str, Optional[str], float, Optional[int], Optional[str]]]
+                             ) -> List[Tuple[bool, int, Optional[str]]]:
+        """Leader: `compare_and_set` for each (key, value, expires_at, if_version, if_value), atomically."""
+        return [self.compare_and_set(*item) for item in items]
+
+    def delete(self, key: str) -> Optional[int]:
+        """Leader delete: the version of the delete, or None if the key does not exist."""
+        applied, version, _ = self.compare_and_set(key, None, 0.0, None, None)
+        return version if applied else None
+
+    def expire_due(self, now: float, limit: int) -> List[Tuple[str, int]]:
+        """
+        Leader: delete up to `limit` keys whose expiry has passed, each as a new version.
+        Returns (key, version) of the deletes to replicate.
+        """
+        expired = []
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now and len(expired) < limit:
+            expires_at, key = heapq.heappop(heap)
+            if self.expiries.get(key) != expires_at:
+                continue
+            self.applied_index += 1
+            self._delete(key, self.applied_index)
+            expired.append((key, self.applied_index))
+        return expired
+
+    def apply(self, key: str, value: Optional[str], version: int, superseded: Iterable[int] = (),
+              expires_at: float = 0.0) -> bool:
+        """
+        Follower write: apply unless a newer version of the key is already stored. A None
+        value is a delete. `superseded` are older versions of the key the leader coalesced
+        into this one; they count as applied too.
+        """
+        applied = version > self._stored_version(key)
+        if applied:
+            if value is None:
+                self._delete_at(key, version)
+            else:
+                self._set(key, value, version, expires_at)
+        for superseded_version in superseded:
+            self._mark_applied(superseded_version)
+        self._mark_applied(version)
+        return applied
+
+    def _delete_at(self, key: str, version: int):
+        """Follower delete; remembers the version until older writes can no longer arrive."""
+        self._delete(key, version)
+        if version > self.applied_index:
+            self.tombstones[key] = version
+            heapq.heappush(self.tombstone_heap, (version, key))
+
+    def apply_many(self, items: List[Tuple[str, Optional[str], int, List[int], float]]) -> int:
+        return sum(self.apply(*item) for item in items)
+
+    def repair(self, entries: Dict[str, str], versions: Dict[str, int], sync_index: int,
+               deletes: Optional[Dict[str, int]] = None) -> int:
+        """
+        Apply anti-entropy entries. Entries without a version are forced; versioned entries
+        replace older or equal versions. `deletes` are keys the leader no longer has, with a
+        leader index at which they were gone. `sync_index` is a leader index this node is now
+        known to reflect, which closes gaps left by writes that never arrived.
+        """
+        repaired = 0
+        for key, version in (deletes or {}).items():
+            if version > self._stored_version(key):
+                self._delete_at(key, version)
+                repaired += 1
+        for key, value in entries.items():
+            version = versions.get(key)
+            stored_version = self._stored_version(key)
+            if version is None:
+                self._set(key, value, stored_version, None)
+            elif version >= stored_version:
+                self._set(key, value, version, None)
+            else:
+                continue
+            repaired += 1
+        if sync_index > self.applied_index:
+            self.applied_index = sync_index
+            self.applied_ahead = {index for index in self.applied_ahead if index > sync_index}
+            self._advance_applied()
+        return repaired
+
+    def _mark_applied(self, version: int):
+        if version > self.applied_index:
+            self.applied_ahead.add(version)
+            self._advance_applied()
+
+    def _advance_applied(self):
+        while self.applied_index + 1 in self.applied_ahead:
+            self.applied_index += 1
+            self.applied_ahead.remove(self.applied_index)
+        # Every write up to the applied index has arrived, so older tombstones are not needed
+        while self.tombstone_heap and self.tombstone_heap[0][0] <= self.applied_index:
+            version, key = heapq.heappop(self.tombstone_heap)
+            if self.tombstones.get(key) == version:
+                del self.tombstones[key]
+        self._update_freshness()
+
+    def observe_leader(self, commit_index: int, sent_at: float):
+        if not self.leader_observations or commit_index >= self.leader_observations[-1][0]:
+            self.leader_observations.append((commit_index, sent_at))
+        self._update_freshness()
+
+    def _update_freshness(self):
+        # Once every write up to a heartbeat's index is applied, this node holds everything
+        # the leader had when it sent that heartbeat.
+        while self.leader_observations and self.leader_observations[0][0] <= self.applied_index:
+            _, sent_at = self.leader_observations.popleft()
+            self.fresh_as_of = max(self.fresh_as_of, sent_at)
+
+    def replication_status(self) -> Dict[str, Any]:
+        leader_index = self.leader_observations[-1][0] if self.leader_observations else self.applied_index
+        staleness_ms = (time.time() - self.fresh_as_of) * 1000.0 if self.fresh_as_of else None
+        return {
+            "applied_index": self.applied_index,
+            "leader_index": max(leader_index, self.applied_index),
+            "pending_out_of_order": len(self.applied_ahead),
+            "staleness_ms": staleness_ms,
+        }
+
+    def election_state(self) -> Dict[str, Any]:
+        return {
+            "term": self.term,
+            "role": self.role,
+            "leader_url": self.leader_url,
+            "voted_for": self.voted_for,
+            "write_quorum": self.leader_write_quorum,
+        }
+
+    def observe_term(self, term: int) -> bool:
+        """
+        Check a message from the leader of `term`: False if a later term has begun. A later
+        term than this node's means a new leader was elected, whose URL comes with its
+        first heartbeat.
+        """
+        if term < self.term:
+            return False
+        if term > self.term:
+            self.term = term
+            self.voted_for = None
+            self.leader_url = None
+            self.role = "follower"
+        return True
+
+    def follow_leader(self, term: int, leader_url: str, write_quorum: int, election_timeout_s: float) -> bool:
+        """Heartbeat from a leader: follow it and push the election back, unless its term is over."""
+        if not self.observe_term(term):
+            return False
+        # A candidate of this term lost to this leader
+        self.role = "follower"
+        self.leader_url = leader_url
+        self.leader_write_quorum = write_quorum
+        self.leader_seen_at = time.monotonic()
+        self.election_deadline = self.leader_seen_at + election_timeout_s
+        return True
+
+    def apply_from(self, term: int, items: List[Tuple[str, Optional[str], int, List[int], float]]) -> Optional[int]:
+        """`apply_many` for a replication message from the leader of `term`; None if that term is over."""
+        if not self.observe_term(term):
+            return None
+        return self.apply_many(items)
+
+    def begin_election(self, candidate: str, election_timeout_s: float) -> Optional[Tuple[int, int]]:
+        """
+        Start an election if the leader has been silent past the deadline: move to the next
+        term and vote for `candidate` (this node). Returns the term and this node's applied
+        index to ask for votes with, or None if no election is due. A candidate whose
+        election fails starts another one once the new deadline passes.
+        """
+        now = time.monotonic()
+        if self.role == "leader" or now < self.election_deadline:
+            return None
+        self.term += 1
+        self.voted_for = candidate
+        self.leader_url = None
+        self.role = "candidate"
+        self.election_deadline = now + election_timeout_s
+        return self.term, self.applied_index
+
+    def request_vote(self, term: int, candidate: str, applied_index: int, min_timeout_s: float,
+                     election_timeout_s: float) -> Tuple[bool, int]:
+        """
+        Vote for `candidate` in `term` if this node has not voted for anyone else in that term
+        and the candidate has applied at least as much of the log. A node still hearing from
+        its leader, or leading itself, refuses, so a node that was cut off cannot depose a
+        working leader. Returns (granted, this node's term).
+        """
+        now = time.monotonic()
+        if term < self.term or self.role == "leader" or \
+                (self.leader_url is not None and now - self.leader_seen_at < min_timeout_s):
+            return False, self.term
+        self.observe_term(term)
+        if self.voted_for not in (None, candidate) or applied_index < self.applied_index:
+            return False, self.term
+        self.voted_for = candidate
+        self.election_deadline = now + election_timeout_s
+        return True, self.term
+
+    def entries_after(self, version: int) -> Tuple[List[Tuple[str, Optional[str], int, float]], int, bool]:
+        """
+        Current entries (None values for deletes) of keys changed at a version above `version`
+        while they are in the change log, the highest version this node has applied, and
+        whether the log still holds every change above `version`. A newly elected leader pulls
+        these from the other followers so it holds every write a quorum acknowledged, even
+        ones it had not received itself.
+        """
+        latest: Dict[str, Tuple[int, Optional[str]]] = {}
+        for _, change_version, key, value in self.change_log:
+            if change_version > version and change_version > latest.get(key, (0, None))[0]:
+                latest[key] = (change_version, value)
+        entries = [
+            (key, value, change_version, self.expiries.get(key, 0.0) if value is not None else 0.0)
+            for key, (change_version, value) in latest.items()
+        ]
+        complete = self.change_log_dropped <= version
+        return entries, max(self.applied_index, max(self.applied_ahead, default=0)), complete
+
+    def promote(self, term: int, leader_url: str, last_version: int) -> bool:
+        """
+        Become the leader of `term` if this node is still its candidate. Versions continue
+        after `last_version`, the highest any reachable follower has applied, so the new
+        leader's writes are newer than everything already replicated. Gaps left by writes
+        that never arrived are closed on followers by the new leader's anti-entropy.
+        """
+        if self.term != term or self.role != "candidate":
+            return False
+        self.role = "leader"
+        self.leader_url = leader_url
+        self.applied_index = max(self.applied_index, last_version, max(self.applied_ahead, default=0))
+        self.applied_ahead.clear()
+        self.tombstones.clear()
+        self.tombstone_heap.clear()
+        self.leader_observations.clear()
+        return True
+
+    def keys(self) -> List[str]:
+        return list(self.engine.keys())
+
+    def scan_keys(self, prefix: str, start_after: Optional[str], limit: int) -> Tuple[List[str], Optional[str]]:
+        """Up to `limit` keys in order and the cursor for the next page (None at the end)."""
+        keys = self.index.scan(prefix, start_after=start_after, limit=limit)
+        next_start_after = keys[-1] if len(keys) == limit else None
+        now = time.time()
+        return [key for key in keys if not self._expired(key, now)], next_start_after
+
+    def scan(self, prefix: str, start: Optional[str], start_after: Optional[str], end: Optional[str],
+             limit: int) -> Tuple[List[Tuple[str, str, int, float]], Optional[str]]:
+        """
+        Key, value, version and expiry time (0 for none) of up to `limit` keys in order (see
+        SortedKeyIndex.scan) and the cursor for the next page.
+        """
+        keys = self.index.scan(prefix, start, start_after, end, limit)
+        next_start_after = keys[-1] if len(keys) == limit else None
+        now = time.time()
+        return [
+            (key, *self.engine.get(key), self.expiries.get(key, 0.0)) for key in keys if not self._expired(key, now)
+        ], next_start_after
+
+    def open_snapshot(self) -> Dict[str, int]:
+        """
+        Start a point-in-time export. Pages are read later with `read_snapshot`; writes made
+        meanwhile save the key's previous entry in the snapshot instead of blocking.
+        """
+        now = time.monotonic()
+        for snapshot_id, snapshot in list(self.snapshots.items()):
+            if now - snapshot.last_read > SNAPSHOT_IDLE_TIMEOUT_S:
+                del self.snapshots[snapshot_id]
+        snapshot_id = next(self.snapshot_ids)
+        self.snapshots[snapshot_id] = ExportSnapshot()
+        return {"snapshot_id": snapshot_id, "applied_index": self.applied_index, "keys_count": len(self.engine)}
+
+    def read_snapshot(self, snapshot_id: int, start_after: Optional[str],
+                      limit: int) -> Tuple[List[Tuple[str, str, int]], Optional[str]]:
+        """
+        Entries after `start_after` in key order, as of when the snapshot was opened, and the
+        cursor for the next page (None at the end). A page scans at most `limit` current keys.
+        """
+        snapshot = self.snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise ValueError(f"Snapshot {snapshot_id} is closed or expired")
+        snapshot.last_read = time.monotonic()
+        keys = self.index.scan(start_after=start_after, limit=limit)
+        # Keys removed from the index since the snapshot was opened only survive as pre-images
+        upper = keys[-1] if len(keys) == limit else None
+        next_start_after = upper
+        keys.extend(
+            key for key, entry in snapshot.preimages.items()
+            if entry is not None and key not in self.index
+            and (start_after is None or key > start_after) and (upper is None or key < upper)
+        )
+        keys.sort()
+        entries = []
+        for key in keys:
+            entry = snapshot.preimages[key] if key in snapshot.preimages else self.engine.get(key)
+            if entry is not None:
+                entries.append((key, *entry))
+        return entries, next_start_after
+
+    def close_snapshot(self, snapshot_id: int):
+        self.snapshots.pop(snapshot_id, None)
+
+    def snapshot(self) -> Dict[str, str]:
+        return {key: value for key, value, _ in self.engine.items()}
+
+    def count(self) -> int:
+        return len(self.engine)
+
+    def storage_stats(self) -> Dict[str, int]:
+        return self.engine.stats()
+
+    def merkle_root(self) -> Dict[str, int]:
+        return {
+            "root": self.merkle.root(),
+            "depth": self.merkle.depth,
+            "keys_count": len(self.engine),
+            "applied_index": self.applied_index,
+        }
+
+    def merkle_nodes(self, level: int, indices: List[int]) -> List[int]:
+        """Node hashes of `level`; levels below the leaf buckets are computed from them."""
+        if level < 0 or level > MAX_LEVEL:
+            raise ValueError(f"Level must be between 0 and {MAX_LEVEL}")
+        if any(index < 0 or index >= (1 << level) for index in indices):
+            raise ValueError("Node index out of range")
+        return self.merkle.nodes(level, indices)
+
+    def merkle_buckets(self, indices: List[int], level: Optional[int] = None) -> List[Dict[str, int]]:
+        """Per-key entry hashes under nodes of `level` (leaf buckets by default), which is at least the leaf level."""
+        level = self.merkle.depth if level is None else level
+        if level < self.merkle.depth or level > MAX_LEVEL:
+            raise ValueError(f"Level must be between {self.merkle.depth} and {MAX_LEVEL}")
+        if any(index < 0 or index >= (1 << level) for index in indices):
+            raise ValueError("Bucket index out of range")
+        return [self.merkle.bucket_hashes(index, level) for index in indices]
+
+    def set_config(self, name: str, value: Any) -> Dict[str, Any]:
+        self.config[name] = value
+        return dict(self.config)
+
+    def get_config(self) -> Dict[str, Any]:
+        return dict(self.config)
+
+    def publish_metrics(self, worker: int, values: Dict[str, Dict[Tuple, Any]]) -> Dict[int, Dict]:
+        """Keep one worker's current metric values; returns the latest values of every worker."""
+        self.worker_metrics[worker] = values
+        return self.worker_metrics
+
+
+class ExportSnapshot:
+    """Entries of keys changed since a snapshot was opened, as they were at that point."""
+
+    def __init__(self):
+        # None marks a key that did not exist yet
+        self.preimages: Dict[str, Optional[Tuple[str, int]]] = {}
+        self.last_read = time.monotonic()
+
+    def preserve(self, key: str, engine: StorageEngine):
+        if key not in self.preimages:
+            self.preimages[key] = engine.get(key)
+
+
+class LocalStore:
+    """Async facade over an in-process KVStore, used with a single worker."""
+
+    def __init__(self, store: KVStore):
+        self.store = store
+        self.config_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self.store.config
+
+    def on_config(self, listener: Callable[[Dict[str, Any]], None]):
+        self.config_listeners.append(listener)
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def set_config(self, name: str, value: Any) -> Dict[str, Any]:
+        config = self.store.set_config(name, value)
+        for listener in self.config_listeners:
+            listener(config)
+        return config
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = getattr(self.store, name)
+
+        async def call(*args):
+            return method(*args)
+
+        setattr(self, name, call)
+        return call
+
+
+async def export_ndjson(store, page_size: int, header: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """
+    Stream a point-in-time snapshot of `store` (a LocalStore or RemoteStore) as NDJSON: a
+    header line, one {"key", "value", "version"} line per entry in key order, then an
+    {"end": true, "count": n} line so readers can tell a complete export from a cut one.
+    Only one page is held in memory at a time.
+    """
+    snapshot = await store.open_snapshot()
+    snapshot_id = snapshot.pop("snapshot_id")
+    try:
+        yield (json.dumps({**header, **snapshot}) + "\n").encode()
+        count = 0
+        start_after = None
+        while True:
+            entries, start_after = await store.read_snapshot(snapshot_id, start_after, page_size)
+            count += len(entries)
+            if entries:
+                yield "".join(
+                    json.dumps({"key": key, "value": value, "version": version}) + "\n"
+                    for key, value, version in entries
+                ).encode()
+            if start_after is None:
+                break
+        yield (json.dumps({"end": True, "count": count}) + "\n").encode()
+    finally:
+        await store.close_snapshot(snapshot_id)
+
+
+def encode_frame(message: Any) -> bytes:
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Any:
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(length))
+
+
+class RemoteStore:
+    """
+    Async client for a store owned by another process. Calls are multiplexed over one
+    Unix socket connection per worker; config changes are pushed by the owner.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count()
+        self.config: Dict[str, Any] = {}
+        self.config_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.config_ready = asyncio.Event()
+
+    def on_config(self, listener: Callable[[Dict[str, Any]], None]):
+        self.config_listeners.append(listener)
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+        self.reader_task = asyncio.create_task(self._read_loop())
+        # The owner sends its current config as the first frame
+        await self.config_ready.wait()
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    def _apply_config(self, config: Dict[str, Any]):
+        self.config = config
+        for listener in self.config_listeners:
+            listener(config)
+        self.config_ready.set()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message = await read_frame(self.reader)
+                if message[0] == "config":
+                    self._apply_config(message[1])
+                    continue
+                _, request_id, ok, result = message
+                future = self.pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        except Exception as e:
+            # Later calls fail fast instead of writing into a dead connection and waiting forever
+            writer, self.reader, self.writer = self.writer, None, None
+            writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Store owner connection lost: {e!r}"))
+            self.pending.clear()
+
+    async def call(self, method: str, *args) -> Any:
+        if self.writer is None:
+            raise RuntimeError("Store not connected")
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode_frame(("call", request_id, method, args)))
+        return await future
+
+    async def set_config(self, name: str, value: Any) -> Dict[str, Any]:
+        config = await self.call("set_config", name, value)
+        self._apply_config(config)
+        return config
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        call = functools.partial(self.call, name)
+        setattr(self, name, call)
+        return call
+
+
+async def _serve(socket_path: str, store: KVStore):
+    connections = set()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.add(writer)
+        writer.write(encode_frame(("config", store.get_config())))
+        try:
+            while True:
+                _, request_id, method, args = await read_frame(reader)
+                try:
+                    if method.startswith("_"):
+                        raise AttributeError(method)
+                    result, ok = getattr(store, method)(*args), True
+                except Exception as e:
+                    result, ok = e, False
+                writer.write(encode_frame(("result", request_id, ok, result)))
+                if method == "set_config" and ok:
+                    for connection in connections:
+                        if connection is not writer:
+                            connection.write(encode_frame(("config", result)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            connections.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    async with server:
+        await server.serve_forever()
+
+
+def serve_store(socket_path: str, merkle_depth: int, config: Dict[str, Any], engine: str):
+    asyncio.run(_serve(socket_path, KVStore(merkle_depth, config, open_engine(engine))))
+
+
+def start_store_owner(merkle_depth: int, config: Dict[str, Any], engine: str = "dict") -> multiprocessing.Process:
+    """
+    Start the store owner process and export its socket path, so uvicorn workers
+    spawned afterwards connect to it instead of creating their own store.
+    """
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="kvstore-"), "store.sock")
+    process = multiprocessing.Process(
+        target=serve_store,
+        args=(socket_path, merkle_depth, config, engine),
+        daemon=True
+    )
+    process.start()
+    deadline = time.time() + 10.0
+    while not os.path.exists(socket_path):
+        if time.time() > deadline or not process.is_alive():
+            raise RuntimeError("Store owner process failed to start")
+        time.sleep(0.05)
+    os.environ[STORE_SOCKET_ENV] = socket_path
+    print(f"Store owner process {process.pid} listening on {socket_path}")
+    return process
+
+
+def open_store(merkle_depth: int = DEFAULT_DEPTH, config: Optional[Dict[str, Any]] = None,
+               engine: str = "dict"):
+    socket_path = os.getenv(STORE_SOCKET_ENV)
+    if socket_path:
+        return RemoteStore(socket_path)
+    return LocalStore(KVStore(merkle_depth, config, open_engine(engine)))
@@ -1,65 +1,135 @@
 """
 Leader server for key-value store with single-leader replication.
 Only the leader accepts writes and replicates them to followers.
+
+The write path itself (quorum replication, admission control, heartbeats, expiry and
+anti-entropy) is in write_path.py; a follower elected after this leader fails builds its
+own from there.
 """
-import os
 import asyncio
-import time
-from typing import Dict, List, Optional
+import os
+from typing import Dict, List, Optional, Tuple
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import httpx
 
-shared_client: Optional[httpx.AsyncClient] = None
+import fast_path
+from change_feed import ChangeFeed, parse_event_id
+from key_locks import KeyLocks
+from kvstore import export_ndjson, open_store, start_store_owner
+from metrics import (CONTENT_TYPE, Registry, RequestMetrics, add_runtime_metrics, publish_periodically,
+                     render_workers, start_monitor)
+from write_path import QUORUM_MODES, BatchWriteRequest, WritePath, WritePathConfig, WriteRequest
+
+# In-memory transport to the followers, set by the simulator; None uses the network
+transport: Optional[httpx.AsyncBaseTransport] = None
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global shared_client
-    limits = httpx.Limits(max_keepalive_connections=10, max_connections=100)
-    shared_client = httpx.AsyncClient(
-        timeout=10.0,
-        limits=limits,
-        http2=False
-    )
+    await store.connect()
+    monitor = start_monitor(loop_lag, LOOP_LAG_INTERVAL_MS)
+    await write_path.start(transport)
+    publisher = asyncio.create_task(publish_periodically(store, registries))
+    print(f"Delay range: [{MIN_DELAY_MS}ms, {MAX_DELAY_MS}ms]")
     yield
-    if shared_client:
-        await shared_client.aclose()
+    publisher.cancel()
+    await write_path.stop()
+    if monitor:
+        monitor.cancel()
+    await store.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
-store: Dict[str, str] = {}
-store_lock = asyncio.Lock()
-
 FOLLOWERS = os.getenv("FOLLOWERS", "").split(",")
 FOLLOWERS = [f.strip() for f in FOLLOWERS if f.strip()]
-WRITE_QUORUM = int(os.getenv("WRITE_QUORUM", "3"))
 MIN_DELAY_MS = int(os.getenv("MIN_DELAY_MS", "0"))
 MAX_DELAY_MS = int(os.getenv("MAX_DELAY_MS", "1000"))
 LEADER_PORT = int(os.getenv("LEADER_PORT", "8000"))
+# Address clients reach this leader at; followers redirect writes there
+LEADER_URL = os.getenv("LEADER_URL", f"http://localhost:{LEADER_PORT}")
+# Election term this leader starts in; followers elect a replacement in a later one
+LEADER_TERM = int(os.getenv("LEADER_TERM", "1"))
+MERKLE_DEPTH = int(os.getenv("MERKLE_DEPTH", "10"))
+# "dict" or "compact", see storage.py
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "dict")
+MAX_SCAN_LIMIT = int(os.getenv("MAX_SCAN_LIMIT", "10000"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+WATCH_BUFFER_SIZE = int(os.getenv("WATCH_BUFFER_SIZE", "10000"))
+WATCH_POLL_MS = int(os.getenv("WATCH_POLL_MS", "10"))
+# How often the event-loop lag metric samples the loop, 0 disables it
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+# Serve writes and reads, and encode replication messages, without Pydantic (see fast_path.py)
+FAST_PATH = os.getenv("FAST_PATH", "true").lower() == "true"
+# WRITE_QUORUM, QUORUM_MODE and the write path's limits, see write_path.py
+WRITE_PATH_CONFIG = WritePathConfig()
+
+
+def initial_config() -> Dict:
+    return {"write_quorum": WRITE_PATH_CONFIG.write_quorum, "quorum_mode": WRITE_PATH_CONFIG.quorum_mode}
+
+
+metrics = Registry()
+app.add_middleware(RequestMetrics, registry=metrics)
+loop_lag = add_runtime_metrics(metrics)
+lock_wait = metrics.histogram("kv_lock_wait_seconds", "Time writes waited for their key locks")
+
+# With several workers the store and config live in a shared owner process
+store = open_store(MERKLE_DEPTH, initial_config(), STORAGE_ENGINE)
+key_locks = KeyLocks(on_wait=lock_wait.observe)
+change_feed = ChangeFeed(store, WATCH_BUFFER_SIZE, WATCH_POLL_MS / 1000.0)
+write_path = WritePath(store, key_locks, FOLLOWERS, LEADER_URL, LEADER_TERM, WRITE_PATH_CONFIG.write_quorum,
+                       WRITE_PATH_CONFIG.quorum_mode, WRITE_PATH_CONFIG)
+store.on_config(write_path.apply_config)
+
+
+class MultiGetRequest(BaseModel):
+    keys: List[str]
 
-print(f"Leader initialized with {len(FOLLOWERS)} followers: {FOLLOWERS}")
-print(f"Write quorum: {WRITE_QUORUM}, Delay range: [{MIN_DELAY_MS}ms, {MAX_DELAY_MS}ms]")
 
+class QuorumUpdateRequest(BaseModel):
+    quorum: int
 
-class WriteRequest(BaseModel):
-    key: str
-    value: str
 
+class QuorumModeRequest(BaseModel):
+    mode: str
 
-class ReplicateRequest(BaseModel):
-    key: str
-    value: str
 
+class MerkleNodesRequest(BaseModel):
+    level: int
+    indices: List[int]
 
-class QuorumUpdateRequest(BaseModel):
-    quorum: int
+
+class MerkleBucketsRequest(BaseModel):
+    indices: List[int]
+    # Nodes of a level below the leaf buckets; None for the leaf buckets themselves
+    level: Optional[int] = None
 
 
 @app.get("/")
 async def root():
-    return {"role": "leader", "followers": FOLLOWERS, "write_quorum": WRITE_QUORUM}
+    if write_path.superseded_by is not None:
+        newer_term, leader_url = write_path.superseded_by
+        return {"role": "superseded", "term": newer_term, "leader_url": leader_url}
+    return {"role": "leader", "followers": FOLLOWERS, "write_quorum": write_path.write_quorum,
+            "term": write_path.term, "leader_url": LEADER_URL}
+
+
+@app.get("/replication")
+async def replication_status():
+    status = await store.replication_status()
+    return {
+        "role": "leader",
+        "commit_index": status["applied_index"],
+        "inflight_writes": write_path.inflight_writes,
+        "rejected_writes": write_path.rejected_writes,
+        "background_replications": len(write_path.background_replications),
+        "follower_backlog": {url: stats["inflight"] for url, stats in write_path.follower_tracker.snapshot().items()},
+        "follower_queues": {url: queue.snapshot() for url, queue in write_path.replication_queues.items()}
+    }
 
 
 @app.get("/health")
@@ -67,120 +137,221 @@ async def health():
     return {"status": "healthy", "role": "leader"}
 
 
+@app.get("/storage")
+async def storage_stats():
+    return {"role": "leader", "engine": STORAGE_ENGINE, **(await store.storage_stats())}
+
+
+async def read_entry(key: str) -> Dict:
+    entry = await store.get(key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    value, version = entry
+    return {"key": key, "value": value, "version": version}
+
+
 @app.get("/keys/{key}")
 async def read(key: str):
-    async with store_lock:
-        if key in store:
-            return {"key": key, "value": store[key]}
-    raise HTTPException(status_code=404, detail="Key not found")
+    return await read_entry(key)
+
+
+def check_scan_limit(limit: int):
+    if limit < 1 or limit > MAX_SCAN_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_SCAN_LIMIT}")
 
 
 @app.get("/keys")
-async def list_keys():
-    return {"keys": list(store.keys())}
+async def list_keys(prefix: str = "", start_after: Optional[str] = None, limit: int = 1000):
+    """One page of keys in order; pass `next_start_after` back as `start_after` for the next page."""
+    check_scan_limit(limit)
+    keys, next_start_after = await store.scan_keys(prefix, start_after, limit)
+    return {"keys": keys, "next_start_after": next_start_after}
+
+
+@app.get("/scan")
+async def scan(prefix: str = "", start: Optional[str] = None, end: Optional[str] = None,
+               start_after: Optional[str] = None, limit: int = 1000):
+    """Key/value pairs in key order, from `start` (inclusive) to `end` (exclusive)."""
+    check_scan_limit(limit)
+    entries, next_start_after = await store.scan(prefix, start, start_after, end, limit)
+    return {
+        "items": [
+            {"key": key, "value": value, "version": version, "expires_at": expires_at or None}
+            for key, value, version, expires_at in entries
+        ],
+        "next_start_after": next_start_after
+    }
 
 
 @app.post("/keys")
 async def write(request: WriteRequest):
-    start_time = time.time()
-    
-    async with store_lock:
-        store[request.key] = request.value
-    
-    async def replicate_to_follower(follower_url: str) -> bool:
-        try:
-            if shared_client is None:
-                raise RuntimeError("Shared HTTP client not initialized")
-            response = await shared_client.post(
-                f"{follower_url}/replicate",
-                json={"key": request.key, "value": request.value}
-            )
-            
-            return response.status_code == 200
-        except Exception as e:
-            print(f"Error replicating to {follower_url}: {e}")
-            return False
-    
-    replication_tasks = [asyncio.create_task(replicate_to_follower(follower)) 
-                         for follower in FOLLOWERS]
-    
-    successful_count = 0
-    pending_tasks = set(replication_tasks)
-    
-    # Wait for quorum by processing tasks as they complete
-    while successful_count < WRITE_QUORUM and pending_tasks:
-        done, pending_tasks = await asyncio.wait(
-            pending_tasks,
-            return_when=asyncio.FIRST_COMPLETED
-        )
-        
-        for task in done:
-            try:
-                if task.result() is True:
-                    successful_count += 1
-                    if successful_count >= WRITE_QUORUM:
-                        # Cancel remaining tasks to avoid unnecessary work
-                        for remaining_task in pending_tasks:
-                            remaining_task.cancel()
-                        break
-            except Exception as e:
-                pass
-        
-        if successful_count >= WRITE_QUORUM:
-            break
-    
-    total_successful = successful_count
-    
-    latency = time.time() - start_time
-    
-    if total_successful >= WRITE_QUORUM:
-        return {
-            "status": "success",
-            "key": request.key,
-            "value": request.value,
-            "replicated_to": total_successful,
-            "total_followers": len(FOLLOWERS),
-            "write_quorum": WRITE_QUORUM,
-            "latency_seconds": latency
-        }
-    else:
-        raise HTTPException(
-            status_code=503,
-            detail=f"Write quorum not met. Got {total_successful}/{WRITE_QUORUM} confirmations. "
-                   f"Write persisted on leader but replication incomplete."
-        )
+    return write_path.redirect_if_superseded("/keys") or await write_path.apply_write(
+        request.key, request.value, request.ttl_ms, request.if_version, request.if_value
+    )
+
+
+async def lean_write(request: Request) -> Response:
+    redirect = write_path.redirect_if_superseded("/keys")
+    if redirect:
+        return redirect
+    fields = fast_path.parse_body(WriteRequest, await request.body())
+    return fast_path.json_response(await write_path.apply_write(**fields))
+
+
+async def lean_read(request: Request) -> Response:
+    return fast_path.json_response(await read_entry(request.path_params["key"]))
+
+
+@app.post("/keys/batch")
+async def write_batch(request: BatchWriteRequest):
+    """
+    Apply many writes and deletes atomically on the leader and replicate them in one message
+    per follower. The whole batch shares one quorum outcome; each item gets its own version.
+    Conditional items that fail are skipped and come back with the key's current state.
+    """
+    return write_path.redirect_if_superseded("/keys/batch") or await write_path.apply_batch(request)
+
+
+@app.delete("/keys/{key}")
+async def delete(request: Request, key: str, if_version: Optional[int] = None, if_value: Optional[str] = None):
+    """Delete a key, optionally only at a given version or value, replicated like a write."""
+    path = f"/keys/{key}?{request.url.query}" if request.url.query else f"/keys/{key}"
+    return write_path.redirect_if_superseded(path) or await write_path.apply_delete(key, if_version, if_value)
+
+
+@app.post("/keys/mget")
+async def read_many(request: MultiGetRequest):
+    entries = await store.get_many(request.keys)
+    return {
+        "items": {key: {"value": value, "version": version} for key, (value, version) in entries.items()},
+        "missing": [key for key in request.keys if key not in entries]
+    }
 
 
 @app.get("/state")
 async def get_state():
-    return {"store": store, "keys_count": len(store)}
+    snapshot = await store.snapshot()
+    return {"store": snapshot, "keys_count": len(snapshot)}
+
+
+@app.get("/export")
+async def export():
+    """Full store as NDJSON, streamed from a point-in-time snapshot."""
+    return StreamingResponse(
+        export_ndjson(store, EXPORT_PAGE_SIZE, {"role": "leader"}),
+        media_type="application/x-ndjson"
+    )
+
+
+def watch_start(after_event: Optional[str]) -> Optional[Tuple[str, int]]:
+    """The id of the last event a watcher saw; a reconnecting EventSource sends it as Last-Event-ID."""
+    if after_event is None:
+        return None
+    try:
+        return parse_event_id(after_event)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Not an event id of this watch stream")
+
+
+@app.get("/watch")
+async def watch(request: Request, prefix: str = "", from_version: Optional[int] = None,
+                after_event: Optional[str] = None):
+    """Server-sent events for every change to keys with `prefix`, optionally replayed after an event or a version."""
+    after = watch_start(request.headers.get("last-event-id", after_event))
+    return StreamingResponse(
+        change_feed.subscribe(prefix, from_version, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/merkle")
+async def get_merkle_root():
+    return await store.merkle_root()
+
+
+@app.post("/merkle/nodes")
+async def get_merkle_nodes(request: MerkleNodesRequest):
+    try:
+        hashes = await store.merkle_nodes(request.level, request.indices)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"level": request.level, "hashes": hashes}
+
+
+@app.post("/merkle/buckets")
+async def get_merkle_buckets(request: MerkleBucketsRequest):
+    try:
+        buckets = await store.merkle_buckets(request.indices, request.level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"buckets": buckets}
+
+
+@app.post("/anti-entropy/run")
+async def trigger_anti_entropy():
+    return {"repaired": await write_path.run_anti_entropy()}
 
 
 @app.post("/config/quorum")
 async def update_quorum(request: QuorumUpdateRequest):
-    global WRITE_QUORUM
     if request.quorum < 1 or request.quorum > len(FOLLOWERS):
         raise HTTPException(
             status_code=400,
             detail=f"Quorum must be between 1 and {len(FOLLOWERS)}"
         )
-    old_quorum = WRITE_QUORUM
-    WRITE_QUORUM = request.quorum
+    old_quorum = write_path.write_quorum
+    # Broadcast through the store so every worker sees the new quorum
+    await store.set_config("write_quorum", request.quorum)
     return {
         "status": "updated",
         "old_quorum": old_quorum,
-        "new_quorum": WRITE_QUORUM,
+        "new_quorum": write_path.write_quorum,
         "total_followers": len(FOLLOWERS)
     }
 
 
 @app.get("/config/quorum")
 async def get_quorum():
-    return {"quorum": WRITE_QUORUM, "total_followers": len(FOLLOWERS)}
+    return {"quorum": write_path.write_quorum, "mode": write_path.quorum_mode, "total_followers": len(FOLLOWERS)}
+
+
+@app.post("/config/quorum-mode")
+async def update_quorum_mode(request: QuorumModeRequest):
+    if request.mode not in QUORUM_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Quorum mode must be one of {', '.join(QUORUM_MODES)}"
+        )
+    old_mode = write_path.quorum_mode
+    await store.set_config("quorum_mode", request.mode)
+    return {"status": "updated", "old_mode": old_mode, "new_mode": write_path.quorum_mode}
+
+
+def registries() -> List[Registry]:
+    return [metrics, write_path.metrics]
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of this node, summed over its workers."""
+    return Response(await render_workers(store, registries()), media_type=CONTENT_TYPE)
+
+
+@app.get("/followers")
+async def get_followers():
+    """Per-follower replication latency, failures and ejection state as seen by this worker."""
+    return {"mode": write_path.quorum_mode, "followers": write_path.follower_tracker.snapshot()}
+
+
+if FAST_PATH:
+    fast_path.install(app, [("/keys", "POST", lean_write), ("/keys/{key}", "GET", lean_read)])
 
 
 if __name__ == "__main__":
     import uvicorn
     workers = int(os.getenv("WORKERS", "10"))
+    if workers > 1:
+        start_store_owner(MERKLE_DEPTH, initial_config(), STORAGE_ENGINE)
     uvicorn.run("leader:app", host="0.0.0.0", port=LEADER_PORT, workers=workers)
 
@@ -0,0 +1,91 @@
+"""
+Incrementally maintained hash tree over the key space.
+Used by the leader's anti-entropy task to find and repair divergent keys on followers.
+
+Levels below the leaf buckets are virtual: a node at level L > depth covers the keys whose
+hash starts with its L-bit index, and its hash is computed from its leaf bucket on request.
+Repair descends them down to about one key per node (`repair_level`), so finding a diverged
+key moves O(log n) hashes whatever the bucket size.
+"""
+import hashlib
+from typing import Dict, List, Optional
+
+DEFAULT_DEPTH = 10
+# Deepest virtual level: the key hashes have 64 bits
+MAX_LEVEL = 64
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def key_bucket(key: str, depth: int) -> int:
+    return _hash64(key.encode()) >> (64 - depth) if depth else 0
+
+
+def entry_hash(key: str, value: str) -> int:
+    return _hash64(key.encode() + b"\x00" + value.encode())
+
+
+class MerkleTree:
+    """
+    Binary hash tree with 2**depth leaf buckets. Keys are assigned to buckets by hash,
+    and every node holds the XOR of the entry hashes below it, so a single write
+    updates one path from leaf to root in O(depth).
+    """
+
+    def __init__(self, depth: int = DEFAULT_DEPTH):
+        self.depth = depth
+        self.levels: List[List[int]] = [[0] * (1 << level) for level in range(depth + 1)]
+        self.buckets: List[Dict[str, int]] = [{} for _ in range(1 << depth)]
+
+    def update(self, key: str, value: str):
+        index = key_bucket(key, self.depth)
+        bucket = self.buckets[index]
+        new_hash = entry_hash(key, value)
+        delta = bucket.get(key, 0) ^ new_hash
+        bucket[key] = new_hash
+        self._propagate(index, delta)
+
+    def remove(self, key: str):
+        index = key_bucket(key, self.depth)
+        old_hash = self.buckets[index].pop(key, None)
+        if old_hash is not None:
+            self._propagate(index, old_hash)
+
+    def _propagate(self, index: int, delta: int):
+        if delta == 0:
+            return
+        for level in range(self.depth, -1, -1):
+            self.levels[level][index] ^= delta
+            index >>= 1
+
+    def root(self) -> int:
+        return self.levels[0][0]
+
+    def nodes(self, level: int, indices: List[int]) -> List[int]:
+        if level <= self.depth:
+            return [self.levels[level][index] for index in indices]
+        hashes = []
+        for index in indices:
+            node_hash = 0
+            for entry in self.bucket_hashes(index, level).values():
+                node_hash ^= entry
+            hashes.append(node_hash)
+        return hashes
+
+    def bucket_hashes(self, index: int, level: Optional[int] = None) -> Dict[str, int]:
+        """Entry hashes of the keys under node `index` of `level` (a leaf bucket by default)."""
+        if level is None or level == self.depth:
+            return dict(self.buckets[index])
+        bucket = self.buckets[index >> (level - self.depth)]
+        return {key: entry for key, entry in bucket.items() if key_bucket(key, level) == index}
+
+
+def repair_level(depth: int, keys_count: int) -> int:
+    """The level with about one key per node for `keys_count` keys, and at least the leaf level."""
+    return min(max(depth, keys_count.bit_length()), MAX_LEVEL)
+
+
+def children(indices: List[int]) -> List[int]:
+    return [child for index in indices for child in (2 * index, 2 * index + 1)]
@@ -0,0 +1,243 @@
+"""
+Prometheus metrics for the leader and the followers, without a client library: counters,
+gauges and histograms with labels, rendered in the text exposition format for GET /metrics.
+Recording a sample is a dict lookup and a bisect, and gauges are only read when scraped,
+so the metrics stay on all the time.
+
+With several workers every worker keeps its own metrics and publishes their current values
+to the store, on every scrape and every PUBLISH_INTERVAL_S; /metrics sums the latest values
+of all workers, whichever worker answers. A worker publishes its own values before reading
+the others', so each worker's share, and with it every counter, never goes down from one
+scrape to the next.
+"""
+import asyncio
+import bisect
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds, from 100us (a read on an idle loop) to the 10s replication timeout
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+# Seconds between publishes of a worker's values when it is not scraped
+PUBLISH_INTERVAL_S = 1.0
+
+# Metric name -> label values -> value, as published by one worker
+Snapshot = Dict[str, Dict[Tuple, Any]]
+
+
+def escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def values(self) -> Dict[Tuple, Any]:
+        """Current value per label values."""
+        raise NotImplementedError
+
+    def merge(self, workers: Iterable[Dict[Tuple, Any]]) -> Dict[Tuple, Any]:
+        """Sum of the values of several workers."""
+        merged: Dict[Tuple, Any] = {}
+        for values in workers:
+            for labels, value in values.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def samples(self, values: Dict[Tuple, Any]) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, values: Optional[Dict[Tuple, Any]] = None) -> List[str]:
+        values = self.values() if values is None else values
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples(values)]
+
+
+class Gauge(Metric):
+    """
+    A value read when scraped: `collect` returns it, or with labels a dict of label values
+    (a tuple) to values. Counters the code already keeps are exposed the same way.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Any], labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def values(self) -> Dict[Tuple, Any]:
+        return self.collect() if self.labels else {(): self.collect()}
+
+    def samples(self, values: Dict[Tuple, Any]) -> List[str]:
+        return [f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+                for labels, value in values.items()]
+
+
+class Counter(Gauge):
+    type = "counter"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [count per bucket, the last one above every bound], sum
+        self.series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels: Any):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def values(self) -> Dict[Tuple, Any]:
+        return {labels: [list(counts), total] for labels, (counts, total) in self.series.items()}
+
+    def merge(self, workers: Iterable[Dict[Tuple, Any]]) -> Dict[Tuple, Any]:
+        merged: Dict[Tuple, Any] = {}
+        for values in workers:
+            for labels, (counts, total) in values.items():
+                series = merged.setdefault(labels, [[0] * len(counts), 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+        return merged
+
+    def samples(self, values: Dict[Tuple, Any]) -> List[str]:
+        lines = []
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip([*map(format_value, self.buckets), "+Inf"], counts):
+                cumulative += count
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Any], labels: Sequence[str] = ()) -> Gauge:
+        return self.add(Gauge(name, help, collect, labels))
+
+    def counter(self, name: str, help: str, collect: Callable[[], Any], labels: Sequence[str] = ()) -> Counter:
+        return self.add(Counter(name, help, collect, labels))
+
+    def snapshot(self) -> Snapshot:
+        return {metric.name: metric.values() for metric in self.metrics}
+
+    def render(self, workers: Optional[Sequence[Snapshot]] = None) -> str:
+        """This worker's metrics, or with `workers` the sum of their published snapshots."""
+        return "".join(
+            line + "\n" for metric in self.metrics
+            for line in metric.render(None if workers is None else
+                                      metric.merge(worker.get(metric.name, {}) for worker in workers))
+        )
+
+
+async def publish(store, registries: Sequence[Registry]) -> List[Snapshot]:
+    """Publish this worker's current values to the store; returns every worker's latest ones."""
+    snapshot = {name: values for registry in registries for name, values in registry.snapshot().items()}
+    return list((await store.publish_metrics(os.getpid(), snapshot)).values())
+
+
+async def render_workers(store, registries: Sequence[Registry]) -> str:
+    """GET /metrics: the registries summed over every worker of the node."""
+    workers = await publish(store, registries)
+    return "".join(registry.render(workers) for registry in registries)
+
+
+async def publish_periodically(store, registries: Callable[[], Sequence[Registry]]):
+    """Keep this worker's values in the sum when other workers answer the scrapes."""
+    while True:
+        await asyncio.sleep(PUBLISH_INTERVAL_S)
+        try:
+            await publish(store, registries())
+        except Exception as e:
+            print(f"Error publishing metrics: {e}")
+
+
+class RequestMetrics:
+    """
+    ASGI middleware timing every HTTP request by method, handler and status, and counting the
+    requests in flight. The handler is the endpoint function's name, so paths with keys in
+    them do not each get their own series.
+    """
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.inflight = 0
+        self.latency = registry.histogram("kv_http_request_duration_seconds", "HTTP request latency",
+                                          ("method", "handler", "status"))
+        registry.gauge("kv_http_requests_in_flight", "HTTP requests being handled", lambda: self.inflight)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start_time = time.perf_counter()
+        self.inflight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.inflight -= 1
+            endpoint = scope.get("endpoint")
+            self.latency.observe(time.perf_counter() - start_time, scope["method"],
+                                 endpoint.__name__ if endpoint else "unmatched", status)
+
+
+def add_runtime_metrics(registry: Registry) -> Histogram:
+    """Event-loop lag and task count; returns the lag histogram for `monitor_event_loop`."""
+    registry.gauge("kv_asyncio_tasks", "Tasks alive on the event loop", lambda: len(asyncio.all_tasks()))
+    return registry.histogram("kv_event_loop_lag_seconds",
+                              "How late the event loop ran a timer, i.e. how long it was busy")
+
+
+async def monitor_event_loop(lag: Histogram, interval: float):
+    """Sleep `interval` at a time and record how late each wakeup is."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start_time = loop.time()
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, loop.time() - start_time - interval))
+
+
+def start_monitor(lag: Histogram, interval_ms: int) -> Optional[asyncio.Task]:
+    return asyncio.create_task(monitor_event_loop(lag, interval_ms / 1000.0)) if interval_ms > 0 else None
@@ -0,0 +1,110 @@
+"""
+In-process LRU cache of key/value entries for KVClient, bounded by entry count and bytes.
+The client keeps it coherent by applying the leader's change stream (see KVClient), so an
+entry is only as stale as the watch delivering its invalidation. Entries also expire after
+`max_age_ms`, which bounds staleness if the stream stalls without disconnecting.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+RECENT_CHANGES = 10000
+
+
+class NearCache:
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 2 ** 20,
+                 max_age_ms: Optional[float] = 30000.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_ms / 1000.0 if max_age_ms is not None else None
+        # key -> (value, version, cached_at), least recently used first
+        self.entries: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+        self.bytes = 0
+        # Latest version the change stream reported for recently changed keys, so a read
+        # that raced with a change cannot put the older value back
+        self.recent_changes: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.updates = 0
+
+    @staticmethod
+    def _size(key: str, value: str) -> int:
+        # UTF-8 bytes, as sent on the wire; not the Python objects' memory
+        return len(key.encode()) + len(value.encode())
+
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        entry = self.entries.get(key)
+        if entry is None or (self.max_age is not None and time.monotonic() - entry[2] > self.max_age):
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key: str, value: str, version: int):
+        """Cache an entry read or written by the client, unless a newer version is known."""
+        if version < self.recent_changes.get(key, 0):
+            return
+        current = self.entries.get(key)
+        if current is not None:
+            if current[1] > version:
+                return
+            self._remove(key)
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, version, time.monotonic())
+        self.bytes += size
+        self._evict()
+
+    def apply_change(self, key: str, value: Optional[str], version: int):
+        """A change from the leader's stream: refresh a cached entry in place, or drop it on delete."""
+        self.recent_changes[key] = version
+        self.recent_changes.move_to_end(key)
+        if len(self.recent_changes) > RECENT_CHANGES:
+            self.recent_changes.popitem(last=False)
+        current = self.entries.get(key)
+        if current is None or current[1] >= version:
+            return
+        if value is None:
+            self._remove(key)
+            self.invalidations += 1
+        else:
+            size_change = self._size(key, value) - self._size(key, current[0])
+            self.entries[key] = (value, version, time.monotonic())
+            self.bytes += size_change
+            self.updates += 1
+            self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        value, _, _ = self.entries.pop(key)
+        self.bytes -= self._size(key, value)
+
+    def clear(self):
+        """Drop everything, e.g. when changes may have been missed."""
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.recent_changes.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "updates": self.updates,
+        }
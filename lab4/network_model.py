@@ -0,0 +1,124 @@
+"""
+Network model for a follower: how long each message from the leader takes and whether it
+arrives at all. Messages are delayed by a configurable distribution, lost at a given rate,
+and dropped entirely during partition windows. A lost or partitioned message fails after
+a timeout, which is what the leader would see on a real network.
+
+Delay distributions, in milliseconds:
+    constant:MS
+    uniform:LOW:HIGH
+    exponential:MEAN
+    lognormal:MEDIAN:SIGMA      the log of the delay is normal around log(MEDIAN)
+    pareto:SCALE:ALPHA          at least SCALE, P(delay > x) = (SCALE / x) ** ALPHA
+    bimodal:FAST:SLOW:P_SLOW    around SLOW with probability P_SLOW, else around FAST
+"""
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Spread of each mode of a bimodal delay, as the sigma of a log-normal around its median
+BIMODAL_SIGMA = 0.25
+DISTRIBUTION_PARAMS = {"constant": 1, "uniform": 2, "exponential": 1, "lognormal": 2, "pareto": 2, "bimodal": 3}
+
+
+def parse_delay(spec: str) -> Tuple[str, List[float]]:
+    name, *params = spec.split(":")
+    if DISTRIBUTION_PARAMS.get(name) != len(params):
+        raise ValueError(f"Unknown delay distribution {spec!r}, expected one of "
+                         f"{', '.join(f'{name}:{count} params' for name, count in DISTRIBUTION_PARAMS.items())}")
+    try:
+        values = [float(param) for param in params]
+    except ValueError:
+        raise ValueError(f"Delay distribution {spec!r} has a non-numeric parameter")
+    if any(value < 0 for value in values):
+        raise ValueError(f"Delay distribution {spec!r} has a negative parameter")
+    if name == "pareto" and (values[0] <= 0 or values[1] <= 0):
+        raise ValueError("Pareto scale and alpha must be positive")
+    if name == "bimodal" and values[2] > 1:
+        raise ValueError("Bimodal P_SLOW must be at most 1")
+    return name, values
+
+
+def delay_sampler(spec: str, rng: random.Random) -> Callable[[], float]:
+    """A function drawing delays from `spec`, in seconds."""
+    name, values = parse_delay(spec)
+    if name == "constant":
+        return lambda: values[0] / 1000.0
+    if name == "uniform":
+        return lambda: rng.uniform(values[0], values[1]) / 1000.0
+    if name == "exponential":
+        return lambda: rng.expovariate(1000.0 / values[0]) if values[0] > 0 else 0.0
+    if name == "lognormal":
+        median, sigma = values
+        return lambda: rng.lognormvariate(math.log(median), sigma) / 1000.0 if median > 0 else 0.0
+    if name == "pareto":
+        scale, alpha = values
+        return lambda: scale * rng.paretovariate(alpha) / 1000.0
+    fast, slow, p_slow = values
+
+    def bimodal() -> float:
+        median = slow if rng.random() < p_slow else fast
+        return rng.lognormvariate(math.log(median), BIMODAL_SIGMA) / 1000.0 if median > 0 else 0.0
+    return bimodal
+
+
+def partition_windows(spec: str, started_at: float) -> List[List[float]]:
+    """Parse "START:DURATION,..." in seconds after `started_at` into absolute [from, until] windows."""
+    windows = []
+    for window in filter(None, (part.strip() for part in spec.split(","))):
+        start, duration = (float(value) for value in window.split(":"))
+        windows.append([started_at + start, started_at + start + duration])
+    return windows
+
+
+class NetworkModel:
+    def __init__(self, delay: str = "uniform:0:1000", loss_rate: float = 0.0, timeout_ms: int = 1000,
+                 partitions: Optional[List[List[float]]] = None, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+        self.delay_spec = delay
+        self.sample = delay_sampler(delay, self.rng)
+        self.loss_rate = loss_rate
+        self.timeout_ms = timeout_ms
+        # Absolute [from, until] times during which no message gets through
+        self.partitions = partitions or []
+        self.messages = 0
+        self.lost = 0
+        self.partitioned = 0
+
+    def settings(self) -> Dict[str, Any]:
+        return {"delay": self.delay_spec, "loss_rate": self.loss_rate, "timeout_ms": self.timeout_ms,
+                "partitions": [list(window) for window in self.partitions]}
+
+    def configure(self, settings: Dict[str, Any]):
+        self.sample = delay_sampler(settings["delay"], self.rng)
+        self.delay_spec = settings["delay"]
+        self.loss_rate = settings["loss_rate"]
+        self.timeout_ms = settings["timeout_ms"]
+        self.partitions = settings["partitions"]
+
+    @property
+    def timeout_s(self) -> float:
+        return self.timeout_ms / 1000.0
+
+    def delay(self) -> float:
+        return self.sample()
+
+    def in_partition(self) -> bool:
+        now = time.time()
+        return any(start <= now < until for start, until in self.partitions)
+
+    def fault(self) -> Optional[str]:
+        """Why the next message does not arrive: "partitioned", "lost", or None if it does."""
+        self.messages += 1
+        if self.in_partition():
+            self.partitioned += 1
+            return "partitioned"
+        if self.loss_rate and self.rng.random() < self.loss_rate:
+            self.lost += 1
+            return "lost"
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.settings(), "partitioned_now": self.in_partition(), "messages": self.messages,
+                "lost": self.lost, "dropped_in_partition": self.partitioned}
@@ -1,13 +1,41 @@
 """
 Performance analysis script for the key-value store.
-Tests write performance with different write quorum values.
+Runs YCSB-style workloads for each write quorum and concurrency level: a mix of reads and
+writes over keys chosen uniformly, by a zipfian distribution or favouring the most recently
+inserted keys. Reports throughput and latency per run, the throughput-latency curve and the
+concurrency at which throughput saturates for each quorum, saves the runs as JSON and CSV
+and compares them with a baseline run to flag regressions. With --history it records every
+operation to an NDJSON history, then each node's final state once the cluster settles, and
+checks the history with consistency_checker.py.
+
+Workloads (fraction of reads, default key distribution):
+    write   0%,   uniform    the original write-quorum experiment and the default
+    a       50%,  zipfian    update heavy
+    b       95%,  zipfian    read mostly
+    c       100%, zipfian    read only
+    d       95%,  latest     read latest: writes insert new keys, reads favour the newest
+
+Usage: python performance_analysis.py [--workload write] [--quorum 1,2,3,4,5] [--concurrency 10]
+       [--distribution uniform|zipfian|latest] [--read-ratio R] [--value-size 100]
+       [--operations 100] [--records 10] [--read-from leader|followers]
+       [--output results] [--baseline results.json] [--tolerance 0.15] [--seed 0]
+       [--history history.ndjson] [--sessions]
+Concurrency takes a comma-separated list; with several levels the script plots
+throughput_vs_latency.png, otherwise quorum_vs_latency.png.
 """
+import argparse
 import asyncio
+import csv
 import httpx
+import json
+import random
+import sys
 import time
 import matplotlib.pyplot as plt
 import numpy as np
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+
+from consistency_checker import HistoryRecorder, check, load_history, print_report
 
 LEADER_URL = "http://localhost:8000"
 FOLLOWERS = [
@@ -22,88 +50,310 @@ NUM_WRITES = 100
 NUM_WORKERS = 10  # Number of concurrent workers
 NUM_KEYS = 10
 QUORUM_VALUES = [1, 2, 3, 4, 5]
+VALUE_SIZE = 100
+
+# Workload name -> (fraction of reads, default key distribution)
+WORKLOADS = {
+    "write": (0.0, "uniform"),
+    "a": (0.5, "zipfian"),
+    "b": (0.95, "zipfian"),
+    "c": (1.0, "zipfian"),
+    "d": (0.95, "latest"),
+}
+ZIPFIAN_THETA = 0.99
+# Throughput counts as saturated within this fraction of the best level's
+SATURATION_GAIN = 0.1
+# Fields compared with a baseline run: (field, True if higher is better)
+REGRESSION_FIELDS = [("throughput", True), ("p50_ms", False), ("p99_ms", False)]
+# How long to wait for the followers to catch up before recording final states
+SETTLE_SECONDS = 30
+
+
+class Zipfian:
+    """
+    Zipfian ranks over a growing number of items, rank 0 the most popular, after Gray et
+    al., "Quickly Generating Billion-Record Synthetic Databases", as YCSB draws them.
+    """
+
+    def __init__(self, items: int, rng: random.Random, theta: float = ZIPFIAN_THETA):
+        self.rng = rng
+        self.theta = theta
+        self.alpha = 1.0 / (1.0 - theta)
+        self.zeta2 = 1.0 + 0.5 ** theta
+        self.items = 0
+        self.zetan = 0.0
+        self.grow(items)
+
+    def grow(self, items: int):
+        """Extend the zeta sum incrementally when keys are inserted."""
+        self.zetan += sum(1.0 / (i ** self.theta) for i in range(self.items + 1, items + 1))
+        self.items = items
+        self.eta = (1 - (2.0 / items) ** (1 - self.theta)) / (1 - self.zeta2 / self.zetan)
+
+    def next(self) -> int:
+        u = self.rng.random()
+        uz = u * self.zetan
+        if uz < 1.0:
+            return 0
+        if uz < self.zeta2:
+            return 1
+        return min(int(self.items * (self.eta * u - self.eta + 1) ** self.alpha), self.items - 1)
+
+
+def plan_operations(read_ratio: float, distribution: str, records: int, operations: int,
+                    rng: random.Random) -> List[Tuple[bool, int]]:
+    """
+    Draw the whole run up front as (is_read, key index) pairs, so a seed always gives the same
+    operations whatever the timing. Keys below `records` exist before the run.
+    """
+    zipfian = Zipfian(records, rng) if distribution != "uniform" else None
+    count = records
+    plan = []
+    for _ in range(operations):
+        is_read = rng.random() < read_ratio
+        if distribution == "latest":
+            if is_read:
+                # The newest key is rank 0
+                index = count - 1 - zipfian.next()
+            else:
+                index = count
+                count += 1
+                zipfian.grow(count)
+        elif distribution == "zipfian":
+            index = zipfian.next()
+        else:
+            index = rng.randrange(records)
+        plan.append((is_read, index))
+    return plan
+
 
+def make_value(n: int, size: int) -> str:
+    return f"{n}:".ljust(size, "x")
 
-async def write_key(client: httpx.AsyncClient, key: str, value: str):
-    start_time = time.time()
+
+def percentiles_ms(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {"avg_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    values = np.array(latencies) * 1000
+    return {
+        "avg_ms": float(np.mean(values)),
+        "p50_ms": float(np.median(values)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+async def set_quorum(quorum: int) -> bool:
     try:
-        response = await client.post(
-            f"{LEADER_URL}/keys",
-            json={"key": key, "value": value},
-            timeout=15.0
-        )
-        latency = time.time() - start_time
-        success = response.status_code == 200
-        return latency, success
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            health_response = await client.get(f"{LEADER_URL}/health")
+            if health_response.status_code != 200:
+                print(f"ERROR: Leader not healthy. Skipping quorum {quorum}")
+                return False
+            
+            quorum_response = await client.post(
+                f"{LEADER_URL}/config/quorum",
+                json={"quorum": quorum}
+            )
+            if quorum_response.status_code == 200:
+                quorum_data = quorum_response.json()
+                print(f"Updated quorum: {quorum_data['old_quorum']} -> {quorum_data['new_quorum']}")
+                return True
+            print(f"ERROR: Failed to update quorum: {quorum_response.status_code}")
+            return False
     except Exception as e:
-        latency = time.time() - start_time
-        return latency, False
+        print(f"ERROR: Cannot connect to leader: {e}. Skipping quorum {quorum}")
+        return False
+
+
+async def load_records(client: httpx.AsyncClient, prefix: str, records: int, value_size: int,
+                       history: Optional[HistoryRecorder] = None):
+    """Write the initial records in batches, so reads find them."""
+    for start in range(0, records, 1000):
+        items = [{"key": f"{prefix}{i}", "value": make_value(i, value_size)}
+                 for i in range(start, min(start + 1000, records))]
+        start_time = history.now() if history else 0.0
+        response = await client.post(f"{LEADER_URL}/keys/batch", json={"items": items})
+        response.raise_for_status()
+        if history:
+            end_time = history.now()
+            for item, result in zip(items, response.json()["results"]):
+                history.record(f"{prefix}load", "write", item["key"], item["value"], result["version"], LEADER_URL,
+                               start_time, end_time, True)
 
 
-async def test_quorum(quorum: int) -> Dict:
-    print(f"\nTesting with write quorum = {quorum}")
-    print(f"Using {NUM_WORKERS} concurrent workers")
+def node_of(response: httpx.Response) -> str:
+    """The node that answered, after any redirect to the leader."""
+    return f"{response.url.scheme}://{response.url.host}:{response.url.port}"
+
+
+async def run_workload(client: httpx.AsyncClient, prefix: str, plan: List[Tuple[bool, int]], concurrency: int,
+                       value_size: int, read_from: str, history: Optional[HistoryRecorder] = None,
+                       sessions: bool = False) -> Dict:
+    """
+    Run `plan` with `concurrency` closed-loop workers and measure every operation. Each worker
+    is one process of the history. With `sessions` a worker's reads carry the newest version it
+    has written or read as min_version, so a follower behind it waits or redirects to the leader.
+    """
+    read_latencies, write_latencies = [], []
+    errors = 0
+    misses = 0
+    # Key -> (version, value) of its latest acknowledged write, for the consistency check
+    written: Dict[str, Tuple[int, str]] = {}
+    pending = iter(enumerate(plan))
     
-    limits = httpx.Limits(max_keepalive_connections=NUM_WORKERS * 2, max_connections=100)
-    async with httpx.AsyncClient(timeout=15.0, limits=limits) as client:
-        latencies = []
-        successes = []
-        
-        test_data = [
-            (f"perf_key_{i % NUM_KEYS}", f"value_{i}_{quorum}_{time.time()}")
-            for i in range(NUM_WRITES)
-        ]
-        
-        semaphore = asyncio.Semaphore(NUM_WORKERS)
-        
-        async def write_with_semaphore(key: str, value: str):
-            async with semaphore:
-                return await write_key(client, key, value)
-        
-        tasks = [write_with_semaphore(key, value) for key, value in test_data]
-        
-        results = await asyncio.gather(*tasks)
-        
-        for latency, success in results:
-            latencies.append(latency)
-            successes.append(success)
-        
-        latencies_array = np.array(latencies) if latencies else np.array([])
-        avg_latency = np.mean(latencies_array) if len(latencies_array) > 0 else 0
-        median_latency = np.median(latencies_array) if len(latencies_array) > 0 else 0
-        p95_latency = np.percentile(latencies_array, 95) if len(latencies_array) > 0 else 0
-        p99_latency = np.percentile(latencies_array, 99) if len(latencies_array) > 0 else 0
-        success_rate = sum(successes) / len(successes) if successes else 0
-        
-        print(f"  Average latency: {avg_latency:.4f} seconds")
-        print(f"  Median latency: {median_latency:.4f} seconds")
-        print(f"  P95 latency: {p95_latency:.4f} seconds")
-        print(f"  P99 latency: {p99_latency:.4f} seconds")
-        print(f"  Success rate: {success_rate:.2%}")
-        print(f"  Total writes: {len(successes)}")
-        
-        return {
-            "quorum": quorum,
-            "avg_latency": avg_latency,
-            "median_latency": median_latency,
-            "p95_latency": p95_latency,
-            "p99_latency": p99_latency,
-            "latencies": latencies,
-            "success_rate": success_rate,
-            "test_data": test_data
-        }
+    async def worker(process: str):
+        nonlocal errors, misses
+        seen_version = 0
+        for n, (is_read, index) in pending:
+            key = f"{prefix}{index}"
+            start_time = time.perf_counter()
+            op_start = history.now() if history else 0.0
+            try:
+                if is_read:
+                    node = LEADER_URL if read_from == "leader" else FOLLOWERS[n % len(FOLLOWERS)]
+                    params = {"min_version": seen_version} if sessions and seen_version else None
+                    response = await client.get(f"{node}/keys/{key}", params=params, follow_redirects=True)
+                    ok = response.status_code in (200, 404)
+                    if history:
+                        found = response.json() if response.status_code == 200 else {"value": None, "version": 0}
+                        history.record(process, "read", key, found["value"], found["version"], node_of(response),
+                                       op_start, history.now(), ok)
+                    # A read of a key whose insert is still in flight finds nothing
+                    if response.status_code == 404:
+                        misses += 1
+                    elif not ok:
+                        errors += 1
+                        continue
+                    else:
+                        seen_version = max(seen_version, response.json()["version"])
+                    read_latencies.append(time.perf_counter() - start_time)
+                else:
+                    value = make_value(n, value_size)
+                    response = await client.post(f"{LEADER_URL}/keys", json={"key": key, "value": value})
+                    version = response.json()["version"] if response.status_code == 200 else None
+                    if history:
+                        history.record(process, "write", key, value, version, LEADER_URL, op_start, history.now(),
+                                       version is not None)
+                    if version is None:
+                        errors += 1
+                        continue
+                    write_latencies.append(time.perf_counter() - start_time)
+                    seen_version = max(seen_version, version)
+                    if version > written.get(key, (0, None))[0]:
+                        written[key] = (version, value)
+            except httpx.HTTPError:
+                errors += 1
+                if history and not is_read:
+                    # The write may still have taken effect
+                    history.record(process, "write", key, value, None, LEADER_URL, op_start, history.now(), False)
+    
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker(f"{prefix}w{i}") for i in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    
+    reads, writes = percentiles_ms(read_latencies), percentiles_ms(write_latencies)
+    return {
+        "concurrency": concurrency,
+        "operations": len(plan),
+        "throughput": (len(read_latencies) + len(write_latencies)) / elapsed,
+        **percentiles_ms(read_latencies + write_latencies),
+        **{f"read_{name}": value for name, value in reads.items()},
+        **{f"write_{name}": value for name, value in writes.items()},
+        "success_rate": 1 - errors / len(plan),
+        "read_misses": misses,
+        "test_data": [(key, value) for key, (_, value) in written.items()]
+    }
+
+
+def saturation_point(runs: List[Dict]) -> Optional[Dict]:
+    """
+    The lowest concurrency level whose throughput is within SATURATION_GAIN of the best one;
+    more workers beyond it only add latency. None if throughput still grows by more than
+    that at the highest level.
+    """
+    runs = sorted(runs, key=lambda run: run["concurrency"])
+    best = max(runs, key=lambda run: run["throughput"])
+    if best is runs[-1] and len(runs) > 1 and best["throughput"] > runs[-2]["throughput"] * (1 + SATURATION_GAIN):
+        return None
+    return next(run for run in runs if run["throughput"] >= best["throughput"] * (1 - SATURATION_GAIN))
+
+
+def run_id(run: Dict) -> Tuple:
+    return (run["workload"], run["distribution"], run["read_ratio"], run["value_size"], run["quorum"],
+            run["concurrency"], run["read_from"])
+
+
+def compare_with_baseline(runs: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Regressions of more than `tolerance` against the baseline run with the same settings."""
+    baseline_runs = {run_id(run): run for run in baseline}
+    regressions = []
+    for run in runs:
+        before = baseline_runs.get(run_id(run))
+        if before is None:
+            continue
+        for field, higher_is_better in REGRESSION_FIELDS:
+            old, new = before.get(field), run.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"quorum {run['quorum']}, concurrency {run['concurrency']}: "
+                                   f"{field} {old:.1f} -> {new:.1f} ({change:+.0%})")
+    return regressions
+
+
+def save_results(path: str, config: Dict, runs: List[Dict]):
+    rows = [{name: value for name, value in run.items() if name != "test_data"} for run in runs]
+    with open(f"{path}.json", "w") as f:
+        json.dump({"config": config, "runs": rows}, f, indent=2)
+    with open(f"{path}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results saved to {path}.json and {path}.csv")
+
+
+async def stream_export(client: httpx.AsyncClient, url: str) -> AsyncIterator[Dict]:
+    """Yield the records of a node's NDJSON export one at a time."""
+    async with client.stream("GET", f"{url}/export") as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                yield json.loads(line)
+
+
+async def read_export(client: httpx.AsyncClient, url: str, keys: set) -> Dict:
+    """Stream a node's export, keeping only the values of `keys` and the total key count."""
+    values = {}
+    total_keys = None
+    async for record in stream_export(client, url):
+        if "key" in record:
+            if record["key"] in keys:
+                values[record["key"]] = record["value"]
+        elif record.get("end"):
+            total_keys = record["count"]
+    if total_keys is None:
+        raise RuntimeError(f"Export from {url} ended early")
+    return {"values": values, "total_keys": total_keys}
 
 
 async def verify_consistency(test_data: List[tuple]) -> Dict:
+    keys = {key for key, _ in test_data}
     async with httpx.AsyncClient(timeout=15.0) as client:
-        leader_response = await client.get(f"{LEADER_URL}/state")
-        leader_store = leader_response.json()["store"]
+        leader_export = await read_export(client, LEADER_URL, keys)
+        leader_root = (await client.get(f"{LEADER_URL}/merkle")).json()["root"]
         
         consistency_results = {}
         
         for follower_url in FOLLOWERS:
-            follower_response = await client.get(f"{follower_url}/state")
-            follower_store = follower_response.json()["store"]
+            # Matching Merkle roots mean identical stores, so skip the follower's export
+            follower_root = (await client.get(f"{follower_url}/merkle")).json()["root"]
+            if follower_root == leader_root:
+                follower_export = leader_export
+            else:
+                follower_export = await read_export(client, follower_url, keys)
+            follower_store = follower_export["values"]
             
             missing_keys = []
             mismatched_values = []
@@ -117,8 +367,8 @@ async def verify_consistency(test_data: List[tuple]) -> Dict:
             consistency_results[follower_url] = {
                 "missing_keys": len(missing_keys),
                 "mismatched_values": len(mismatched_values),
-                "total_keys_in_leader": len(leader_store),
-                "total_keys_in_follower": len(follower_store),
+                "total_keys_in_leader": leader_export["total_keys"],
+                "total_keys_in_follower": follower_export["total_keys"],
                 "missing_keys_list": missing_keys[:10],  # First 10 for debugging
                 "mismatched_list": mismatched_values[:10]  # First 10 for debugging
             }
@@ -126,63 +376,38 @@ async def verify_consistency(test_data: List[tuple]) -> Dict:
         return consistency_results
 
 
-async def main():
-    """Main function to run performance analysis."""
-    print("=" * 60)
-    print("Performance Analysis: Write Quorum vs Latency")
-    print("=" * 60)
-    print(f"Total writes: {NUM_WRITES}")
-    print(f"Concurrent batch size: {NUM_WORKERS}")
-    print(f"Number of keys: {NUM_KEYS}")
-    print(f"Quorum values to test: {QUORUM_VALUES}")
-    print("\nNOTE: This script assumes docker-compose is running.")
-    print("Quorum will be updated via API endpoint (no docker-compose modification needed)")
-    print("=" * 60)
-    
-    results = []
+async def record_final_states(client: httpx.AsyncClient, history: HistoryRecorder):
+    """
+    Wait up to SETTLE_SECONDS for every follower's Merkle root to match the leader's, then
+    record each node's state of the history's keys, version 0 where a node lacks one.
+    """
+    nodes = [LEADER_URL, *FOLLOWERS]
+    deadline = time.monotonic() + SETTLE_SECONDS
+    while True:
+        roots = {(await client.get(f"{url}/merkle")).json()["root"] for url in nodes}
+        if len(roots) == 1:
+            break
+        if time.monotonic() > deadline:
+            print(f"WARNING: Nodes still differ after {SETTLE_SECONDS}s, recording their states anyway")
+            break
+        await asyncio.sleep(0.5)
     
-    for quorum in QUORUM_VALUES:
-        print(f"\n{'='*60}")
-        print(f"Testing with WRITE_QUORUM={quorum}")
-        print(f"{'='*60}")
-        
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                health_response = await client.get(f"{LEADER_URL}/health")
-                if health_response.status_code != 200:
-                    print(f"ERROR: Leader not healthy. Skipping quorum {quorum}")
-                    continue
-                
-                quorum_response = await client.post(
-                    f"{LEADER_URL}/config/quorum",
-                    json={"quorum": quorum}
-                )
-                if quorum_response.status_code == 200:
-                    quorum_data = quorum_response.json()
-                    print(f"Updated quorum: {quorum_data['old_quorum']} -> {quorum_data['new_quorum']}")
-                else:
-                    print(f"ERROR: Failed to update quorum: {quorum_response.status_code}")
-                    continue
-        except Exception as e:
-            print(f"ERROR: Cannot connect to leader: {e}. Skipping quorum {quorum}")
-            continue
-        
-        result = await test_quorum(quorum)
-        results.append(result)
-        
-        print("\nVerifying consistency...")
-        consistency = await verify_consistency(result["test_data"])
-        for follower_url, stats in consistency.items():
-            print(f"  {follower_url}:")
-            print(f"    Missing keys: {stats['missing_keys']}")
-            print(f"    Mismatched values: {stats['mismatched_values']}")
-            print(f"    Leader keys: {stats['total_keys_in_leader']}, Follower keys: {stats['total_keys_in_follower']}")
-    
-    quorums = [r["quorum"] for r in results]
-    avg_latencies = [r["avg_latency"] for r in results]
-    median_latencies = [r["median_latency"] for r in results]
-    p95_latencies = [r["p95_latency"] for r in results]
-    p99_latencies = [r["p99_latency"] for r in results]
+    for url in nodes:
+        missing = set(history.keys)
+        async for record in stream_export(client, url):
+            if record.get("key") in missing:
+                missing.discard(record["key"])
+                history.record_final(url, record["key"], record["value"], record["version"])
+        for key in sorted(missing):
+            history.record_final(url, key, None, 0)
+
+
+def plot_quorum_vs_latency(runs: List[Dict], operations: int, concurrency: int, records: int):
+    quorums = [r["quorum"] for r in runs]
+    avg_latencies = [r["avg_ms"] for r in runs]
+    median_latencies = [r["p50_ms"] for r in runs]
+    p95_latencies = [r["p95_ms"] for r in runs]
+    p99_latencies = [r["p99_ms"] for r in runs]
     
     plt.figure(figsize=(12, 7))
     
@@ -196,30 +421,177 @@ async def main():
              label='P99', color='red')
     
     plt.xlabel('Write Quorum', fontsize=12)
-    plt.ylabel('Latency (seconds)', fontsize=12)
-    plt.title('Write Quorum vs Latency Metrics\n(100 writes, 10 concurrent batches, 10 keys)', fontsize=14)
+    plt.ylabel('Latency (ms)', fontsize=12)
+    plt.title(f'Write Quorum vs Latency Metrics\n({operations} operations, {concurrency} concurrent workers, '
+              f'{records} keys)', fontsize=14)
     plt.grid(True, alpha=0.3)
     plt.xticks(quorums)
     plt.legend(loc='best', fontsize=10)
     
     for i, (q, lat) in enumerate(zip(quorums, avg_latencies)):
-        plt.annotate(f'{lat:.3f}s', (q, lat), textcoords="offset points", 
+        plt.annotate(f'{lat:.0f}ms', (q, lat), textcoords="offset points", 
                     xytext=(0,10), ha='center', fontsize=8, color='blue')
     
     plt.tight_layout()
     plt.savefig('quorum_vs_latency.png', dpi=300, bbox_inches='tight')
     print(f"\nPlot saved to quorum_vs_latency.png")
+
+
+def plot_throughput_vs_latency(runs: List[Dict], workload: str):
+    plt.figure(figsize=(12, 7))
+    for quorum in sorted({r["quorum"] for r in runs}):
+        curve = sorted((r for r in runs if r["quorum"] == quorum), key=lambda r: r["concurrency"])
+        throughputs = [r["throughput"] for r in curve]
+        p99_latencies = [r["p99_ms"] for r in curve]
+        plt.plot(throughputs, p99_latencies, marker='o', linewidth=2, markersize=6, label=f'Quorum {quorum}')
+        for r in curve:
+            plt.annotate(str(r["concurrency"]), (r["throughput"], r["p99_ms"]), textcoords="offset points",
+                         xytext=(0, 8), ha='center', fontsize=8)
+    
+    plt.xlabel('Throughput (ops/s)', fontsize=12)
+    plt.ylabel('P99 latency (ms)', fontsize=12)
+    plt.title(f'Throughput vs P99 Latency, workload {workload}\n(points labelled with concurrency)', fontsize=14)
+    plt.grid(True, alpha=0.3)
+    plt.legend(loc='best', fontsize=10)
+    plt.tight_layout()
+    plt.savefig('throughput_vs_latency.png', dpi=300, bbox_inches='tight')
+    print(f"\nPlot saved to throughput_vs_latency.png")
+
+
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",")]
+
+
+async def main():
+    """Main function to run performance analysis."""
+    parser = argparse.ArgumentParser(description="YCSB-style workloads against the cluster, per write quorum.")
+    parser.add_argument("--workload", choices=list(WORKLOADS), default="write")
+    parser.add_argument("--read-ratio", type=float, help="Fraction of reads, overriding the workload's")
+    parser.add_argument("--distribution", choices=["uniform", "zipfian", "latest"],
+                        help="Key distribution, overriding the workload's")
+    parser.add_argument("--quorum", type=int_list, default=QUORUM_VALUES)
+    parser.add_argument("--concurrency", type=int_list, default=[NUM_WORKERS])
+    parser.add_argument("--operations", type=int, default=NUM_WRITES, help="Operations per run")
+    parser.add_argument("--records", type=int, default=NUM_KEYS, help="Keys loaded before the runs")
+    parser.add_argument("--value-size", type=int, default=VALUE_SIZE)
+    parser.add_argument("--read-from", choices=["leader", "followers"], default="leader")
+    parser.add_argument("--output", default="results", help="Results are saved to OUTPUT.json and OUTPUT.csv")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change flagged as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", help="Record every operation to this NDJSON file and check it afterwards")
+    parser.add_argument("--sessions", action="store_true",
+                        help="Reads carry the newest version their worker has seen as min_version")
+    args = parser.parse_args()
+    read_ratio, distribution = WORKLOADS[args.workload]
+    read_ratio = args.read_ratio if args.read_ratio is not None else read_ratio
+    distribution = args.distribution or distribution
+    
+    print("=" * 60)
+    print("Performance Analysis: Write Quorum vs Throughput and Latency")
+    print("=" * 60)
+    print(f"Workload: {args.workload} ({read_ratio:.0%} reads from {args.read_from}, {distribution} keys)")
+    print(f"Operations per run: {args.operations}, records: {args.records}, value size: {args.value_size}")
+    print(f"Concurrency levels: {args.concurrency}")
+    print(f"Quorum values to test: {args.quorum}")
+    if args.history:
+        print(f"Recording history to {args.history}{', with session tokens' if args.sessions else ''}")
+    print("\nNOTE: This script assumes docker-compose is running.")
+    print("Quorum will be updated via API endpoint (no docker-compose modification needed)")
+    print("=" * 60)
+    
+    runs = []
+    history = HistoryRecorder(args.history) if args.history else None
+    limits = httpx.Limits(max_keepalive_connections=max(args.concurrency) * 2, max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=15.0, limits=limits) as client:
+        for quorum in args.quorum:
+            print(f"\n{'='*60}")
+            print(f"Testing with WRITE_QUORUM={quorum}")
+            print(f"{'='*60}")
+            if not await set_quorum(quorum):
+                continue
+            
+            test_data = []
+            for concurrency in args.concurrency:
+                # Fresh keys for every run, so each one starts from the same records
+                prefix = f"perf_{args.workload}_q{quorum}_c{concurrency}_{int(time.time())}_"
+                if read_ratio > 0 or distribution == "latest":
+                    await load_records(client, prefix, args.records, args.value_size, history)
+                plan = plan_operations(read_ratio, distribution, args.records, args.operations,
+                                       random.Random(f"{args.seed}:{quorum}:{concurrency}"))
+                result = await run_workload(client, prefix, plan, concurrency, args.value_size, args.read_from,
+                                            history, args.sessions)
+                test_data.extend(result.pop("test_data"))
+                run = {"workload": args.workload, "distribution": distribution, "read_ratio": read_ratio,
+                       "value_size": args.value_size, "quorum": quorum, "read_from": args.read_from, **result}
+                runs.append(run)
+                print(f"  Concurrency {concurrency}: {run['throughput']:.1f} ops/s, "
+                      f"p50 {run['p50_ms']:.1f}ms, p99 {run['p99_ms']:.1f}ms, "
+                      f"success rate {run['success_rate']:.2%}")
+            
+            if test_data:
+                print("\nVerifying consistency...")
+                consistency = await verify_consistency(test_data)
+                for follower_url, stats in consistency.items():
+                    print(f"  {follower_url}:")
+                    print(f"    Missing keys: {stats['missing_keys']}")
+                    print(f"    Mismatched values: {stats['mismatched_values']}")
+                    print(f"    Leader keys: {stats['total_keys_in_leader']}, Follower keys: {stats['total_keys_in_follower']}")
+        
+        if history:
+            await record_final_states(client, history)
+            history.close()
+    
+    if not runs:
+        print("No runs completed")
+        return 1
+    
+    if len(args.concurrency) > 1:
+        plot_throughput_vs_latency(runs, args.workload)
+    else:
+        plot_quorum_vs_latency(runs, args.operations, args.concurrency[0], args.records)
     
     print("\n" + "=" * 60)
     print("Summary:")
     print("=" * 60)
-    print(f"{'Quorum':<8} {'Average':<10} {'Median':<10} {'P95':<10} {'P99':<10} {'Success Rate':<12}")
-    print("-" * 60)
-    for r in results:
-        print(f"{r['quorum']:<8} {r['avg_latency']:<10.4f} {r['median_latency']:<10.4f} "
-              f"{r['p95_latency']:<10.4f} {r['p99_latency']:<10.4f} {r['success_rate']:<12.2%}")
+    print(f"{'Quorum':<8} {'Workers':<8} {'Ops/s':<10} {'Average':<10} {'Median':<10} {'P95':<10} {'P99':<10} "
+          f"{'Success Rate':<12}")
+    print("-" * 80)
+    for r in runs:
+        print(f"{r['quorum']:<8} {r['concurrency']:<8} {r['throughput']:<10.1f} {r['avg_ms']:<10.1f} "
+              f"{r['p50_ms']:<10.1f} {r['p95_ms']:<10.1f} {r['p99_ms']:<10.1f} {r['success_rate']:<12.2%}")
     
+    if len(args.concurrency) > 1:
+        print(f"\nSaturation (fewest workers within {SATURATION_GAIN:.0%} of the best throughput):")
+        for quorum in sorted({r["quorum"] for r in runs}):
+            point = saturation_point([r for r in runs if r["quorum"] == quorum])
+            if point is None:
+                print(f"  Quorum {quorum}: not saturated at {max(args.concurrency)} workers")
+            else:
+                print(f"  Quorum {quorum}: {point['throughput']:.1f} ops/s at {point['concurrency']} workers, "
+                      f"p99 {point['p99_ms']:.1f}ms")
+    
+    save_results(args.output, {**vars(args), "read_ratio": read_ratio, "distribution": distribution}, runs)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["runs"]
+        regressions = compare_with_baseline(runs, baseline, args.tolerance)
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("  No regressions")
+    
+    if history:
+        print(f"\nConsistency of {history.operations} recorded operations ({args.history}):")
+        violations = check(load_history(args.history))
+        print_report(violations)
+        if any(violations.values()):
+            return 1
+    return 0
 
-if __name__ == "__main__":
-    asyncio.run(main())
 
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
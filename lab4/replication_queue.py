@@ -0,0 +1,152 @@
+"""
+Per-follower replication queue on the leader with write coalescing.
+Only a bounded number of messages per follower are in flight; writes queued behind them
+that hit a key already waiting in the queue replace the older value instead of being
+shipped separately. Every write waiting on a replaced value is acked together with the
+value that replaced it, since the follower then holds something at least as new.
+
+The writes held for a follower, queued or in flight, are bounded too. A follower too far
+behind to take `max_held` more gets none: they fail at once, and `on_overflow` is called
+once everything held for it has been answered, so anti-entropy can repair the follower
+instead of the leader buffering everything it missed.
+"""
+import asyncio
+import functools
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+# (key, value or None for a delete, version, versions this value superseded without being
+# shipped, expiry time or 0)
+ShipItem = Tuple[str, Optional[str], int, List[int], float]
+
+
+class PendingEntry:
+    __slots__ = ("key", "value", "version", "expires_at", "superseded", "waiters")
+
+    def __init__(self, key: str, value: Optional[str], version: int, expires_at: float, waiter: asyncio.Future):
+        self.key = key
+        self.value = value
+        self.version = version
+        self.expires_at = expires_at
+        self.superseded: List[int] = []
+        self.waiters: List[asyncio.Future] = [waiter]
+
+
+class ReplicationQueue:
+    def __init__(self, send: Callable[[List[ShipItem]], Awaitable[bool]], coalesce: bool = True,
+                 max_inflight: int = 16, max_items: int = 100, max_held: int = 10000,
+                 on_overflow: Optional[Callable[[], None]] = None):
+        self.send = send
+        self.coalesce = coalesce
+        # Without coalescing every write is shipped on its own, immediately
+        self.max_inflight = max_inflight if coalesce else float("inf")
+        self.max_items = max_items if coalesce else 1
+        self.max_held = max_held
+        self.on_overflow = on_overflow
+        self.overflowed = False
+        self.queue: Deque[PendingEntry] = deque()
+        self.unshipped: Dict[str, PendingEntry] = {}
+        self.inflight = 0
+        self.coalesced = 0
+        self.messages = 0
+        self.dropped = 0
+        # Entries queued or in flight, whose values the queue holds
+        self.held = 0
+        # Messages in flight, referenced here so they are not garbage collected
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, items: List[Tuple[str, Optional[str], int, float]]) -> bool:
+        """Queue writes (key, value, version, expires_at) for this follower; True once the follower acked all of them."""
+        if self.held + len(items) > self.max_held:
+            self.dropped += len(items)
+            self.overflowed = True
+            self._notify_if_drained()
+            return False
+        waiters = [self._enqueue(*item) for item in items]
+        self._ship_ready()
+        results = await asyncio.gather(*waiters)
+        return all(results)
+
+    def _enqueue(self, key: str, value: Optional[str], version: int, expires_at: float) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        entry = self.unshipped.get(key) if self.coalesce else None
+        if entry is not None and version > entry.version:
+            entry.superseded.append(entry.version)
+            entry.value = value
+            entry.version = version
+            entry.expires_at = expires_at
+            entry.waiters.append(waiter)
+            self.coalesced += 1
+            return waiter
+        entry = PendingEntry(key, value, version, expires_at, waiter)
+        self.queue.append(entry)
+        self.held += 1
+        if self.coalesce:
+            self.unshipped[key] = entry
+        return waiter
+
+    def _ship_ready(self):
+        while self.queue and self.inflight < self.max_inflight:
+            entries = []
+            while self.queue and len(entries) < self.max_items:
+                entry = self.queue.popleft()
+                if self.unshipped.get(entry.key) is entry:
+                    del self.unshipped[entry.key]
+                entries.append(entry)
+            self.inflight += 1
+            self.messages += 1
+            task = asyncio.create_task(self._ship(entries))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            task.add_done_callback(functools.partial(self._shipped, entries))
+
+    async def _ship(self, entries: List[PendingEntry]) -> bool:
+        try:
+            return await self.send([(entry.key, entry.value, entry.version, entry.superseded, entry.expires_at)
+                                    for entry in entries])
+        except Exception as e:
+            print(f"Error shipping replication message: {e}")
+            return False
+
+    def _shipped(self, entries: List[PendingEntry], task: asyncio.Task):
+        # A done callback, so it also runs for a message cancelled by close() before it started
+        self.inflight -= 1
+        self.held -= len(entries)
+        self._answer(entries, not task.cancelled() and task.result())
+        if not task.cancelled():
+            self._ship_ready()
+            self._notify_if_drained()
+
+    @staticmethod
+    def _answer(entries: List[PendingEntry], ok: bool):
+        for entry in entries:
+            for waiter in entry.waiters:
+                if not waiter.done():
+                    waiter.set_result(ok)
+
+    async def close(self):
+        """Fail the queued writes and cancel the messages in flight."""
+        queued = list(self.queue)
+        self.queue.clear()
+        self.unshipped.clear()
+        self.held -= len(queued)
+        self._answer(queued, False)
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _notify_if_drained(self):
+        if self.overflowed and not self.held:
+            self.overflowed = False
+            if self.on_overflow:
+                self.on_overflow()
+
+    def snapshot(self) -> Dict:
+        return {
+            "queued": len(self.queue),
+            "inflight_messages": self.inflight,
+            "messages": self.messages,
+            "coalesced_writes": self.coalesced,
+            "dropped_writes": self.dropped,
+        }
@@ -0,0 +1,194 @@
+"""
+Binary replication transport: one long-lived TCP connection per follower carrying
+length-prefixed frames. Many replication messages can be in flight on a connection at
+once; the follower acks each one by request id as soon as it is applied.
+
+Frame layout (all integers big-endian):
+    frame     = length:u32 payload
+    replicate = type:u8 request_id:u32 term:u64 count:u32 item*
+    item      = version:u64 key_len:u32 value_len:u32 superseded_count:u32 expires_at:f64
+                key:bytes value:bytes superseded:u64*
+    ack       = type:u8 request_id:u32 ok:u8
+
+A value_len of 0xFFFFFFFF marks a delete (no value bytes follow); expires_at is 0 for
+keys without a TTL. `term` is the sender's election term; followers refuse messages from a
+leader whose term is over.
+"""
+import asyncio
+import itertools
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+MSG_REPLICATE = 1
+MSG_ACK = 2
+
+FRAME_HEADER = struct.Struct("!I")
+MESSAGE_HEADER = struct.Struct("!BI")
+REPLICATE_HEADER = struct.Struct("!QI")
+ITEM_HEADER = struct.Struct("!QIIId")
+ACK_STATUS = struct.Struct("!B")
+DELETED_VALUE = 0xFFFFFFFF
+
+# (key, value or None for a delete, version, versions superseded by this value, expires_at)
+Item = Tuple[str, Optional[str], int, List[int], float]
+
+
+def encode_replicate(request_id: int, items: List[Item], term: int = 0) -> bytes:
+    parts = [MESSAGE_HEADER.pack(MSG_REPLICATE, request_id), REPLICATE_HEADER.pack(term, len(items))]
+    for key, value, version, superseded, expires_at in items:
+        key_bytes = key.encode()
+        value_bytes = value.encode() if value is not None else b""
+        value_length = len(value_bytes) if value is not None else DELETED_VALUE
+        parts.append(ITEM_HEADER.pack(version, len(key_bytes), value_length, len(superseded), expires_at))
+        parts.append(key_bytes)
+        parts.append(value_bytes)
+        if superseded:
+            parts.append(struct.pack(f"!{len(superseded)}Q", *superseded))
+    payload = b"".join(parts)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_replicate(payload: bytes) -> Tuple[int, int, List[Item]]:
+    message_type, request_id = MESSAGE_HEADER.unpack_from(payload, 0)
+    if message_type != MSG_REPLICATE:
+        raise ValueError(f"Unexpected message type {message_type}")
+    offset = MESSAGE_HEADER.size
+    term, count = REPLICATE_HEADER.unpack_from(payload, offset)
+    offset += REPLICATE_HEADER.size
+    items = []
+    for _ in range(count):
+        version, key_length, value_length, superseded_count, expires_at = ITEM_HEADER.unpack_from(payload, offset)
+        offset += ITEM_HEADER.size
+        key = payload[offset:offset + key_length].decode()
+        offset += key_length
+        if value_length == DELETED_VALUE:
+            value = None
+        else:
+            value = payload[offset:offset + value_length].decode()
+            offset += value_length
+        superseded = list(struct.unpack_from(f"!{superseded_count}Q", payload, offset))
+        offset += 8 * superseded_count
+        items.append((key, value, version, superseded, expires_at))
+    return request_id, term, items
+
+
+def encode_ack(request_id: int, ok: bool) -> bytes:
+    payload = MESSAGE_HEADER.pack(MSG_ACK, request_id) + ACK_STATUS.pack(1 if ok else 0)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_ack(payload: bytes) -> Tuple[int, bool]:
+    message_type, request_id = MESSAGE_HEADER.unpack_from(payload, 0)
+    if message_type != MSG_ACK:
+        raise ValueError(f"Unexpected message type {message_type}")
+    (status,) = ACK_STATUS.unpack_from(payload, MESSAGE_HEADER.size)
+    return request_id, status == 1
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return await reader.readexactly(length)
+
+
+class StreamReplicator:
+    """Leader-side connection to one follower's replication port."""
+
+    def __init__(self, host: str, port: int, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count()
+        self.connect_lock = asyncio.Lock()
+
+    async def _ensure_connected(self):
+        async with self.connect_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port),
+                timeout=self.timeout
+            )
+            self.reader_task = asyncio.create_task(self._read_acks(self.reader, self.writer))
+
+    async def _read_acks(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_id, ok = decode_ack(await read_frame(reader))
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(ok)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError) as e:
+            writer.close()
+            if self.writer is not writer:
+                return
+            self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Replication stream closed: {e}"))
+            self.pending.clear()
+
+    async def replicate(self, items: List[Item], term: int = 0) -> bool:
+        await self._ensure_connected()
+        request_id = next(self.request_ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        writer = self.writer
+        writer.write(encode_replicate(request_id, items, term))
+
+        async def sent_and_acked() -> bool:
+            # Waits while the follower is not reading, instead of buffering without bound
+            await writer.drain()
+            return await future
+
+        try:
+            return await asyncio.wait_for(sent_and_acked(), timeout=self.timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+async def serve_replication(port: int, apply_items: Callable[[List[Item], int], Awaitable]) -> asyncio.AbstractServer:
+    """
+    Follower-side replication listener. Each message is applied in its own task and acked
+    when done, so a slow message does not hold up the ones behind it.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks: Set[asyncio.Task] = set()
+
+        async def apply_and_ack(request_id: int, term: int, items: List[Item]):
+            try:
+                await apply_items(items, term)
+                ok = True
+            except Exception as e:
+                print(f"Error applying replicated items: {e}")
+                ok = False
+            if not writer.is_closing():
+                writer.write(encode_ack(request_id, ok))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+        try:
+            while True:
+                request_id, term, items = decode_replicate(await read_frame(reader))
+                task = asyncio.create_task(apply_and_ack(request_id, term, items))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # reuse_port lets every uvicorn worker listen on the same replication port
+    return await asyncio.start_server(handle, host="0.0.0.0", port=port, reuse_port=True)
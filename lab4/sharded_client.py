@@ -0,0 +1,231 @@
+"""
+Client-side sharding across several leader groups (a leader and its followers each). Keys
+are placed on groups with a consistent hash ring, so writes spread over all leaders and
+each group replicates only its own keys.
+
+Adding or removing a group is a two-step migration:
+1. Every client calls `add_group` / `remove_group`. From then on writes go to the key's new
+   owner, and reads that miss there fall back to the previous owner.
+2. One client calls `rebalance()`, which scans every previous group's leader and moves the
+   keys whose owner changed. The other clients then call `finish_migration()`.
+
+    groups = {"g1": ("http://localhost:8000", ["http://localhost:8001"]),
+              "g2": ("http://localhost:8100", ["http://localhost:8101"])}
+    async with ShardedKVClient(groups) as kv:
+        await kv.set("user:1", "alice")
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from hash_ring import DEFAULT_VNODES, HashRing
+from kv_client import KVClient
+
+REBALANCE_PAGE_SIZE = 1000
+MOVE_RETRIES = 3
+
+
+class ShardedKVClient:
+    def __init__(self, groups: Dict[str, Tuple[str, Sequence[str]]], vnodes: int = DEFAULT_VNODES,
+                 **client_options):
+        self.client_options = client_options
+        self.clients: Dict[str, KVClient] = {
+            name: KVClient(leader_url, follower_urls, **client_options)
+            for name, (leader_url, follower_urls) in groups.items()
+        }
+        self.ring = HashRing(groups, vnodes)
+        # The ring before the last group change, while its keys are being moved
+        self.previous_ring: Optional[HashRing] = None
+
+    async def __aenter__(self) -> "ShardedKVClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
+
+    def client_for(self, key: str) -> KVClient:
+        return self.clients[self.ring.owner(key)]
+
+    def _previous_client(self, key: str) -> Optional[KVClient]:
+        """The key's previous owner while a migration moves it, otherwise None."""
+        if self.previous_ring is None:
+            return None
+        previous = self.previous_ring.owner(key)
+        return self.clients[previous] if previous != self.ring.owner(key) else None
+
+    # Reads and writes
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None) -> int:
+        """Write a key on its owner group; the version is that group's."""
+        return await self.client_for(key).set(key, value, ttl_ms)
+
+    async def set_many(self, items: Dict[str, str], ttl_ms: Optional[int] = None) -> Dict[str, int]:
+        versions = await asyncio.gather(*(self.set(key, value, ttl_ms) for key, value in items.items()))
+        return dict(zip(items, versions))
+
+    async def get(self, key: str, consistency: Optional[str] = None) -> Optional[str]:
+        entry = await self.get_entry(key, consistency)
+        return entry[0] if entry is not None else None
+
+    async def get_entry(self, key: str, consistency: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        entry = await self.client_for(key).get_entry(key, consistency)
+        previous = self._previous_client(key)
+        if entry is None and previous is not None:
+            # Not moved yet
+            entry = await previous.get_entry(key, consistency)
+        return entry
+
+    async def get_many(self, keys: Sequence[str], consistency: Optional[str] = None) -> Dict[str, str]:
+        entries = await asyncio.gather(*(self.get_entry(key, consistency) for key in keys))
+        return {key: entry[0] for key, entry in zip(keys, entries) if entry is not None}
+
+    async def compare_and_set(self, key: str, value: str, if_version: Optional[int] = None,
+                              if_value: Optional[str] = None, ttl_ms: Optional[int] = None) -> int:
+        await self._settle(key)
+        return await self.client_for(key).compare_and_set(key, value, if_version, if_value, ttl_ms)
+
+    async def delete(self, key: str, if_version: Optional[int] = None, if_value: Optional[str] = None) -> bool:
+        await self._settle(key)
+        return await self.client_for(key).delete(key, if_version, if_value)
+
+    async def _settle(self, key: str):
+        """Move a key to its new owner now, so conditions are checked against its real state."""
+        previous = self._previous_client(key)
+        if previous is None:
+            return
+        entry = await self._scan_entry(previous, key)
+        if entry is not None:
+            await self._move_page([entry], previous, self.client_for(key))
+
+    # Migration
+
+    def add_group(self, name: str, leader_url: str, follower_urls: Sequence[str] = ()):
+        if self.previous_ring is not None:
+            raise RuntimeError("Finish the current migration before changing groups again")
+        self.clients[name] = KVClient(leader_url, follower_urls, **self.client_options)
+        self.previous_ring, self.ring = self.ring, self.ring.with_group(name)
+
+    def remove_group(self, name: str):
+        if self.previous_ring is not None:
+            raise RuntimeError("Finish the current migration before changing groups again")
+        self.previous_ring, self.ring = self.ring, self.ring.without_group(name)
+
+    async def finish_migration(self):
+        """Stop falling back to previous owners and drop clients of removed groups."""
+        removed = [name for name in self.clients if name not in self.ring.groups]
+        self.previous_ring = None
+        await asyncio.gather(*(self.clients.pop(name).close() for name in removed))
+
+    async def _scan_entry(self, client: KVClient, key: str) -> Optional[Dict]:
+        items, _ = await client.scan(start=key, limit=1)
+        items = [item for item in items if item["key"] == key]
+        return items[0] if items else None
+
+    def _copy_item(self, item: Dict, if_version: int, now: float) -> Dict:
+        return {
+            "key": item["key"], "value": item["value"], "if_version": if_version,
+            "ttl_ms": max(1, int((item["expires_at"] - now) * 1000)) if item["expires_at"] is not None else None
+        }
+
+    async def _move_page(self, items: List[Dict], source: KVClient, target: KVClient) -> Dict[str, int]:
+        """
+        Copy scanned entries to their new owner with one conditional batch (only keys still
+        absent there), then delete the source copies with one batch conditioned on the
+        versions that were copied. Returns how many were moved, skipped, expired or conflicted.
+
+        A client still on the old ring may write or delete a key between the copy and the
+        source delete. Then the target holds a stale copy: it is overwritten with the newer
+        source entry (or deleted, if the source no longer has one), conditioned on the version
+        the copy got there, and the source delete is retried. Keys still changing after
+        MOVE_RETRIES rounds are left on the source and counted as conflicts.
+        """
+        now = time.time()
+        live = [item for item in items if item["expires_at"] is None or item["expires_at"] > now]
+        stats = {"moved": 0, "skipped": 0, "expired": len(items) - len(live), "conflict": 0}
+        if not live:
+            return stats
+        # Scanned source entry and the version its copy got on the target, per copied key
+        copied: List[Tuple[Dict, int]] = []
+        for item, result in zip(live, await target.write_batch([self._copy_item(item, 0, now) for item in live])):
+            if result["status"] == "success":
+                copied.append((item, result["version"]))
+            else:
+                # The key was written on the new owner since the migration began, which wins
+                stats["skipped"] += 1
+        deletes = [{"key": item["key"], "value": None, "if_version": item["version"]} for item in live]
+        results = await source.write_batch(deletes)
+        stale = {item["key"] for item, result in zip(live, results) if result["status"] != "success"}
+        for attempt in range(MOVE_RETRIES + 1):
+            copied = [(item, version) for item, version in copied if item["key"] in stale]
+            if not copied or attempt == MOVE_RETRIES:
+                break
+            stale = await self._replace_stale_copies(copied, source, target)
+        stats["conflict"] = len(copied)
+        stats["moved"] = len(live) - stats["skipped"] - stats["conflict"]
+        return stats
+
+    async def _replace_stale_copies(self, copied: List[Tuple[Dict, int]], source: KVClient,
+                                    target: KVClient) -> set:
+        """
+        Bring stale target copies up to the source's current entries and delete those from
+        the source again. Updates `copied` in place and returns the keys still stale.
+        """
+        now = time.time()
+        current = await asyncio.gather(*(self._scan_entry(source, item["key"]) for item, _ in copied))
+        replacements = []
+        for (item, version), entry in zip(copied, current):
+            if entry is None or (entry["expires_at"] is not None and entry["expires_at"] <= now):
+                replacements.append({"key": item["key"], "value": None, "if_version": version})
+            else:
+                replacements.append(self._copy_item(entry, version, now))
+        stale = set()
+        deletes = []
+        results = await target.write_batch(replacements)
+        for index, (replacement, result, entry) in enumerate(zip(replacements, results, current)):
+            if entry is None or replacement["value"] is None:
+                continue
+            if result["status"] == "success":
+                copied[index] = (entry, result["version"])
+                stale.add(entry["key"])
+            # Otherwise the new owner took a write of its own meanwhile, which wins
+            deletes.append({"key": entry["key"], "value": None, "if_version": entry["version"]})
+        if deletes:
+            for delete, result in zip(deletes, await source.write_batch(deletes)):
+                if result["status"] == "success":
+                    stale.discard(delete["key"])
+        return stale
+
+    async def rebalance(self, page_size: int = REBALANCE_PAGE_SIZE) -> Dict[str, float]:
+        """
+        Move every key whose owner changed with the last `add_group`/`remove_group`, reading
+        each previous group's leader page by page. Returns counts of scanned keys and of
+        move outcomes.
+        """
+        if self.previous_ring is None:
+            raise RuntimeError("No group change to rebalance")
+        start_time = time.time()
+        stats = {"scanned": 0, "moved": 0, "skipped": 0, "expired": 0, "conflict": 0}
+        for group in self.previous_ring.groups:
+            source = self.clients[group]
+            start_after = None
+            while True:
+                items, start_after = await source.scan(start_after=start_after, limit=page_size)
+                stats["scanned"] += len(items)
+                moving: Dict[str, List[Dict]] = {}
+                for item in items:
+                    owner = self.ring.owner(item["key"])
+                    if owner != group:
+                        moving.setdefault(owner, []).append(item)
+                for counts in await asyncio.gather(*(
+                    self._move_page(items, source, self.clients[owner]) for owner, items in moving.items()
+                )):
+                    for outcome, count in counts.items():
+                        stats[outcome] += count
+                if start_after is None:
+                    break
+        await self.finish_migration()
+        stats["seconds"] = time.time() - start_time
+        return stats
@@ -0,0 +1,261 @@
+"""
+In-process cluster simulator: runs the leader and N followers in this process, wired by an
+in-memory ASGI transport, on an event loop with a virtual clock. The clock jumps straight to
+the next timer whenever every task is waiting, so the simulated replication delays cost no
+real time, and each follower draws its delays and losses from its own seeded generator, so
+a run with the same seed gives the same numbers.
+
+The nodes are the real leader.py and follower.py, loaded once per node with their settings
+in the environment; settings not swept here (COALESCE_WRITES, QUORUM_DEADLINE_MS, ...) are
+read from the environment as for real nodes. Request handling itself takes no virtual time,
+so latencies show the replication protocol and delays, not CPU cost.
+
+Delays use the distributions of network_model.py, e.g. uniform:0:1000 or pareto:20:1.5.
+A delay of the form "A/B/..." gives the followers profiles A, B, ... in turn. Lost
+messages fail after LOSS_TIMEOUT_MS, and PARTITIONS windows count from the start of a run.
+
+Usage: python simulator.py [--followers 5] [--quorum 1,2,3,4,5] [--delay uniform:0:1000]
+                           [--loss 0] [--batch-size 1] [--writes 100] [--concurrency 10] [--seed 0]
+Every comma-separated list is swept; the runs are the cartesian product of the lists.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from network_model import NetworkModel, parse_delay
+
+NODE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEADER_URL = "http://leader:8000"
+NUM_KEYS = 10
+# Wall time is measured with the real clock, saved before any run swaps it out
+wall_clock = time.perf_counter
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock only advances when nothing is ready to run."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+        select = self._selector.select
+
+        def advance_when_idle(timeout=None):
+            events = select(None if timeout is None else 0)
+            if not events and timeout:
+                self.now += timeout
+            return events
+
+        self._selector.select = advance_when_idle
+
+    def time(self) -> float:
+        return self.now
+
+
+@contextlib.contextmanager
+def virtual_time(loop: VirtualClockLoop):
+    """Point time.time/monotonic/perf_counter at the loop's clock, as the nodes read those too."""
+    epoch = time.time()
+    originals = time.time, time.monotonic, time.perf_counter
+    time.time = lambda: epoch + loop.now
+    time.monotonic = time.perf_counter = loop.time
+    try:
+        yield
+    finally:
+        time.time, time.monotonic, time.perf_counter = originals
+
+
+class RoutingTransport(httpx.AsyncBaseTransport):
+    """Sends each request to the ASGI app registered for its host and port."""
+
+    def __init__(self):
+        self.routes: Dict[str, httpx.ASGITransport] = {}
+
+    def add(self, url: str, app):
+        address = httpx.URL(url)
+        self.routes[f"{address.host}:{address.port}"] = httpx.ASGITransport(app=app)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        route = self.routes.get(f"{request.url.host}:{request.url.port}")
+        if route is None:
+            raise httpx.ConnectError(f"No simulated node at {request.url}", request=request)
+        return await route.handle_async_request(request)
+
+
+def load_node(filename: str, name: str, env: Dict[str, str]):
+    """Import a fresh copy of a node module with `env` applied, so it gets its own app and store."""
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(NODE_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+async def run_cluster(num_followers: int, quorum: int, delay: str, loss_rate: float, batch_size: int,
+                      num_writes: int, concurrency: int, seed: int, quorum_mode: str) -> Dict:
+    profiles = delay.split("/")
+    follower_urls = [f"http://follower{i}:{8000 + i}" for i in range(1, num_followers + 1)]
+    routes = RoutingTransport()
+    with contextlib.redirect_stdout(io.StringIO()):
+        followers = []
+        for i, url in enumerate(follower_urls, start=1):
+            node = load_node("follower.py", f"sim_follower{i}", {
+                "FOLLOWER_ID": f"follower{i}", "FOLLOWER_PORT": str(8000 + i), "FOLLOWER_URL": url,
+                "LEADER_URL": LEADER_URL, "PEERS": "", "REPL_PORT": "0"
+            })
+            node.network = NetworkModel(profiles[(i - 1) % len(profiles)], loss_rate, node.LOSS_TIMEOUT_MS,
+                                        node.network.partitions, random.Random(f"{seed}:{i}"))
+            routes.add(url, node.app)
+            followers.append(node)
+        leader = load_node("leader.py", "sim_leader", {
+            "FOLLOWERS": ",".join(follower_urls), "WRITE_QUORUM": str(quorum), "QUORUM_MODE": quorum_mode,
+            "LEADER_URL": LEADER_URL, "REPLICATION_TRANSPORT": "http"
+        })
+        leader.transport = routes
+        routes.add(LEADER_URL, leader.app)
+
+    async with contextlib.AsyncExitStack() as stack:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for node in [*followers, leader]:
+                await stack.enter_async_context(node.app.router.lifespan_context(node.app))
+        client = await stack.enter_async_context(httpx.AsyncClient(transport=routes, timeout=None))
+
+        # Keys are distinct within a batch, since a batch locks each of its keys once
+        num_keys = max(NUM_KEYS, batch_size)
+        requests = [
+            [{"key": f"sim_key_{n % num_keys}", "value": f"value_{n}"}
+             for n in range(start, min(start + batch_size, num_writes))]
+            for start in range(0, num_writes, batch_size)
+        ]
+        loop = asyncio.get_running_loop()
+        latencies, successes = [], []
+        pending = iter(requests)
+
+        async def worker():
+            for items in pending:
+                start_time = loop.time()
+                if len(items) == 1:
+                    response = await client.post(f"{LEADER_URL}/keys", json=items[0])
+                else:
+                    response = await client.post(f"{LEADER_URL}/keys/batch", json={"items": items})
+                latencies.append((loop.time() - start_time) * 1000)
+                successes.append(response.status_code == 200)
+
+        start_time = loop.time()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = loop.time() - start_time
+
+        # Let the followers outside the quorum finish, then compare their trees with the leader's
+        await asyncio.gather(*list(leader.write_path.background_replications), return_exceptions=True)
+        leader_root = (await client.get(f"{LEADER_URL}/merkle")).json()["root"]
+        converged = sum([(await client.get(f"{url}/merkle")).json()["root"] == leader_root
+                         for url in follower_urls])
+
+    # Lost messages may still be timing out; finish them before the loop closes
+    leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in leftover:
+        task.cancel()
+    await asyncio.gather(*leftover, return_exceptions=True)
+
+    return {
+        "avg_latency": float(np.mean(latencies)),
+        "median_latency": float(np.median(latencies)),
+        "p95_latency": float(np.percentile(latencies, 95)),
+        "p99_latency": float(np.percentile(latencies, 99)),
+        "success_rate": sum(successes) / len(successes),
+        "throughput": num_writes / elapsed if elapsed else float("inf"),
+        "virtual_seconds": elapsed,
+        "converged": converged
+    }
+
+
+def simulate(num_followers: int = 5, quorum: int = 3, delay: str = "uniform:0:1000", loss_rate: float = 0.0,
+             batch_size: int = 1, num_writes: int = 100, concurrency: int = 10, seed: int = 0,
+             quorum_mode: str = "all") -> Dict:
+    """
+    Run one workload against a fresh simulated cluster and return its write latencies in
+    virtual milliseconds, throughput in writes per virtual second and the real time taken.
+    """
+    for profile in delay.split("/"):
+        parse_delay(profile)
+    loop = VirtualClockLoop()
+    wall_start = wall_clock()
+    try:
+        with virtual_time(loop):
+            result = loop.run_until_complete(run_cluster(
+                num_followers, quorum, delay, loss_rate, batch_size, num_writes, concurrency, seed, quorum_mode
+            ))
+    finally:
+        loop.close()
+        for name in [name for name in sys.modules if name.startswith("sim_")]:
+            del sys.modules[name]
+    return {
+        "followers": num_followers, "quorum": quorum, "delay": delay, "loss_rate": loss_rate, "batch_size": batch_size,
+        "seed": seed, **result, "wall_seconds": wall_clock() - wall_start
+    }
+
+
+def sweep(followers: List[int], quorums: List[int], delays: List[str], loss_rates: List[float],
+          batch_sizes: List[int], num_writes: int, concurrency: int, seed: int, quorum_mode: str) -> List[Dict]:
+    results = []
+    print(f"{'Followers':<10} {'Quorum':<7} {'Delay':<28} {'Loss':<6} {'Batch':<6} {'Avg ms':<9} {'P50 ms':<9} "
+          f"{'P95 ms':<9} {'P99 ms':<9} {'Writes/s':<9} {'Success':<8} {'Converged':<10} {'Wall s':<7}")
+    print("-" * 135)
+    for num_followers, quorum, delay, loss_rate, batch_size in itertools.product(
+            followers, quorums, delays, loss_rates, batch_sizes):
+        if quorum > num_followers:
+            continue
+        r = simulate(num_followers, quorum, delay, loss_rate, batch_size, num_writes, concurrency, seed,
+                     quorum_mode)
+        results.append(r)
+        print(f"{num_followers:<10} {quorum:<7} {delay:<28} {loss_rate:<6} {batch_size:<6} {r['avg_latency']:<9.1f} "
+              f"{r['median_latency']:<9.1f} {r['p95_latency']:<9.1f} {r['p99_latency']:<9.1f} "
+              f"{r['throughput']:<9.1f} {r['success_rate']:<8.0%} "
+              f"{str(r['converged']) + '/' + str(num_followers):<10} {r['wall_seconds']:<7.2f}")
+    return results
+
+
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the cluster in one process on a virtual clock.")
+    parser.add_argument("--followers", type=int_list, default=[5])
+    parser.add_argument("--quorum", type=int_list, default=[1, 2, 3, 4, 5])
+    parser.add_argument("--delay", type=lambda value: value.split(","), default=["uniform:0:1000"])
+    parser.add_argument("--loss", type=lambda value: [float(part) for part in value.split(",")], default=[0.0])
+    parser.add_argument("--batch-size", type=int_list, default=[1])
+    parser.add_argument("--writes", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quorum-mode", choices=["all", "fastest"], default="all")
+    args = parser.parse_args()
+
+    print("=" * 135)
+    print("Cluster Simulation: virtual clock, in-memory transport")
+    print("=" * 135)
+    print(f"{args.writes} writes over {NUM_KEYS} keys, {args.concurrency} concurrent workers, "
+          f"quorum mode {args.quorum_mode}, seed {args.seed}")
+    sweep(args.followers, args.quorum, args.delay, args.loss, args.batch_size, args.writes, args.concurrency,
+          args.seed, args.quorum_mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,28 @@ Integration test for the key-value store with single-leader replication.
 import pytest
 import httpx
 import asyncio
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
 import time
 
+from consistency_checker import check
+from election import Election
+from follower_stats import P95_REFRESH_SAMPLES, FollowerTracker
+from hash_ring import HashRing
+from kv_client import ConflictError, KVClient
+from change_feed import ChangeFeed, parse_event_id
+from kvstore import MAX_CHANGE_LOG, STORE_SOCKET_ENV, KVStore, LocalStore, RemoteStore, start_store_owner
+from near_cache import NearCache
+from performance_analysis import plan_operations
+from replication_queue import ReplicationQueue
+from sharded_client import ShardedKVClient
+from simulator import load_node, simulate
+
 LEADER_URL = "http://localhost:8000"
 FOLLOWERS = [
     "http://localhost:8001",
@@ -16,6 +36,27 @@ FOLLOWERS = [
 ]
 
 
+async def reach_leader_at_leader_url(request: httpx.Request):
+    """
+    Followers redirect to the leader's announced address, which names its service
+    (http://leader:8000) under docker-compose; send those requests to LEADER_URL.
+    """
+    leader = httpx.URL(LEADER_URL)
+    if request.url.port == leader.port and request.url.host != leader.host:
+        request.url = request.url.copy_with(host=leader.host)
+
+
+def for_follower(values: dict, follower_url: str):
+    """
+    The entry of `values`, keyed by the leader's follower URLs, for `follower_url`. The leader
+    names followers by service (http://follower1:8001) under docker-compose, so match the port.
+    """
+    port = follower_url.rsplit(":", 1)[1]
+    matches = [value for url, value in values.items() if url.rsplit(":", 1)[1] == port]
+    assert len(matches) == 1, f"no single follower on port {port} in {list(values)}"
+    return matches[0]
+
+
 @pytest.mark.asyncio
 async def test_leader_health():
     """Test that leader is healthy."""
@@ -165,6 +206,1426 @@ async def test_state_consistency():
                 assert follower_store[key] == value, f"Value mismatch for key {key} in follower {follower_url}"
 
 
+@pytest.mark.asyncio
+async def test_anti_entropy_repairs_divergent_follower():
+    """Test that anti-entropy finds a diverged key via Merkle trees and repairs it."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        write_response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "anti_entropy_test", "value": "leader_value"}
+        )
+        assert write_response.status_code == 200
+        
+        # Wait for replication
+        await asyncio.sleep(3)
+        
+        # Corrupt one follower behind the leader's back
+        repair_response = await client.post(
+            f"{FOLLOWERS[0]}/repair",
+            json={"entries": {"anti_entropy_test": "stale_value"}}
+        )
+        assert repair_response.status_code == 200
+        
+        run_response = await client.post(f"{LEADER_URL}/anti-entropy/run")
+        assert run_response.status_code == 200
+        assert for_follower(run_response.json()["repaired"], FOLLOWERS[0]) >= 1
+        
+        read_response = await client.get(f"{FOLLOWERS[0]}/keys/anti_entropy_test")
+        assert read_response.json()["value"] == "leader_value"
+        
+        leader_root = (await client.get(f"{LEADER_URL}/merkle")).json()["root"]
+        follower_root = (await client.get(f"{FOLLOWERS[0]}/merkle")).json()["root"]
+        assert follower_root == leader_root
+
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """ASGI transport to one app that counts the Merkle hashes in its responses."""
+
+    def __init__(self, app):
+        self.inner = httpx.ASGITransport(app=app)
+        self.hashes = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.inner.handle_async_request(request)
+        body = await response.aread()
+        if request.url.path == "/merkle/nodes":
+            self.hashes += len(json.loads(body)["hashes"])
+        elif request.url.path == "/merkle/buckets":
+            self.hashes += sum(len(bucket) for bucket in json.loads(body)["buckets"])
+        return httpx.Response(response.status_code, headers=response.headers, content=body)
+
+
+@pytest.mark.asyncio
+async def test_repair_moves_log_n_hashes_for_one_key():
+    """Test that repairing one diverged key in a large store moves O(log n) hashes, not a leaf bucket."""
+    follower_url = "http://merkle-follower:8001"
+    env = {"MERKLE_DEPTH": "4", "ANTI_ENTROPY_INTERVAL_S": "0", "LOOP_LAG_INTERVAL_MS": "0", "PEERS": "",
+           "REPL_PORT": "0", "DELAY_MODEL": "constant:0"}
+    follower = load_node("follower.py", "merkle_follower", env)
+    node = load_node("leader.py", "merkle_leader", {**env, "FOLLOWERS": follower_url, "WRITE_QUORUM": "1"})
+    node.transport = CountingTransport(follower.app)
+    num_keys = 20000
+    versions = await node.store.write_many([(f"merkle_{i}", "v", 0.0) for i in range(num_keys)])
+    await follower.store.apply_many([(f"merkle_{i}", "v", version, [], 0.0) for i, version in enumerate(versions)])
+    await follower.store.repair({"merkle_7": "stale"}, {}, 0)
+
+    async with follower.app.router.lifespan_context(follower.app), node.app.router.lifespan_context(node.app):
+        assert await node.write_path.repair_follower(follower_url) == 1
+    assert await follower.store.get("merkle_7") == ("v", versions[7])
+    assert (await follower.store.merkle_root())["root"] == (await node.store.merkle_root())["root"]
+    # A leaf bucket of this 16-bucket tree holds about 1250 keys
+    assert node.transport.hashes <= 4 * num_keys.bit_length()
+
+
+@pytest.mark.asyncio
+async def test_reads_do_not_wait_on_write_locks():
+    """Test that a read is served while a write holds the key's lock, and a write to the key waits."""
+    env = {"FOLLOWERS": "", "WRITE_QUORUM": "0", "ANTI_ENTROPY_INTERVAL_S": "0", "LOOP_LAG_INTERVAL_MS": "0"}
+    node = load_node("leader.py", "locked_reads_leader", env)
+    async with node.app.router.lifespan_context(node.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=node.app), base_url="http://leader") as client:
+            response = await client.post("/keys", json={"key": "locked_key", "value": "v1"})
+            assert response.status_code == 200
+            
+            async with node.key_locks("locked_key"):
+                read_response = await asyncio.wait_for(client.get("/keys/locked_key"), timeout=1.0)
+                assert read_response.json()["value"] == "v1"
+                write = asyncio.create_task(client.post("/keys", json={"key": "locked_key", "value": "v2"}))
+                await asyncio.sleep(0.2)
+                assert not write.done()
+            assert (await asyncio.wait_for(write, timeout=1.0)).status_code == 200
+            assert (await client.get("/keys/locked_key")).json()["value"] == "v2"
+
+
+@pytest.mark.asyncio
+async def test_read_after_write_across_workers():
+    """Test that every leader worker sees a write, whichever worker served it."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        write_response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "worker_test", "value": "worker_value"}
+        )
+        assert write_response.status_code == 200
+        
+        # Fresh connections are spread across workers
+        for _ in range(20):
+            async with httpx.AsyncClient() as fresh_client:
+                read_response = await fresh_client.get(f"{LEADER_URL}/keys/worker_test")
+                assert read_response.status_code == 200
+                assert read_response.json()["value"] == "worker_value"
+
+
+@pytest.mark.asyncio
+async def test_quorum_config_applies_to_all_workers():
+    """Test that a quorum change is seen by every leader worker."""
+    async with httpx.AsyncClient() as client:
+        original = (await client.get(f"{LEADER_URL}/config/quorum")).json()["quorum"]
+        new_quorum = 1 if original != 1 else 2
+        update_response = await client.post(
+            f"{LEADER_URL}/config/quorum",
+            json={"quorum": new_quorum}
+        )
+        assert update_response.status_code == 200
+        
+        try:
+            for _ in range(20):
+                async with httpx.AsyncClient() as fresh_client:
+                    response = await fresh_client.get(f"{LEADER_URL}/config/quorum")
+                    assert response.json()["quorum"] == new_quorum
+        finally:
+            await client.post(f"{LEADER_URL}/config/quorum", json={"quorum": original})
+
+
+@pytest.mark.asyncio
+async def test_multi_worker_leader_shares_store_and_config():
+    """Test that all workers of a leader started with WORKERS > 1 serve one store and one config."""
+    url = "http://localhost:8600"
+    env = dict(os.environ, LEADER_PORT="8600", LEADER_URL=url, FOLLOWERS="", WRITE_QUORUM="0", WORKERS="3")
+    env.pop(STORE_SOCKET_ENV, None)
+    leader_process = subprocess.Popen([sys.executable, "leader.py"], env=env, start_new_session=True,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            for _ in range(100):
+                try:
+                    if (await client.get(f"{url}/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            
+            versions = []
+            for i in range(20):
+                async with httpx.AsyncClient() as fresh_client:
+                    response = await fresh_client.post(f"{url}/keys", json={"key": f"worker_key_{i}", "value": "v"})
+                    versions.append(response.json()["version"])
+            # One version sequence, whichever worker took the write
+            assert versions == list(range(versions[0], versions[0] + 20))
+            assert (await client.post(f"{url}/config/quorum-mode", json={"mode": "fastest"})).status_code == 200
+            
+            for i in range(20):
+                async with httpx.AsyncClient() as fresh_client:
+                    response = await fresh_client.get(f"{url}/keys/worker_key_{i}")
+                    assert response.json()["version"] == versions[i]
+                    assert (await fresh_client.get(f"{url}/followers")).json()["mode"] == "fastest"
+    finally:
+        # The workers and the store owner are in the leader's process group
+        os.killpg(leader_process.pid, signal.SIGKILL)
+        leader_process.wait()
+
+
+
+async def worker_states(url: str, fields, connections: int = 9):
+    """The distinct values of `fields` in GET /replication, over fresh connections spread across workers."""
+    states = set()
+    for _ in range(connections):
+        async with httpx.AsyncClient(timeout=5.0) as fresh_client:
+            reply = (await fresh_client.get(f"{url}/replication")).json()
+            states.add(tuple(reply[field] for field in fields))
+    return states
+
+
+@pytest.mark.asyncio
+async def test_multi_worker_followers_agree_on_election_state():
+    """Test that the workers of followers started with WORKERS > 1 agree on term, vote and applied index."""
+    leader_url = "http://localhost:8610"
+    follower_urls = [f"http://localhost:{8610 + i}" for i in range(1, 4)]
+    base_env = dict(os.environ, MIN_DELAY_MS="0", MAX_DELAY_MS="0", HEARTBEAT_INTERVAL_MS="100")
+    base_env.pop(STORE_SOCKET_ENV, None)
+    processes = []
+    for i, url in enumerate(follower_urls, start=1):
+        env = dict(base_env, FOLLOWER_PORT=str(8610 + i), FOLLOWER_ID=f"worker_follower{i}", FOLLOWER_URL=url,
+                   LEADER_URL=leader_url, PEERS=",".join(peer for peer in follower_urls if peer != url),
+                   ELECTION_TIMEOUT_MS="500", REPL_PORT=str(9610 + i), WORKERS="3")
+        processes.append(subprocess.Popen([sys.executable, "follower.py"], env=env, start_new_session=True,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    env = dict(base_env, LEADER_PORT="8610", LEADER_URL=leader_url, FOLLOWERS=",".join(follower_urls),
+               WRITE_QUORUM="3", WORKERS="1")
+    leader_process = subprocess.Popen([sys.executable, "leader.py"], env=env, start_new_session=True,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    processes.append(leader_process)
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            for url in [leader_url, *follower_urls]:
+                for _ in range(100):
+                    try:
+                        if (await client.get(f"{url}/health")).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.1)
+            for i in range(10):
+                response = await client.post(f"{leader_url}/keys", json={"key": f"worker_follower_key_{i}", "value": "v"})
+                assert response.status_code == 200
+            last_version = response.json()["version"]
+            
+            fields = ["term", "voted_for", "leader_url", "applied_index"]
+            for url in follower_urls:
+                states = await worker_states(url, fields)
+                assert len(states) == 1, f"workers of {url} disagree: {states}"
+                term, _, announced_leader, applied_index = states.pop()
+                assert announced_leader == leader_url
+                assert applied_index >= last_version
+            
+            os.killpg(leader_process.pid, signal.SIGKILL)
+            fields = ["term", "voted_for", "leader_url", "role"]
+            deadline = time.time() + 20
+            while True:
+                states = [await worker_states(url, fields) for url in follower_urls]
+                # Every worker of every follower names the same term and leader, which says it leads
+                agreed = set().union(*states)
+                if len({(state_term, leader) for state_term, _, leader, _ in agreed}) == 1:
+                    new_term, _, new_leader, _ = agreed.pop()
+                    if new_leader in follower_urls and all(len(state) == 1 for state in states) \
+                            and next(iter(states[follower_urls.index(new_leader)]))[3] == "leader":
+                        break
+                assert time.time() < deadline, f"followers did not settle on one leader: {states}"
+                await asyncio.sleep(0.2)
+            assert new_term > term
+            response = await client.post(f"{new_leader}/keys", json={"key": "worker_follower_key_new", "value": "v"})
+            assert response.status_code == 200
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+@pytest.mark.asyncio
+async def test_remote_store_fails_fast_after_owner_dies():
+    """Test that a worker's store calls fail instead of hanging once the store owner is gone."""
+    owner = start_store_owner(4, {"write_quorum": 1})
+    store = RemoteStore(os.environ.pop(STORE_SOCKET_ENV))
+    try:
+        await store.connect()
+        version = await store.write("owner_key", "value", 0.0)
+        assert await store.get("owner_key") == ("value", version)
+        
+        owner.kill()
+        owner.join()
+        with pytest.raises((ConnectionError, RuntimeError)):
+            await asyncio.wait_for(store.get("owner_key"), timeout=2.0)
+        # Once the loss is noticed, calls fail at once
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(store.get("owner_key"), timeout=2.0)
+    finally:
+        await store.close()
+        owner.kill()
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes_on_followers():
+    """Test that a follower read with min_version never returns an older value."""
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True,
+                                 event_hooks={"request": [reach_leader_at_leader_url]}) as client:
+        write_response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "ryw_test", "value": "ryw_value"}
+        )
+        assert write_response.status_code == 200
+        version = write_response.json()["version"]
+        
+        # Either served by the follower once caught up, or redirected to the leader
+        for follower_url in FOLLOWERS:
+            read_response = await client.get(
+                f"{follower_url}/keys/ryw_test",
+                params={"min_version": version}
+            )
+            assert read_response.status_code == 200
+            assert read_response.json()["value"] == "ryw_value"
+            assert read_response.json()["version"] >= version
+
+
+@pytest.mark.asyncio
+async def test_followers_expose_applied_index():
+    """Test that followers catch up to the leader's commit index."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        write_response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "applied_index_test", "value": "value"}
+        )
+        version = write_response.json()["version"]
+        
+        # Wait for replication
+        await asyncio.sleep(3)
+        
+        for follower_url in FOLLOWERS:
+            status = (await client.get(f"{follower_url}/replication")).json()
+            assert status["applied_index"] >= version
+            assert status["staleness_ms"] is not None
+
+
+@pytest.mark.asyncio
+async def test_stale_follower_read_redirects_to_leader():
+    """Test that a follower redirects reads it cannot serve within the staleness bound."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "staleness_test", "value": "value"}
+        )
+        read_response = await client.get(
+            f"{FOLLOWERS[0]}/keys/staleness_test",
+            params={"max_staleness_ms": 0}
+        )
+        assert read_response.status_code == 307
+        location = httpx.URL(read_response.headers["location"])
+        assert (location.port, location.path) == (httpx.URL(LEADER_URL).port, "/keys/staleness_test")
+
+
+@pytest.mark.asyncio
+async def test_batch_write_and_mget():
+    """Test that a batch write is replicated and readable with a multi-get."""
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True,
+                                 event_hooks={"request": [reach_leader_at_leader_url]}) as client:
+        items = [{"key": f"batch_test_{i}", "value": f"value_{i}"} for i in range(50)]
+        write_response = await client.post(f"{LEADER_URL}/keys/batch", json={"items": items})
+        assert write_response.status_code == 200
+        write_data = write_response.json()
+        assert write_data["status"] == "success"
+        assert write_data["replicated_to"] >= write_data["write_quorum"]
+        versions = [result["version"] for result in write_data["results"]]
+        assert versions == sorted(versions)
+        
+        keys = [item["key"] for item in items] + ["batch_test_missing"]
+        for url in [LEADER_URL] + FOLLOWERS:
+            mget_response = await client.post(
+                f"{url}/keys/mget",
+                json={"keys": keys},
+                params={"min_version": versions[-1]} if url != LEADER_URL else None
+            )
+            assert mget_response.status_code == 200
+            mget_data = mget_response.json()
+            assert mget_data["missing"] == ["batch_test_missing"]
+            for item in items:
+                assert mget_data["items"][item["key"]]["value"] == item["value"]
+
+
+@pytest.mark.asyncio
+async def test_fastest_quorum_mode():
+    """Test that writes meet the quorum in fastest-followers mode and latency is tracked."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        mode_response = await client.post(f"{LEADER_URL}/config/quorum-mode", json={"mode": "fastest"})
+        assert mode_response.status_code == 200
+        try:
+            for i in range(10):
+                write_response = await client.post(
+                    f"{LEADER_URL}/keys",
+                    json={"key": f"fastest_test_{i}", "value": f"value_{i}"}
+                )
+                assert write_response.status_code == 200
+                write_data = write_response.json()
+                assert write_data["replicated_to"] >= write_data["write_quorum"]
+            
+            followers = (await client.get(f"{LEADER_URL}/followers")).json()["followers"]
+            assert sum(stats["successes"] for stats in followers.values()) >= 10 * write_data["write_quorum"]
+        finally:
+            await client.post(f"{LEADER_URL}/config/quorum-mode", json={"mode": "all"})
+        
+        bad_response = await client.post(f"{LEADER_URL}/config/quorum-mode", json={"mode": "bogus"})
+        assert bad_response.status_code == 400
+
+
+
+def test_hedge_delay_uses_cached_p95():
+    """Test that a follower's p95 is recomputed every P95_REFRESH_SAMPLES latencies, not per hedge decision."""
+    tracker = FollowerTracker(["http://f1"], min_hedge_delay=0.0)
+    for _ in range(P95_REFRESH_SAMPLES):
+        tracker.record_success("http://f1", 0.01)
+    assert tracker.hedge_delay(["http://f1"]) == pytest.approx(0.01)
+    
+    for _ in range(P95_REFRESH_SAMPLES - 1):
+        tracker.record_success("http://f1", 1.0)
+    assert tracker.hedge_delay(["http://f1"]) == pytest.approx(0.01)
+    tracker.record_success("http://f1", 1.0)
+    assert tracker.hedge_delay(["http://f1"]) == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_quorum_deadline_and_admission_control():
+    """Test that writes give up on a stalled quorum at the deadline and excess writes get 503 with Retry-After."""
+    released = asyncio.Event()
+
+    async def stalled_followers(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/replicate"):
+            await released.wait()
+            return httpx.Response(200, json={"status": "replicated", "applied": True})
+        return httpx.Response(200, json={})
+
+    env = {"FOLLOWERS": "http://stalled1:8001,http://stalled2:8002", "WRITE_QUORUM": "1",
+           "QUORUM_DEADLINE_MS": "200", "MAX_INFLIGHT_WRITES": "2", "ANTI_ENTROPY_INTERVAL_S": "0",
+           "LOOP_LAG_INTERVAL_MS": "0"}
+    node = load_node("leader.py", "admission_leader", env)
+    node.transport = httpx.MockTransport(stalled_followers)
+    async with node.app.router.lifespan_context(node.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=node.app), base_url="http://leader") as client:
+            start_time = time.perf_counter()
+            response = await client.post("/keys", json={"key": "deadline_key", "value": "v"})
+            assert response.status_code == 503
+            assert "quorum not met" in response.json()["detail"]
+            assert time.perf_counter() - start_time < 1.0
+            # The write was applied locally and keeps replicating
+            assert (await client.get("/keys/deadline_key")).status_code == 200
+            
+            node.write_path.config.quorum_deadline_ms = 5000
+            waiting = [asyncio.create_task(client.post("/keys", json={"key": f"waiting_{i}", "value": "v"}))
+                       for i in range(2)]
+            await asyncio.sleep(0.1)
+            response = await client.post("/keys", json={"key": "rejected_key", "value": "v"})
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "1"
+            assert (await client.get("/keys/rejected_key")).status_code == 404
+            
+            released.set()
+            assert [(await task).status_code for task in waiting] == [200, 200]
+            assert (await client.post("/keys", json={"key": "admitted_key", "value": "v"})).status_code == 200
+            assert "kv_writes_rejected_total 1" in (await client.get("/metrics")).text
+
+
+@pytest.mark.asyncio
+async def test_replication_queue_is_bounded():
+    """Test that a follower's queue refuses writes beyond its bound and asks for a repair once drained."""
+    released = asyncio.Event()
+    overflows = []
+
+    async def send(items):
+        await released.wait()
+        return True
+
+    queue = ReplicationQueue(send, max_inflight=1, max_items=2, max_held=4,
+                             on_overflow=lambda: overflows.append(queue.snapshot()))
+    accepted = [asyncio.create_task(queue.submit([(f"key_{i}", "v", i + 1, 0.0)])) for i in range(4)]
+    await asyncio.sleep(0)
+    assert queue.held == 4
+    # Nothing more is held for the follower; the write fails at once
+    assert await asyncio.wait_for(queue.submit([("key_4", "v", 5, 0.0)]), timeout=1.0) is False
+    assert queue.snapshot()["dropped_writes"] == 1
+    assert overflows == []
+
+    released.set()
+    assert await asyncio.gather(*accepted) == [True] * 4
+    assert len(overflows) == 1 and overflows[0]["queued"] == 0
+    assert await queue.submit([("key_5", "v", 6, 0.0)]) is True
+    assert len(overflows) == 1
+
+
+
+@pytest.mark.asyncio
+async def test_replication_queue_close_cancels_messages_in_flight():
+    """Test that closing a follower's queue cancels its messages in flight and fails every waiting write."""
+    cancelled = []
+    started = asyncio.Event()
+
+    async def send(items):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(items)
+            raise
+
+    queue = ReplicationQueue(send, max_inflight=1, max_items=1)
+    submits = [asyncio.create_task(queue.submit([(f"key_{i}", "v", i + 1, 0.0)])) for i in range(3)]
+    await asyncio.wait_for(started.wait(), timeout=1.0)
+    assert len(queue.tasks) == 1 and queue.snapshot()["queued"] == 2
+    
+    await queue.close()
+    assert await asyncio.wait_for(asyncio.gather(*submits), timeout=1.0) == [False] * 3
+    assert len(cancelled) == 1 and not queue.tasks
+    assert queue.held == 0 and queue.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_hot_key_writes_converge():
+    """Test that concurrent overwrites of one key are all acked and every replica converges."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        responses = await asyncio.gather(*(
+            client.post(f"{LEADER_URL}/keys", json={"key": "hot_key", "value": f"value_{i}"})
+            for i in range(50)
+        ))
+        assert all(response.status_code == 200 for response in responses)
+        
+        # Wait for replication
+        await asyncio.sleep(3)
+        
+        leader_entry = (await client.get(f"{LEADER_URL}/keys/hot_key")).json()
+        commit_index = (await client.get(f"{LEADER_URL}/replication")).json()["commit_index"]
+        for follower_url in FOLLOWERS:
+            follower_entry = (await client.get(f"{follower_url}/keys/hot_key")).json()
+            assert follower_entry["value"] == leader_entry["value"]
+            assert follower_entry["version"] == leader_entry["version"]
+            # Coalesced versions still count as applied, so there are no gaps
+            status = (await client.get(f"{follower_url}/replication")).json()
+            assert status["applied_index"] >= commit_index
+
+
+@pytest.mark.asyncio
+async def test_storage_stats_count_keys():
+    """Test that every node reports its storage engine and a key count matching the leader."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.post(f"{LEADER_URL}/keys", json={"key": "storage_key", "value": "storage_value"})
+        assert response.status_code == 200
+        
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        leader_stats = (await client.get(f"{LEADER_URL}/storage")).json()
+        assert leader_stats["engine"] in ("dict", "compact")
+        assert leader_stats["keys"] >= 1
+        for follower_url in FOLLOWERS:
+            follower_stats = (await client.get(f"{follower_url}/storage")).json()
+            assert follower_stats["engine"] == leader_stats["engine"]
+            assert follower_stats["keys"] == leader_stats["keys"]
+
+
+def parse_metrics(text: str) -> dict:
+    """Prometheus text format -> {sample name with labels: value}."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoints():
+    """Test that leader and followers expose Prometheus metrics for requests, replication and the event loop."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        for i in range(5):
+            response = await client.post(f"{LEADER_URL}/keys", json={"key": f"metrics_key_{i}", "value": "v"})
+            assert response.status_code == 200
+        
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        for url in [LEADER_URL, *FOLLOWERS]:
+            response = await client.get(f"{url}/metrics")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+            text = response.text
+            samples = parse_metrics(text)
+            # The scrape itself is in flight
+            assert samples["kv_http_requests_in_flight"] >= 1
+            for name in ["kv_event_loop_lag_seconds", "kv_lock_wait_seconds", "kv_http_request_duration_seconds"]:
+                assert f"# TYPE {name} histogram" in text
+            # Buckets are cumulative and the last one holds every sample
+            for sample, value in samples.items():
+                name, _, labels = sample.partition("{")
+                if name.endswith("_count"):
+                    inf = ",".join(filter(None, [labels.rstrip("}"), 'le="+Inf"']))
+                    assert samples[f"{name[:-len('_count')]}_bucket{{{inf}}}"] == value
+        
+        text = (await client.get(f"{LEADER_URL}/metrics")).text
+        for name in ["kv_quorum_wait_seconds", "kv_replication_latency_seconds", "kv_replication_rtt_seconds"]:
+            assert f"# TYPE {name} histogram" in text
+        samples = parse_metrics(text)
+        # Labelled with the leader's follower URLs, which name services under docker-compose
+        failures = {
+            match.group(1): value for sample, value in samples.items()
+            if (match := re.fullmatch(r'kv_replication_failures_total\{follower="([^"]+)"\}', sample))
+        }
+        assert len(failures) == len(FOLLOWERS)
+        for follower_url in FOLLOWERS:
+            assert for_follower(failures, follower_url) >= 0
+        assert "# TYPE kv_replication_apply_seconds histogram" in (await client.get(f"{FOLLOWERS[0]}/metrics")).text
+
+
+
+@pytest.mark.asyncio
+async def test_metrics_sum_over_leader_workers():
+    """Test that a 4-worker leader's counters cover every worker and never go down, whichever worker is scraped."""
+    url = "http://localhost:8620"
+    env = dict(os.environ, LEADER_PORT="8620", LEADER_URL=url, FOLLOWERS="", WRITE_QUORUM="0", WORKERS="4")
+    env.pop(STORE_SOCKET_ENV, None)
+    leader_process = subprocess.Popen([sys.executable, "leader.py"], env=env, start_new_session=True,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            # Four workers take several seconds to start on a busy machine
+            for _ in range(300):
+                try:
+                    if (await client.get(f"{url}/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+        
+        num_writes = 40
+        previous = {}
+        for i in range(num_writes):
+            # Fresh connections are spread across workers
+            async with httpx.AsyncClient(timeout=5.0) as fresh_client:
+                response = await fresh_client.post(f"{url}/keys", json={"key": f"metrics_worker_{i}", "value": "v"})
+                assert response.status_code == 200
+            async with httpx.AsyncClient(timeout=5.0) as fresh_client:
+                samples = parse_metrics((await fresh_client.get(f"{url}/metrics")).text)
+            for sample, value in samples.items():
+                name = sample.partition("{")[0]
+                if name.endswith(("_total", "_count", "_bucket", "_sum")) and sample in previous:
+                    assert value >= previous[sample], f"{sample} went down from {previous[sample]} to {value}"
+            previous = samples
+        
+        # Once every worker has published, the writes each worker took add up
+        await asyncio.sleep(1.5)
+        async with httpx.AsyncClient(timeout=5.0) as fresh_client:
+            samples = parse_metrics((await fresh_client.get(f"{url}/metrics")).text)
+        writes = sum(value for sample, value in samples.items()
+                     if sample.startswith("kv_http_request_duration_seconds_count{") and 'method="POST"' in sample)
+        assert writes == num_writes
+    finally:
+        # The workers and the store owner are in the leader's process group
+        os.killpg(leader_process.pid, signal.SIGKILL)
+        leader_process.wait()
+
+
+@pytest.mark.asyncio
+async def test_paginated_key_listing_and_range_scan():
+    """Test prefix listing with cursor pagination and range scans on the leader and a follower."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        keys = [f"scan_key_{i:02d}" for i in range(15)]
+        response = await client.post(
+            f"{LEADER_URL}/keys/batch",
+            json={"items": [{"key": key, "value": f"value_{key}"} for key in reversed(keys)]}
+        )
+        assert response.status_code == 200
+        
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        for url in [LEADER_URL, FOLLOWERS[0]]:
+            listed = []
+            start_after = None
+            while True:
+                params = {"prefix": "scan_key_", "limit": 4}
+                if start_after is not None:
+                    params["start_after"] = start_after
+                page = (await client.get(f"{url}/keys", params=params)).json()
+                listed.extend(page["keys"])
+                start_after = page["next_start_after"]
+                if start_after is None:
+                    break
+            assert listed == keys
+            
+            data = (await client.get(
+                f"{url}/scan", params={"start": "scan_key_05", "end": "scan_key_08"}
+            )).json()
+            assert [item["key"] for item in data["items"]] == keys[5:8]
+            assert data["items"][0]["value"] == "value_scan_key_05"
+            assert data["next_start_after"] is None
+        
+        response = await client.get(f"{LEADER_URL}/keys", params={"limit": 0})
+        assert response.status_code == 400
+
+
+async def read_export(client: httpx.AsyncClient, url: str) -> list:
+    async with client.stream("GET", f"{url}/export") as response:
+        assert response.status_code == 200
+        return [json.loads(line) async for line in response.aiter_lines() if line]
+
+
+@pytest.mark.asyncio
+async def test_export_streams_sorted_snapshot():
+    """Test that the NDJSON export is complete, in key order and identical on synced followers."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.post(
+            f"{LEADER_URL}/keys/batch",
+            json={"items": [{"key": f"export_key_{i}", "value": f"export_value_{i}"} for i in range(20)]}
+        )
+        assert response.status_code == 200
+        
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        leader_records = await read_export(client, LEADER_URL)
+        header, entries, footer = leader_records[0], leader_records[1:-1], leader_records[-1]
+        assert header["keys_count"] == len(entries)
+        assert footer == {"end": True, "count": len(entries)}
+        keys = [entry["key"] for entry in entries]
+        assert keys == sorted(keys)
+        assert {"key": "export_key_3", "value": "export_value_3"}.items() <= \
+            next(entry for entry in entries if entry["key"] == "export_key_3").items()
+        
+        follower_records = await read_export(client, FOLLOWERS[0])
+        assert follower_records[1:] == leader_records[1:]
+
+
+@pytest.mark.asyncio
+async def test_ttl_keys_expire_everywhere():
+    """Test that a key written with a TTL disappears from the leader and every follower."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "ttl_key", "value": "short_lived", "ttl_ms": 1500}
+        )
+        assert response.status_code == 200
+        assert response.json()["expires_at"] is not None
+        
+        read_response = await client.get(f"{LEADER_URL}/keys/ttl_key")
+        assert read_response.status_code == 200
+        
+        # Wait for the TTL and the replicated expiration
+        await asyncio.sleep(3)
+        
+        read_response = await client.get(f"{LEADER_URL}/keys/ttl_key")
+        assert read_response.status_code == 404
+        commit_index = (await client.get(f"{LEADER_URL}/replication")).json()["commit_index"]
+        for follower_url in FOLLOWERS:
+            read_response = await client.get(f"{follower_url}/keys/ttl_key")
+            assert read_response.status_code == 404
+            # Removed from the store, not only hidden from reads
+            records = await read_export(client, follower_url)
+            assert all(record.get("key") != "ttl_key" for record in records)
+            # The expiration is a versioned write, so followers apply it without a gap
+            status = (await client.get(f"{follower_url}/replication")).json()
+            assert status["applied_index"] >= commit_index
+
+
+@pytest.mark.asyncio
+async def test_delete_and_compare_and_set():
+    """Test conditional writes and deletes on the leader and that deletes replicate."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await client.delete(f"{LEADER_URL}/keys/cas_key")
+        
+        # Create only if absent
+        response = await client.post(f"{LEADER_URL}/keys", json={"key": "cas_key", "value": "1", "if_version": 0})
+        assert response.status_code == 200
+        version = response.json()["version"]
+        response = await client.post(f"{LEADER_URL}/keys", json={"key": "cas_key", "value": "x", "if_version": 0})
+        assert response.status_code == 409
+        
+        response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "cas_key", "value": "2", "if_version": version}
+        )
+        assert response.status_code == 200
+        new_version = response.json()["version"]
+        
+        # A stale version is rejected with the current state, so no extra read is needed
+        response = await client.post(
+            f"{LEADER_URL}/keys",
+            json={"key": "cas_key", "value": "3", "if_version": version}
+        )
+        assert response.status_code == 409
+        assert response.json()["detail"]["version"] == new_version
+        assert response.json()["detail"]["value"] == "2"
+        
+        response = await client.post(f"{LEADER_URL}/keys", json={"key": "cas_key", "value": "3", "if_value": "2"})
+        assert response.status_code == 200
+        
+        response = await client.delete(f"{LEADER_URL}/keys/cas_key", params={"if_value": "2"})
+        assert response.status_code == 409
+        response = await client.delete(f"{LEADER_URL}/keys/cas_key")
+        assert response.status_code == 200
+        response = await client.delete(f"{LEADER_URL}/keys/cas_key")
+        assert response.status_code == 404
+        
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        assert (await client.get(f"{LEADER_URL}/keys/cas_key")).status_code == 404
+        for follower_url in FOLLOWERS:
+            assert (await client.get(f"{follower_url}/keys/cas_key")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_anti_entropy_removes_keys_deleted_on_leader():
+    """Test that anti-entropy deletes a key a follower still holds after the leader deleted it."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        repair_response = await client.post(
+            f"{FOLLOWERS[1]}/repair",
+            json={"entries": {"follower_only_key": "orphan"}}
+        )
+        assert repair_response.status_code == 200
+        
+        run_response = await client.post(f"{LEADER_URL}/anti-entropy/run")
+        assert run_response.status_code == 200
+        
+        assert (await client.get(f"{FOLLOWERS[1]}/keys/follower_only_key")).status_code == 404
+        leader_root = (await client.get(f"{LEADER_URL}/merkle")).json()["root"]
+        follower_root = (await client.get(f"{FOLLOWERS[1]}/merkle")).json()["root"]
+        assert follower_root == leader_root
+
+
+async def collect_events(client: httpx.AsyncClient, url: str, count: int, **params) -> list:
+    """Read `count` change events from a node's watch stream."""
+    events = []
+    async with client.stream("GET", f"{url}/watch", params=params) as response:
+        assert response.status_code == 200
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                events.append(json.loads(line[len("data:"):]))
+                if len(events) == count:
+                    return events
+    return events
+
+
+@pytest.mark.asyncio
+async def test_watch_streams_changes_and_resumes():
+    """Test that watchers on the leader and a follower see sets and deletes, and can resume."""
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await client.post(f"{LEADER_URL}/keys", json={"key": "watch_key_a", "value": "1"})
+        # Wait for replication
+        await asyncio.sleep(2)
+        
+        watchers = [
+            asyncio.create_task(collect_events(client, url, 3, prefix="watch_key_"))
+            for url in [LEADER_URL, FOLLOWERS[2]]
+        ]
+        # Let the watchers connect
+        await asyncio.sleep(1)
+        
+        first = await client.post(f"{LEADER_URL}/keys", json={"key": "watch_key_b", "value": "2"})
+        await client.post(f"{LEADER_URL}/keys", json={"key": "watch_key_c", "value": "3"})
+        await client.post(f"{LEADER_URL}/keys", json={"key": "other_key", "value": "ignored"})
+        await client.delete(f"{LEADER_URL}/keys/watch_key_a")
+        
+        expected = [("set", "watch_key_b"), ("set", "watch_key_c"), ("delete", "watch_key_a")]
+        leader_events, follower_events = await asyncio.wait_for(asyncio.gather(*watchers), timeout=10)
+        assert [(event["op"], event["key"]) for event in leader_events] == expected
+        # A follower emits changes in the order it applied them, which may differ across keys
+        assert sorted((event["op"], event["key"]) for event in follower_events) == sorted(expected)
+        
+        # Resume after the first write: only the later changes are replayed
+        events = await asyncio.wait_for(
+            collect_events(client, LEADER_URL, 2, prefix="watch_key_", from_version=first.json()["version"]),
+            timeout=10
+        )
+        assert [(event["op"], event["key"]) for event in events] == expected[1:]
+
+
+async def next_change_events(stream, count: int) -> list:
+    """(id or event type, data) of the next `count` events of a ChangeFeed subscription."""
+    events = []
+    while len(events) < count:
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout=2.0)
+        for frame in chunk.decode().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+            if "data" in fields:
+                events.append((fields.get("id", fields.get("event")), json.loads(fields["data"])))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_watch_resumes_after_event_on_out_of_order_follower():
+    """Test that resuming after an event id replays exactly the later changes when versions arrive out of order."""
+    store = LocalStore(KVStore())
+    feed = ChangeFeed(store, poll_interval=0.01)
+    # A follower can apply replicated writes in a different order than their versions
+    await store.apply("watch_b", "2", 2)
+    await store.apply("watch_a", "1", 1)
+
+    stream = feed.subscribe("watch_")
+    assert await asyncio.wait_for(stream.__anext__(), timeout=2.0) == b": connected\n\n"
+    await store.apply("watch_d", "4", 4)
+    await store.apply("watch_c", "3", 3)
+    seen = await next_change_events(stream, 2)
+    await stream.aclose()
+    assert [data["version"] for _, data in seen] == [4, 3]
+
+    # Resuming by version would skip v3 if the watcher passed the highest version it saw, or
+    # repeat v3 if it passed the last one; by event id nothing is missed or repeated
+    await store.apply("watch_e", "5", 5)
+    resumed = feed.subscribe("watch_", after_event=parse_event_id(seen[0][0]))
+    await resumed.__anext__()
+    assert [data["version"] for _, data in await next_change_events(resumed, 2)] == [3, 5]
+    await resumed.aclose()
+
+    # An id from another node's change log cannot be placed here
+    foreign = feed.subscribe("watch_", after_event=("0badcafe", 1))
+    await foreign.__anext__()
+    assert (await next_change_events(foreign, 1))[0] == ("reset", {"reason": "unknown_event_id"})
+    await foreign.aclose()
+
+
+@pytest.mark.asyncio
+async def test_client_batches_and_routes_by_consistency():
+    """Test that the client batches concurrent calls and reads its own writes from followers."""
+    async with KVClient(LEADER_URL, FOLLOWERS, consistency="session") as kv:
+        items = {f"client_key_{i}": f"value_{i}" for i in range(50)}
+        versions = await kv.set_many(items)
+        assert len(set(versions.values())) == 50
+        # 50 concurrent sets go out in far fewer requests
+        assert kv.stats["requests"] < 10
+        
+        # Read-your-writes right away, without waiting for replication
+        assert await kv.get_many(list(items)) == items
+        assert await kv.get("client_key_missing") is None
+        
+        for consistency in ["strong", "bounded", "eventual"]:
+            await kv.set("client_key_0", consistency)
+            # Wait for replication
+            await asyncio.sleep(0.5)
+            assert await kv.get("client_key_0", consistency=consistency) == consistency
+        
+        value, version = await kv.get_entry("client_key_1", consistency="strong")
+        with pytest.raises(ConflictError) as conflict:
+            await kv.compare_and_set("client_key_1", "stale", if_version=version - 1)
+        assert conflict.value.version == version
+        await kv.compare_and_set("client_key_1", "fresh", if_version=version)
+        assert await kv.delete("client_key_1")
+        assert not await kv.delete("client_key_1")
+        assert await kv.get("client_key_1") is None
+
+
+@pytest.mark.asyncio
+async def test_client_near_cache_follows_changes():
+    """Test that cached reads are served locally and refreshed when other clients change keys."""
+    async with KVClient(LEADER_URL, FOLLOWERS, near_cache=NearCache(max_entries=100)) as kv, \
+            httpx.AsyncClient() as client:
+        await kv.get("cache_key")
+        # Let the change stream connect
+        await asyncio.sleep(1)
+        assert kv.cache_stats()["watch_connected"]
+        
+        await kv.set("cache_key", "v1")
+        requests = kv.stats["requests"]
+        for _ in range(10):
+            assert await kv.get("cache_key") == "v1"
+        assert kv.stats["requests"] == requests
+        
+        # Another client overwrites, then deletes the key
+        await client.post(f"{LEADER_URL}/keys", json={"key": "cache_key", "value": "v2"})
+        await asyncio.sleep(0.5)
+        assert await kv.get("cache_key") == "v2"
+        await client.delete(f"{LEADER_URL}/keys/cache_key")
+        await asyncio.sleep(0.5)
+        assert await kv.get("cache_key", consistency="strong") is None
+        
+        stats = kv.cache_stats()
+        assert stats["hits"] >= 11
+        assert stats["updates"] == 1
+        assert stats["invalidations"] == 1
+        assert stats["entries"] == 0
+
+
+
+
+def test_near_cache_counts_bytes_and_expires_by_default():
+    """Test that the near cache bounds UTF-8 bytes, not characters, and expires entries unless told not to."""
+    cache = NearCache(max_bytes=100)
+    cache.put("k", "\u00e9" * 30, 1)
+    assert cache.stats()["bytes"] == 61
+    cache.put("k2", "\u00e9" * 30, 1)
+    assert cache.get("k") is None and cache.stats()["evictions"] == 1
+    
+    assert NearCache().max_age is not None
+    assert NearCache(max_age_ms=None).max_age is None
+
+
+@pytest.mark.asyncio
+async def test_near_cache_skips_values_older_than_its_watch():
+    """Test that a lagging follower's value, changed before the watch connected, is neither returned nor cached."""
+    follower = FOLLOWERS[-1]
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        before = (await client.get(f"{follower}/config/network")).json()
+        await client.post(f"{LEADER_URL}/keys", json={"key": "near_stale_key", "value": "v1"})
+        await asyncio.sleep(1)
+        try:
+            # The follower misses the overwrite
+            await client.post(f"{follower}/config/network", json={"loss_rate": 1.0, "timeout_ms": 50})
+            await client.post(f"{LEADER_URL}/keys", json={"key": "near_stale_key", "value": "v2"})
+            assert (await client.get(f"{follower}/keys/near_stale_key")).json()["value"] == "v1"
+            
+            async with KVClient(LEADER_URL, [follower], consistency="eventual", near_cache=NearCache()) as kv:
+                await kv.get("other_key")
+                while not kv.cache_stats()["watch_connected"]:
+                    await asyncio.sleep(0.1)
+                # The follower has not applied the leader's index at the watch's start, so the leader answers
+                assert await kv.get("near_stale_key") == "v2"
+                assert kv.near_cache.get("near_stale_key")[0] == "v2"
+        finally:
+            await client.post(f"{follower}/config/network", json={
+                "loss_rate": before["loss_rate"], "timeout_ms": before["timeout_ms"]
+            })
+            await client.post(f"{LEADER_URL}/anti-entropy/run")
+
+
+def test_hash_ring_moves_keys_only_to_new_group():
+    """Test that adding a group takes a fair share of keys and moves no others."""
+    keys = [f"ring_key_{i}" for i in range(20000)]
+    ring = HashRing(["g1", "g2", "g3"])
+    bigger = ring.with_group("g4")
+    moved = [key for key in keys if bigger.owner(key) != ring.owner(key)]
+    assert all(bigger.owner(key) == "g4" for key in moved)
+    # Keys follow the new group's share of the hash space, about a quarter
+    share = bigger.ownership()["g4"]
+    assert 0.15 < share < 0.35
+    assert abs(len(moved) / len(keys) - share) < 0.02
+    assert abs(sum(bigger.ownership().values()) - 1.0) < 1e-9
+    assert [ring.owner(key) for key in keys] == [bigger.without_group("g4").owner(key) for key in keys]
+
+
+@pytest.mark.asyncio
+async def test_rebalance_replaces_copy_written_on_old_ring():
+    """Test that a move whose source delete conflicts leaves the newer source value on the new owner."""
+    env = {"FOLLOWERS": "", "WRITE_QUORUM": "0", "ANTI_ENTROPY_INTERVAL_S": "0", "PEERS": "", "REPL_PORT": "0"}
+    nodes = {name: load_node("leader.py", f"rebalance_{name}", env) for name in ["g1", "g2"]}
+    async with nodes["g1"].app.router.lifespan_context(nodes["g1"].app), \
+            nodes["g2"].app.router.lifespan_context(nodes["g2"].app):
+        kv = ShardedKVClient({"g1": ("http://g1", [])}, consistency="strong")
+        kv.add_group("g2", "http://g2")
+        for name, client in kv.clients.items():
+            await client.http.aclose()
+            client.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=nodes[name].app))
+        # Keys that move to g2, written on g1 as by clients still on the old ring
+        keys = [f"rebalance_key_{i}" for i in range(200) if kv.ring.owner(f"rebalance_key_{i}") == "g2"][:3]
+        written, deleted, _ = keys
+        for key in keys:
+            await kv.clients["g1"].set(key, "old")
+
+        write_batch = kv.clients["g2"].write_batch
+        interleaved = False
+
+        async def write_batch_with_old_ring_writes(items):
+            nonlocal interleaved
+            results = await write_batch(items)
+            if not interleaved:
+                # Right after the copy: an old-ring client writes one key and deletes another
+                interleaved = True
+                await kv.clients["g1"].set(written, "new")
+                await kv.clients["g1"].delete(deleted)
+            return results
+
+        kv.clients["g2"].write_batch = write_batch_with_old_ring_writes
+        async with kv:
+            stats = await kv.rebalance()
+            assert interleaved
+            assert stats["conflict"] == 0
+            assert await kv.get(written) == "new"
+            assert await kv.get(deleted) is None
+            assert await kv.get(keys[2]) == "old"
+            for key in keys:
+                assert await kv.clients["g1"].get(key) is None
+
+
+STREAM_LEADER = "http://localhost:8700"
+STREAM_FOLLOWERS = ["http://localhost:8701", "http://localhost:8702"]
+
+
+def start_stream_follower(url: str) -> subprocess.Popen:
+    port = int(url.rsplit(":", 1)[1])
+    env = dict(os.environ, FOLLOWER_PORT=str(port), FOLLOWER_ID=f"stream{port}", FOLLOWER_URL=url,
+               LEADER_URL=STREAM_LEADER, PEERS="", REPL_PORT=str(port + 1000), MAX_DELAY_MS="20", WORKERS="1")
+    return subprocess.Popen([sys.executable, "follower.py"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_stream_cluster() -> dict:
+    """A separate leader and two followers replicating over the binary stream transport."""
+    processes = {url: start_stream_follower(url) for url in STREAM_FOLLOWERS}
+    env = dict(os.environ, LEADER_PORT="8700", LEADER_URL=STREAM_LEADER, FOLLOWERS=",".join(STREAM_FOLLOWERS),
+               WRITE_QUORUM="2", REPLICATION_TRANSPORT="stream", WORKERS="1")
+    processes[STREAM_LEADER] = subprocess.Popen([sys.executable, "leader.py"], env=env,
+                                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return processes
+
+
+async def wait_until_healthy(client: httpx.AsyncClient, url: str):
+    for _ in range(100):
+        try:
+            if (await client.get(f"{url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise AssertionError(f"{url} did not start")
+
+
+@pytest.mark.asyncio
+async def test_stream_transport_replicates_and_reconnects():
+    """Test that followers converge over the stream transport and the leader reconnects after a follower restarts."""
+    processes = start_stream_cluster()
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            for url in [*STREAM_FOLLOWERS, STREAM_LEADER]:
+                await wait_until_healthy(client, url)
+            
+            for i in range(20):
+                response = await client.post(f"{STREAM_LEADER}/keys", json={"key": f"stream_key_{i}", "value": f"v{i}"})
+                assert response.json()["replicated_to"] == 2
+            assert (await client.delete(f"{STREAM_LEADER}/keys/stream_key_0")).status_code == 200
+            leader_store = (await client.get(f"{STREAM_LEADER}/state")).json()["store"]
+            for url in STREAM_FOLLOWERS:
+                assert (await client.get(f"{url}/state")).json()["store"] == leader_store
+                # Nothing came over HTTP
+                assert not re.search(r'handler="(lean_)?replicate', (await client.get(f"{url}/metrics")).text)
+            
+            # The follower drops the stream; the leader must open a new connection to its successor
+            restarted = STREAM_FOLLOWERS[0]
+            processes[restarted].kill()
+            processes[restarted].wait()
+            processes[restarted] = start_stream_follower(restarted)
+            await wait_until_healthy(client, restarted)
+            replicated_to = []
+            for i in range(5):
+                response = await client.post(f"{STREAM_LEADER}/keys", json={"key": f"after_restart_{i}", "value": "v"})
+                replicated_to.append(response.json()["replicated_to"] if response.status_code == 200 else None)
+            # At most the first write finds the old connection dead
+            assert replicated_to[1:] == [2] * 4
+            response = await client.get(f"{restarted}/keys/after_restart_4")
+            assert response.json()["value"] == "v"
+    finally:
+        for process in processes.values():
+            process.kill()
+            process.wait()
+
+
+FAILOVER_LEADER = "http://localhost:8500"
+FAILOVER_FOLLOWERS = ["http://localhost:8501", "http://localhost:8502", "http://localhost:8503"]
+
+
+def start_failover_cluster() -> dict:
+    """A separate leader and three followers with elections enabled, so the leader can be killed."""
+    processes = {}
+    for i, url in enumerate(FAILOVER_FOLLOWERS, start=1):
+        env = dict(os.environ, FOLLOWER_PORT=url.rsplit(":", 1)[1], FOLLOWER_ID=f"failover{i}", FOLLOWER_URL=url,
+                   LEADER_URL=FAILOVER_LEADER, PEERS=",".join(peer for peer in FAILOVER_FOLLOWERS if peer != url),
+                   ELECTION_TIMEOUT_MS="300", HEARTBEAT_INTERVAL_MS="50", MAX_DELAY_MS="20", WORKERS="1")
+        processes[url] = subprocess.Popen([sys.executable, "follower.py"], env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ, LEADER_PORT="8500", LEADER_URL=FAILOVER_LEADER, FOLLOWERS=",".join(FAILOVER_FOLLOWERS),
+               WRITE_QUORUM="2", HEARTBEAT_INTERVAL_MS="50", WORKERS="1")
+    processes[FAILOVER_LEADER] = subprocess.Popen([sys.executable, "leader.py"], env=env,
+                                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return processes
+
+
+@pytest.mark.asyncio
+async def test_failover_promotes_follower_and_redirects_writes():
+    """Test that killing the leader elects a follower holding every acked write and writes move to it."""
+    processes = start_failover_cluster()
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            for url in [FAILOVER_LEADER, *FAILOVER_FOLLOWERS]:
+                for _ in range(100):
+                    try:
+                        if (await client.get(f"{url}/")).json().get("leader_url") == FAILOVER_LEADER:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.1)
+        
+        async with KVClient(FAILOVER_LEADER, FAILOVER_FOLLOWERS, retries=200, backoff_base_s=0.01,
+                            backoff_max_s=0.05) as kv:
+            versions = await kv.set_many({f"failover_key_{i}": f"value_{i}" for i in range(50)})
+            processes[FAILOVER_LEADER].send_signal(signal.SIGKILL)
+            
+            # The write waits out the election and lands on the new leader
+            version = await kv.set("after_failover", "new_leader_value")
+            assert version > max(versions.values())
+            new_leader = kv.leader_url
+            assert new_leader in FAILOVER_FOLLOWERS
+            assert kv.stats["leader_changes"] == 1
+            values = await kv.get_many([f"failover_key_{i}" for i in range(50)], consistency="strong")
+            assert values == {f"failover_key_{i}": f"value_{i}" for i in range(50)}
+        
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            other = next(url for url in FAILOVER_FOLLOWERS if url != new_leader)
+            info = (await client.get(f"{other}/")).json()
+            assert info["role"] == "follower"
+            assert info["term"] >= 2
+            assert info["leader_url"] == new_leader
+            
+            # Followers send writes on to the new leader
+            response = await client.post(f"{other}/keys", json={"key": "via_follower", "value": "redirected"})
+            assert response.status_code == 307
+            assert response.headers["location"] == f"{new_leader}/keys"
+            
+            # Replication from a leader of the old term is refused
+            response = await client.post(f"{other}/replicate", json={
+                "key": "stale_leader_key", "value": "stale", "version": 10 ** 6, "term": 1
+            })
+            assert response.status_code == 409
+            assert response.json()["detail"]["term"] == info["term"]
+            
+            # Wait for replication
+            await asyncio.sleep(1)
+            read_response = await client.get(f"{other}/keys/after_failover")
+            assert read_response.json()["value"] == "new_leader_value"
+            assert (await client.get(f"{other}/keys/stale_leader_key")).status_code == 404
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
+
+
+@pytest.mark.asyncio
+async def test_candidate_behind_peer_change_log_stands_down():
+    """Test that a candidate more than a change log behind a peer does not take over, and one within it catches up."""
+    peer = load_node("follower.py", "catch_up_peer", {"PEERS": "", "REPL_PORT": "0", "LOOP_LAG_INTERVAL_MS": "0"})
+    num_writes = MAX_CHANGE_LOG + 100
+    await peer.store.apply_many([(f"catch_up_{i}", "v", i, [], 0.0) for i in range(1, num_writes + 1)])
+
+    async with peer.app.router.lifespan_context(peer.app):
+        behind = LocalStore(KVStore())
+        await behind.apply_many([(f"catch_up_{i}", "v", i, [], 0.0) for i in range(1, 51)])
+        election = Election(behind, "candidate", "http://candidate", ["http://peer"], 1.0)
+        election.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=peer.app))
+        try:
+            # The writes between 50 and the oldest one still in the peer's log cannot be pulled
+            assert await election._catch_up(50) is None
+            assert (await behind.replication_status())["applied_index"] == 50
+            assert await behind.get(f"catch_up_{num_writes}") is None
+            
+            assert await election._catch_up(num_writes - 10) == num_writes
+            assert await behind.get(f"catch_up_{num_writes}") == ("v", num_writes)
+        finally:
+            await election.close()
+
+
+def test_simulator_is_reproducible():
+    """Test that the in-process simulator gives the same results for the same seed, without real delays."""
+    runs = [simulate(num_followers=3, quorum=2, delay="uniform:0:1000", num_writes=200, seed=3) for _ in range(2)]
+    for run in runs:
+        assert run["success_rate"] == 1.0
+        assert run["converged"] == 3
+        # Seconds of simulated delays take a fraction of that in real time
+        assert run["wall_seconds"] < run["virtual_seconds"] / 2
+    assert {k: v for k, v in runs[0].items() if k != "wall_seconds"} == \
+           {k: v for k, v in runs[1].items() if k != "wall_seconds"}
+
+    # A larger quorum waits for slower followers
+    assert simulate(num_followers=3, quorum=3, num_writes=200, seed=3)["avg_latency"] > runs[0]["avg_latency"]
+
+
+@pytest.mark.asyncio
+async def test_network_model_loses_messages_at_runtime():
+    """Test that a follower's network model can be changed at runtime to lose and partition messages."""
+    follower = FOLLOWERS[4]
+    key = f"lost_on_the_way_{time.time()}"
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        response = await client.post(f"{follower}/config/network", json={"delay": "pareto:10"})
+        assert response.status_code == 400
+        
+        before = (await client.get(f"{follower}/config/network")).json()
+        try:
+            response = await client.post(f"{follower}/config/network", json={"loss_rate": 1.0, "timeout_ms": 50})
+            assert response.status_code == 200
+            assert response.json()["loss_rate"] == 1.0
+            
+            write_response = await client.post(f"{LEADER_URL}/keys", json={"key": key, "value": "v"})
+            assert write_response.status_code == 200
+            
+            # Wait for replication
+            await asyncio.sleep(1)
+            assert (await client.get(f"{follower}/keys/{key}")).status_code == 404
+            assert (await client.get(f"{follower}/config/network")).json()["lost"] > before["lost"]
+            
+            response = await client.post(f"{follower}/config/network", json={"loss_rate": 0.0, "partition_ms": 60000})
+            assert (await client.get(f"{follower}/config/network")).json()["partitioned_now"] is True
+            response = await client.post(f"{follower}/config/network", json={"partition_ms": 0})
+            assert response.json()["partitions"] == []
+        finally:
+            await client.post(f"{follower}/config/network", json={
+                "loss_rate": before["loss_rate"], "timeout_ms": before["timeout_ms"], "partition_ms": 0
+            })
+            # Bring the follower back in line with the leader
+            await client.post(f"{LEADER_URL}/anti-entropy/run")
+        
+        assert (await client.get(f"{follower}/keys/{key}")).json()["value"] == "v"
+
+
+@pytest.mark.asyncio
+async def test_fast_path_matches_models():
+    """Test that the lean endpoints answer like the Pydantic ones, errors included."""
+    env = {"FOLLOWERS": "", "WRITE_QUORUM": "0", "ANTI_ENTROPY_INTERVAL_S": "0", "DELAY_MODEL": "constant:0",
+           "PEERS": "", "REPL_PORT": "0"}
+    leader_requests = [
+        ("POST", "/keys", {"key": "a", "value": "1"}),
+        ("POST", "/keys", {"key": "a", "value": "2", "ttl_ms": 60000}),
+        ("POST", "/keys", {"key": "a", "value": "3", "if_version": 1}),
+        ("POST", "/keys", {"key": "b", "value": None}),
+        ("POST", "/keys", {"key": "b"}),
+        ("POST", "/keys", {"key": 5, "value": "1", "if_version": "x"}),
+        # Pydantic's lax mode takes numeric strings and integral floats for ints
+        ("POST", "/keys", {"key": "a", "value": "4", "ttl_ms": "60000"}),
+        ("POST", "/keys", {"key": "a", "value": "5", "if_version": 3.0}),
+        ("POST", "/keys", {"key": "a", "value": "6", "if_version": 3.5}),
+        ("POST", "/keys", {"key": "a", "value": "7", "if_version": True, "ttl_ms": "1_000_000"}),
+        ("GET", "/keys/a", None),
+        ("GET", "/keys/missing", None),
+    ]
+    follower_requests = [
+        ("POST", "/replicate", {"key": "a", "value": "1", "version": 1, "term": 1}),
+        ("POST", "/replicate/batch", {"items": [{"key": "b", "value": "2", "version": 2},
+                                                {"key": "c", "value": None, "version": 3, "superseded": [1]}],
+                                      "term": 1}),
+        ("POST", "/replicate/batch", {"items": [{"key": "d", "version": "four"}], "term": 1}),
+        ("POST", "/replicate", {"key": "a", "value": "1", "version": 4, "superseded": ["x"]}),
+        ("POST", "/replicate/batch", {"items": [{"key": "e", "value": "5", "version": "5", "superseded": ["4", 3.0]}],
+                                      "term": "1"}),
+        ("POST", "/replicate", {"key": "f", "value": "6", "version": 6.0, "expires_at": "0", "term": 1}),
+        ("POST", "/replicate", {"key": "f", "value": 6, "version": 7}),
+        ("GET", "/keys/a", None),
+        ("GET", "/keys/a?min_version=1", None),
+        ("GET", "/keys/a?min_version=1.0", None),
+        ("GET", "/keys/a?min_version=%201", None),
+        ("GET", "/keys/a?min_version=abc", None),
+        ("GET", "/keys/e", None),
+        ("GET", "/keys/c", None),
+    ]
+    answers = {}
+    for fast in [False, True]:
+        for filename, requests in [("leader.py", leader_requests), ("follower.py", follower_requests)]:
+            node = load_node(filename, f"fast_path_{filename[:-3]}_{fast}", {**env, "FAST_PATH": str(fast).lower()})
+            async with node.app.router.lifespan_context(node.app):
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=node.app),
+                                             base_url="http://node") as client:
+                    for method, path, body in requests:
+                        response = await client.request(method, path, json=body)
+                        answer = response.json()
+                        if isinstance(answer, dict):
+                            answer.pop("latency_seconds", None)
+                            answer["expires_at"] = answer.get("expires_at") is not None
+                        if response.status_code == 422:
+                            # Pydantic's messages and URLs differ; the shape and locations must not
+                            answer = sorted(tuple(error["loc"]) for error in answer["detail"])
+                        answers.setdefault((filename, method, path, json.dumps(body)), []).append(
+                            (response.status_code, answer))
+    for request, (models, fast) in answers.items():
+        assert models == fast, request
+    assert answers[("leader.py", "POST", "/keys", json.dumps({"key": "b"}))][1][0] == 422
+    lax_write = {"key": "a", "value": "5", "if_version": 3.0}
+    assert answers[("leader.py", "POST", "/keys", json.dumps(lax_write))][1][0] == 200
+    assert answers[("follower.py", "GET", "/keys/e", "null")][1] == (200, {"key": "e", "value": "5", "version": 5,
+                                                                           "expires_at": False})
+
+
+def test_workload_plans_are_seeded_and_skewed():
+    """Test that YCSB-style workload plans repeat per seed and follow their key distributions."""
+    plan = plan_operations(0.5, "zipfian", 1000, 5000, random.Random(1))
+    assert plan == plan_operations(0.5, "zipfian", 1000, 5000, random.Random(1))
+    assert 0.45 < sum(is_read for is_read, _ in plan) / len(plan) < 0.55
+    # Under a zipfian distribution the hottest key takes a large share
+    hottest = max(set(index for _, index in plan), key=[index for _, index in plan].count)
+    assert hottest == 0
+    assert [index for _, index in plan].count(0) > 5000 / 20
+
+    # Writes of the latest distribution insert new keys; reads favour the newest
+    plan = plan_operations(0.9, "latest", 100, 1000, random.Random(2))
+    inserts = [index for is_read, index in plan if not is_read]
+    assert inserts == list(range(100, 100 + len(inserts)))
+    reads = [index for is_read, index in plan if is_read]
+    assert sum(index >= 50 for index in reads) > 0.8 * len(reads)
+
+
+def register_history(operations: int, rng: random.Random) -> list:
+    """
+    A linearizable history over 100 keys: operation i takes effect at time i, within an
+    interval overlapping its neighbours', and ten processes take turns issuing operations.
+    """
+    state = {}
+    history = []
+    for i in range(operations):
+        key = f"key_{rng.randrange(100)}"
+        op = {"process": f"p{i % 10}", "key": key, "node": "n", "ok": True,
+              "start": i - rng.uniform(0, 4), "end": i + rng.uniform(0, 4)}
+        if rng.random() < 0.5:
+            state[key] = (f"value_{i}", i + 1)
+            history.append({**op, "type": "write", "value": f"value_{i}", "version": i + 1})
+        else:
+            value, version = state.get(key, (None, 0))
+            history.append({**op, "type": "read", "value": value, "version": version})
+    for node in ["n1", "n2"]:
+        for key, (value, version) in state.items():
+            history.append({"type": "final", "key": key, "value": value, "version": version, "node": node})
+    return history
+
+
+def test_consistency_checker_finds_anomalies():
+    """Test that the checker passes a linearizable 100k-operation history quickly and catches injected anomalies."""
+    history = register_history(100000, random.Random(3))
+    start_time = time.perf_counter()
+    assert check(history) == {"eventual": [], "read-your-writes": [], "monotonic-reads": [],
+                              "linearizable": []}
+    assert time.perf_counter() - start_time < 10
+
+    # p0 writes key_0, p1 reads the new value and then, like p0, an older one from a stale node
+    t = 200000
+    op = {"key": "key_0", "node": "n", "ok": True}
+    stale = next(o for o in reversed(history) if o["type"] == "write" and o["key"] == "key_0")
+    history += [
+        {**op, "process": "p0", "type": "write", "value": "new", "version": 1000001, "start": t, "end": t + 1},
+        {**op, "process": "p1", "type": "read", "value": "new", "version": 1000001, "start": t + 2, "end": t + 3},
+        {**op, "process": "p1", "type": "read", "value": stale["value"], "version": stale["version"],
+         "start": t + 4, "end": t + 5},
+        {**op, "process": "p0", "type": "read", "value": stale["value"], "version": stale["version"],
+         "start": t + 6, "end": t + 7},
+        # A read of a value nobody wrote, and a node that lost a key
+        {**op, "process": "p2", "type": "read", "value": "bogus", "version": 1000002, "start": t, "end": t + 1},
+        {"type": "final", "key": "key_1", "value": None, "version": 0, "node": "n2"},
+    ]
+    results = check(history)
+    assert len(results["read-your-writes"]) == 1
+    assert len(results["monotonic-reads"]) == 1
+    assert len(results["linearizable"]) == 2
+    assert "no recorded write" in results["linearizable"][0]
+    # key_0 never reached the final states, and key_1 diverges
+    assert len(results["eventual"]) == 2
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
-
@@ -0,0 +1,655 @@
+"""
+The leader's write path: admission control, writes applied under key locks and replicated
+to followers with a quorum, and the loops a leader runs (heartbeats, TTL expiry and
+anti-entropy). The leader builds one at startup; a follower builds one only once it is
+elected, for its own store and its peers, and drops it when it steps down.
+"""
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import RedirectResponse
+from pydantic import BaseModel
+
+import fast_path
+from follower_stats import FollowerTracker
+from key_locks import KeyLocks
+from merkle import children, repair_level
+from metrics import Registry
+from replication_queue import ReplicationQueue, ShipItem
+from replication_stream import StreamReplicator
+
+QUORUM_MODES = ("all", "fastest")
+
+
+class WriteRequest(BaseModel):
+    key: str
+    value: str
+    # Time to live; the key is deleted on every replica once it passes
+    ttl_ms: Optional[int] = None
+    # Compare-and-set: only write if the key is at this version (0 = absent) / has this value
+    if_version: Optional[int] = None
+    if_value: Optional[str] = None
+
+
+class BatchItem(WriteRequest):
+    # None deletes the key
+    value: Optional[str]
+
+
+class BatchWriteRequest(BaseModel):
+    items: List[BatchItem]
+
+
+class WritePathConfig:
+    """Write path settings, read from the environment by the node that builds a WritePath."""
+
+    def __init__(self, env: Mapping[str, str] = os.environ):
+        self.write_quorum = int(env.get("WRITE_QUORUM", "3"))
+        # "all" replicates to every follower at once; "fastest" to the fastest WRITE_QUORUM plus hedges
+        self.quorum_mode = env.get("QUORUM_MODE", "all")
+        self.anti_entropy_interval_s = float(env.get("ANTI_ENTROPY_INTERVAL_S", "30"))
+        self.heartbeat_interval_ms = int(env.get("HEARTBEAT_INTERVAL_MS", "200"))
+        self.max_batch_size = int(env.get("MAX_BATCH_SIZE", "10000"))
+        self.expiry_interval_ms = int(env.get("EXPIRY_INTERVAL_MS", "100"))
+        self.max_expirations_per_tick = int(env.get("MAX_EXPIRATIONS_PER_TICK", "1000"))
+        # "http" posts JSON to /replicate; "stream" uses the followers' binary replication port
+        self.replication_transport = env.get("REPLICATION_TRANSPORT", "http")
+        self.eject_after_failures = int(env.get("EJECT_AFTER_FAILURES", "3"))
+        self.eject_seconds = float(env.get("EJECT_SECONDS", "5"))
+        # How long a write waits for its quorum, how many writes may wait at once, and how
+        # many unacknowledged replications a follower may have before it is skipped
+        self.quorum_deadline_ms = int(env.get("QUORUM_DEADLINE_MS", "5000"))
+        self.max_inflight_writes = int(env.get("MAX_INFLIGHT_WRITES", "1000"))
+        self.max_follower_backlog = int(env.get("MAX_FOLLOWER_BACKLOG", "1000"))
+        self.replication_timeout_s = float(env.get("REPLICATION_TIMEOUT_S", "10"))
+        self.retry_after_s = int(env.get("RETRY_AFTER_S", "1"))
+        # Per-follower send queue: writes to a key still waiting in the queue replace the queued value
+        self.coalesce_writes = env.get("COALESCE_WRITES", "true").lower() == "true"
+        self.max_messages_per_follower = int(env.get("MAX_MESSAGES_PER_FOLLOWER", "16"))
+        self.max_items_per_message = int(env.get("MAX_ITEMS_PER_MESSAGE", "100"))
+        # Writes held for one follower, queued or in flight; beyond that it is left to anti-entropy
+        self.max_follower_queue = int(env.get("MAX_FOLLOWER_QUEUE", "10000"))
+        # Encode replication messages without Pydantic (see fast_path.py)
+        self.fast_path = env.get("FAST_PATH", "true").lower() == "true"
+
+
+class WritePath:
+    def __init__(self, store, key_locks: KeyLocks, followers: List[str], leader_url: str, term: int,
+                 write_quorum: int, quorum_mode: str, config: WritePathConfig):
+        self.store = store
+        self.key_locks = key_locks
+        self.followers = list(followers)
+        self.leader_url = leader_url
+        self.term = term
+        self.write_quorum = write_quorum
+        self.quorum_mode = quorum_mode
+        self.config = config
+        self.client: Optional[httpx.AsyncClient] = None
+        # Heartbeats, expiry and anti-entropy, running while this node leads
+        self.tasks: List[asyncio.Task] = []
+        # Replications still running after their write reached quorum
+        self.background_replications: Set[asyncio.Task] = set()
+        # Follower URL -> stream connection, or None if the follower has no replication port
+        self.stream_replicators: Dict[str, Optional[StreamReplicator]] = {}
+        self.follower_tracker = FollowerTracker(self.followers, config.eject_after_failures, config.eject_seconds)
+        self.replication_queues = {
+            follower: ReplicationQueue(
+                functools.partial(self.send_replication, follower),
+                config.coalesce_writes,
+                config.max_messages_per_follower,
+                config.max_items_per_message,
+                config.max_follower_queue,
+                functools.partial(self.repair_after_overflow, follower)
+            )
+            for follower in self.followers
+        }
+        self.inflight_writes = 0
+        self.rejected_writes = 0
+        # (term, leader URL) of a newer leader seen in a follower's reply; writes are redirected there
+        self.superseded_by: Optional[Tuple[int, Optional[str]]] = None
+        self.metrics = Registry()
+        self._add_metrics()
+
+    def _add_metrics(self):
+        self.quorum_wait = self.metrics.histogram(
+            "kv_quorum_wait_seconds", "Time from applying a write locally until its quorum was met or missed",
+            ("outcome",)
+        )
+        self.replication_latency = self.metrics.histogram(
+            "kv_replication_latency_seconds", "Time from queueing a write for a follower until it acked", ("follower",)
+        )
+        self.replication_rtt = self.metrics.histogram(
+            "kv_replication_rtt_seconds", "Round trip of one replication message to a follower", ("follower",)
+        )
+        self.metrics.gauge("kv_writes_in_flight", "Writes applied locally and waiting for their quorum",
+                           lambda: self.inflight_writes)
+        self.metrics.counter("kv_writes_rejected_total", "Writes rejected by admission control",
+                             lambda: self.rejected_writes)
+        self.metrics.gauge("kv_background_replications", "Replications still running after their write's quorum",
+                           lambda: len(self.background_replications))
+        self.metrics.gauge("kv_replication_backlog", "Writes submitted to a follower and not yet acked",
+                           lambda: {(url,): stats.inflight for url, stats in self.follower_tracker.stats.items()},
+                           ("follower",))
+        self.metrics.gauge("kv_replication_queue_depth", "Writes queued for a follower behind its in-flight messages",
+                           lambda: {(url,): len(queue.queue) for url, queue in self.replication_queues.items()},
+                           ("follower",))
+        self.metrics.gauge("kv_replication_messages_in_flight", "Replication messages sent and not yet answered",
+                           lambda: {(url,): queue.inflight for url, queue in self.replication_queues.items()},
+                           ("follower",))
+        self.metrics.counter("kv_replication_dropped_total",
+                             "Writes not sent to a follower because its queue was full",
+                             lambda: {(url,): queue.dropped for url, queue in self.replication_queues.items()},
+                             ("follower",))
+        self.metrics.counter("kv_replication_failures_total", "Replications a follower failed or timed out",
+                             lambda: {(url,): stats.failures for url, stats in self.follower_tracker.stats.items()},
+                             ("follower",))
+
+    def apply_config(self, config: Dict):
+        self.write_quorum = config["write_quorum"]
+        self.quorum_mode = config["quorum_mode"]
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        """Start replicating and the leader's loops; `transport` replaces the network (simulator)."""
+        limits = httpx.Limits(max_keepalive_connections=10, max_connections=100)
+        self.client = httpx.AsyncClient(
+            timeout=self.config.replication_timeout_s,
+            limits=limits,
+            http2=False,
+            transport=transport
+        )
+        self.tasks.extend([asyncio.create_task(self._heartbeat_loop()), asyncio.create_task(self._expiry_loop())])
+        if self.config.anti_entropy_interval_s > 0:
+            self.tasks.append(asyncio.create_task(self._anti_entropy_loop()))
+        print(f"Leader of term {self.term} at {self.leader_url} with {len(self.followers)} followers: "
+              f"{self.followers}")
+        print(f"Write quorum: {self.write_quorum}, replication transport: {self.config.replication_transport}, "
+              f"quorum mode: {self.quorum_mode}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+        for queue in self.replication_queues.values():
+            await queue.close()
+        for replicator in self.stream_replicators.values():
+            if replicator:
+                await replicator.close()
+        self.stream_replicators.clear()
+        if self.client:
+            await self.client.aclose()
+
+    # Replication
+
+    async def _get_stream_replicator(self, follower_url: str) -> Optional[StreamReplicator]:
+        """Discover the follower's replication port on first use."""
+        if follower_url not in self.stream_replicators:
+            response = await self.client.get(f"{follower_url}/")
+            port = response.json().get("replication_port")
+            if follower_url in self.stream_replicators:
+                return self.stream_replicators[follower_url]
+            self.stream_replicators[follower_url] = (
+                StreamReplicator(urlsplit(follower_url).hostname, port, self.config.replication_timeout_s)
+                if port else None
+            )
+        return self.stream_replicators[follower_url]
+
+    async def send_replication(self, follower_url: str, items: List[ShipItem]) -> bool:
+        start_time = time.perf_counter()
+        try:
+            if self.client is None:
+                raise RuntimeError("Shared HTTP client not initialized")
+            if self.config.replication_transport == "stream":
+                replicator = await self._get_stream_replicator(follower_url)
+                if replicator:
+                    ok = await replicator.replicate(items, self.term)
+                    self.replication_rtt.observe(time.perf_counter() - start_time, follower_url)
+                    return ok
+            payloads = [
+                {"key": key, "value": value, "version": version, "superseded": superseded, "expires_at": expires_at}
+                for key, value, version, superseded, expires_at in items
+            ]
+            if len(payloads) == 1:
+                path, body = "/replicate", {**payloads[0], "term": self.term}
+            else:
+                path, body = "/replicate/batch", {"items": payloads, "term": self.term}
+            if self.config.fast_path:
+                response = await self.client.post(f"{follower_url}{path}", content=orjson.dumps(body),
+                                                  headers=fast_path.JSON_HEADERS)
+            else:
+                response = await self.client.post(f"{follower_url}{path}", json=body)
+            self.replication_rtt.observe(time.perf_counter() - start_time, follower_url)
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error replicating to {follower_url}: {e}")
+            return False
+
+    def repair_after_overflow(self, follower_url: str):
+        """The follower's queue overflowed and it missed writes; it has caught up with the rest, so repair it now."""
+        async def repair():
+            try:
+                repaired = await self.repair_follower(follower_url)
+                print(f"Anti-entropy repaired {repaired} keys on {follower_url} after its replication queue "
+                      f"overflowed")
+            except Exception as e:
+                print(f"Anti-entropy repair failed for {follower_url}: {e}")
+
+        self.tasks.append(asyncio.create_task(repair()))
+
+    def _run_in_background(self, task: asyncio.Task):
+        self.background_replications.add(task)
+        task.add_done_callback(self.background_replications.discard)
+
+    async def replicate_with_quorum(self, items: List[Tuple[str, Optional[str], int, float]]) -> int:
+        """
+        Replicate one message of (key, value, version, expires_at) items, a None value being a
+        delete, and return once write_quorum followers confirmed, or every candidate answered.
+        Returns the number of confirmations.
+
+        In "all" mode the message goes to every available follower at once. In "fastest" mode
+        it goes to the write_quorum fastest followers first; another follower is added when one
+        fails or when the selected ones take longer than their p95 (a hedge). Followers not
+        needed for the quorum get the message in the background. Ejected followers are skipped
+        unless they are needed to reach the quorum; anti-entropy catches them up later.
+        """
+        tracker = self.follower_tracker
+
+        async def replicate_to_follower(follower_url: str) -> bool:
+            start_time = time.monotonic()
+            tracker.begin(follower_url)
+            try:
+                ok = await self.replication_queues[follower_url].submit(items)
+            finally:
+                tracker.end(follower_url)
+            if ok:
+                latency = time.monotonic() - start_time
+                tracker.record_success(follower_url, latency)
+                self.replication_latency.observe(latency, follower_url)
+            else:
+                tracker.record_failure(follower_url)
+            return ok
+
+        # Followers with a full backlog are skipped and left to anti-entropy, bounding memory
+        write_quorum = self.write_quorum
+        candidates = tracker.candidates(write_quorum, self.config.max_follower_backlog)
+        if self.quorum_mode == "fastest":
+            selected, spare = candidates[:write_quorum], candidates[write_quorum:]
+            hedge_delay = tracker.hedge_delay(selected)
+        else:
+            selected, spare = candidates, []
+            hedge_delay = None
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.config.quorum_deadline_ms / 1000.0
+        successful_count = 0
+        pending_tasks = {asyncio.create_task(replicate_to_follower(follower)) for follower in selected}
+
+        # Wait for quorum by processing tasks as they complete
+        while successful_count < write_quorum and (pending_tasks or spare):
+            if not pending_tasks:
+                pending_tasks.add(asyncio.create_task(replicate_to_follower(spare.pop(0))))
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            timeout = min(hedge_delay, remaining) if spare and hedge_delay is not None else remaining
+            done, pending_tasks = await asyncio.wait(
+                pending_tasks,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                if not spare or loop.time() >= deadline:
+                    break
+                # Selected followers are slower than usual: hedge with the next fastest one
+                pending_tasks.add(asyncio.create_task(replicate_to_follower(spare.pop(0))))
+                continue
+
+            for task in done:
+                if task.result() is True:
+                    successful_count += 1
+                elif spare:
+                    pending_tasks.add(asyncio.create_task(replicate_to_follower(spare.pop(0))))
+
+        # Let the slower and unselected followers finish in the background so they
+        # do not miss the write and stall their applied index
+        for remaining_task in pending_tasks:
+            self._run_in_background(remaining_task)
+        for follower in spare:
+            self._run_in_background(asyncio.create_task(replicate_to_follower(follower)))
+
+        self.quorum_wait.observe(loop.time() - started, "met" if successful_count >= write_quorum else "missed")
+        return successful_count
+
+    # Writes
+
+    def overloaded(self, reason: str) -> HTTPException:
+        self.rejected_writes += 1
+        return HTTPException(
+            status_code=503,
+            detail=f"Leader overloaded: {reason}. Retry later.",
+            headers={"Retry-After": str(self.config.retry_after_s)}
+        )
+
+    @asynccontextmanager
+    async def write_admission(self):
+        """
+        Reject writes before they touch the store when too many are already waiting for a
+        quorum, or when too few followers have room in their replication backlog to make one.
+        """
+        if self.inflight_writes >= self.config.max_inflight_writes:
+            raise self.overloaded(f"{self.inflight_writes} writes already in flight")
+        if len(self.follower_tracker.with_capacity(self.config.max_follower_backlog)) < self.write_quorum:
+            raise self.overloaded("replication backlog full on too many followers")
+        self.inflight_writes += 1
+        try:
+            yield
+        finally:
+            self.inflight_writes -= 1
+
+    def quorum_not_met(self, total_successful: int) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"Write quorum not met. Got {total_successful}/{self.write_quorum} confirmations. "
+                   f"Write persisted on leader but replication incomplete."
+        )
+
+    def redirect_if_superseded(self, path: str) -> Optional[RedirectResponse]:
+        """Once a newer leader was elected, writes go there; the followers would refuse them here."""
+        if self.superseded_by is None:
+            return None
+        _, leader_url = self.superseded_by
+        if leader_url is None:
+            raise HTTPException(status_code=503, detail="A newer leader is being elected",
+                                headers={"Retry-After": str(self.config.retry_after_s)})
+        # 307 keeps the method and body
+        return RedirectResponse(url=f"{leader_url}{path}", status_code=307)
+
+    def _replicated(self, total_successful: int, start_time: float) -> Dict:
+        if total_successful < self.write_quorum:
+            raise self.quorum_not_met(total_successful)
+        return {
+            "replicated_to": total_successful,
+            "total_followers": len(self.followers),
+            "write_quorum": self.write_quorum,
+            "latency_seconds": time.time() - start_time
+        }
+
+    async def apply_write(self, key: str, value: str, ttl_ms: Optional[int], if_version: Optional[int],
+                          if_value: Optional[str]) -> Dict:
+        start_time = time.time()
+        expires_at = expiry_time(ttl_ms)
+        conditional = if_version is not None or if_value is not None
+
+        async with self.write_admission():
+            async with self.key_locks(key):
+                if conditional:
+                    applied, version, current_value = await self.store.compare_and_set(
+                        key, value, expires_at, if_version, if_value
+                    )
+                    if not applied:
+                        raise conflict(key, version, current_value)
+                else:
+                    version = await self.store.write(key, value, expires_at)
+
+            total_successful = await self.replicate_with_quorum([(key, value, version, expires_at)])
+
+        return {"status": "success", "key": key, "value": value, "version": version,
+                "expires_at": expires_at or None, **self._replicated(total_successful, start_time)}
+
+    async def apply_batch(self, request: BatchWriteRequest) -> Dict:
+        """
+        Apply many writes and deletes atomically and replicate them in one message per
+        follower. The whole batch shares one quorum outcome; each item gets its own version.
+        Conditional items that fail are skipped and come back with the key's current state.
+        """
+        start_time = time.time()
+        if len(request.items) > self.config.max_batch_size:
+            raise HTTPException(status_code=400, detail=f"Batch larger than {self.config.max_batch_size} items")
+
+        conditional = any(
+            item.value is None or item.if_version is not None or item.if_value is not None for item in request.items
+        )
+        items = [(item.key, item.value, expiry_time(item.ttl_ms)) for item in request.items]
+        async with self.write_admission():
+            async with self.key_locks.many([key for key, _, _ in items]):
+                if conditional:
+                    outcomes = await self.store.compare_and_set_many([
+                        (key, value, expires_at, item.if_version, item.if_value)
+                        for (key, value, expires_at), item in zip(items, request.items)
+                    ])
+                else:
+                    versions = await self.store.write_many(items)
+                    outcomes = [(True, version, value) for (_, value, _), version in zip(items, versions)]
+
+            applied = [
+                (key, value, version, expires_at)
+                for (key, value, expires_at), (ok, version, _) in zip(items, outcomes) if ok
+            ]
+            total_successful = await self.replicate_with_quorum(applied) if applied else self.write_quorum
+
+        replicated = self._replicated(total_successful, start_time)
+        results = []
+        for (key, value, _), (ok, version, current_value) in zip(items, outcomes):
+            if ok:
+                results.append({"key": key, "version": version, "status": "success"})
+            elif value is None and version == 0:
+                results.append({"key": key, "version": 0, "status": "not_found"})
+            else:
+                results.append({"key": key, "version": version, "status": "conflict", "value": current_value})
+        return {"status": "success", "results": results, **replicated}
+
+    async def apply_delete(self, key: str, if_version: Optional[int], if_value: Optional[str]) -> Dict:
+        """Delete a key, optionally only at a given version or value, replicated like a write."""
+        start_time = time.time()
+
+        async with self.write_admission():
+            async with self.key_locks(key):
+                applied, version, current_value = await self.store.compare_and_set(
+                    key, None, 0.0, if_version, if_value
+                )
+            if not applied:
+                if version == 0:
+                    raise HTTPException(status_code=404, detail="Key not found")
+                raise conflict(key, version, current_value)
+
+            total_successful = await self.replicate_with_quorum([(key, None, version, 0.0)])
+
+        return {"status": "deleted", "key": key, "version": version,
+                **self._replicated(total_successful, start_time)}
+
+    # Anti-entropy
+
+    async def repair_follower(self, follower_url: str) -> int:
+        """
+        Walk the follower's hash tree top-down, descending only into subtrees whose
+        hashes differ, past the leaf buckets down to about one key per node, then ship the
+        keys whose entry hashes differ under the nodes left. Returns the number of keys sent
+        to the follower.
+        """
+        if self.client is None:
+            raise RuntimeError("Shared HTTP client not initialized")
+        response = await self.client.get(f"{follower_url}/merkle")
+        response.raise_for_status()
+        remote = response.json()
+        local = await self.store.merkle_root()
+        if remote["depth"] != local["depth"]:
+            raise RuntimeError(f"Merkle depth mismatch: leader {local['depth']}, follower {remote['depth']}")
+        # Once repaired, the follower reflects every write the leader had applied at this point
+        sync_index = local["applied_index"]
+        if remote["root"] == local["root"]:
+            if remote["applied_index"] < sync_index:
+                await self._send_repair(follower_url, {}, sync_index)
+            return 0
+
+        # Virtual levels below the leaves keep the hashes moved per diverged key at O(log n)
+        leaf_level = repair_level(local["depth"], max(local["keys_count"], remote["keys_count"]))
+        differing = [0]
+        for level in range(1, leaf_level + 1):
+            candidates = children(differing)
+            response = await self.client.post(
+                f"{follower_url}/merkle/nodes",
+                json={"level": level, "indices": candidates}
+            )
+            response.raise_for_status()
+            remote_hashes = response.json()["hashes"]
+            local_hashes = await self.store.merkle_nodes(level, candidates)
+            differing = [index for index, local_hash, remote_hash
+                         in zip(candidates, local_hashes, remote_hashes) if local_hash != remote_hash]
+            if not differing:
+                await self._send_repair(follower_url, {}, sync_index)
+                return 0
+
+        response = await self.client.post(
+            f"{follower_url}/merkle/buckets",
+            json={"indices": differing, "level": leaf_level}
+        )
+        response.raise_for_status()
+        local_buckets = await self.store.merkle_buckets(differing, leaf_level)
+        remote_buckets = response.json()["buckets"]
+        differing_keys = [
+            key
+            for local_bucket, remote_bucket in zip(local_buckets, remote_buckets)
+            for key, local_hash in local_bucket.items()
+            if remote_bucket.get(key) != local_hash
+        ]
+        # A key only the follower has was deleted or expired on the leader, whose own writes
+        # always land locally first. Any write re-creating it gets a later version than this.
+        delete_version = (await self.store.replication_status())["applied_index"]
+        deletes = {
+            key: delete_version
+            for local_bucket, remote_bucket in zip(local_buckets, remote_buckets)
+            for key in remote_bucket if key not in local_bucket
+        }
+        entries = await self.store.get_many(differing_keys)
+        await self._send_repair(follower_url, entries, sync_index, deletes)
+        return len(entries) + len(deletes)
+
+    async def _send_repair(self, follower_url: str, entries: Dict, sync_index: int,
+                           deletes: Optional[Dict[str, int]] = None):
+        response = await self.client.post(
+            f"{follower_url}/repair",
+            json={
+                "entries": {key: value for key, (value, _) in entries.items()},
+                "versions": {key: version for key, (_, version) in entries.items()},
+                "sync_index": sync_index,
+                "deletes": deletes or {},
+                "term": self.term
+            }
+        )
+        response.raise_for_status()
+
+    async def run_anti_entropy(self) -> Dict[str, int]:
+        async def repair_or_log(follower_url: str) -> int:
+            try:
+                return await self.repair_follower(follower_url)
+            except Exception as e:
+                print(f"Anti-entropy repair failed for {follower_url}: {e}")
+                return -1
+
+        results = await asyncio.gather(*(repair_or_log(follower) for follower in self.followers))
+        return dict(zip(self.followers, results))
+
+    def repair_all_now(self):
+        """
+        Run one anti-entropy pass right away, as a newly elected leader does: it brings the
+        followers in line with it and closes gaps in their applied index left by writes the
+        old leader never delivered.
+        """
+        self.tasks.append(asyncio.create_task(self.run_anti_entropy()))
+
+    async def _anti_entropy_loop(self):
+        while True:
+            await asyncio.sleep(self.config.anti_entropy_interval_s)
+            if self.superseded_by is not None:
+                continue
+            repaired = await self.run_anti_entropy()
+            if any(count > 0 for count in repaired.values()):
+                print(f"Anti-entropy repaired keys: {repaired}")
+
+    # Leadership
+
+    def supersede(self, newer_term: int, leader_url: Optional[str]):
+        if newer_term > self.term and (self.superseded_by is None or newer_term >= self.superseded_by[0]):
+            if self.superseded_by is None:
+                print(f"Leader of term {self.term} superseded by term {newer_term} at {leader_url}")
+            self.superseded_by = (newer_term, leader_url)
+
+    async def _heartbeat_loop(self):
+        """
+        Tell followers the current commit index so they can report their staleness, and that
+        this leader is alive, which holds off elections. A follower that has moved on to a
+        later term refuses, and tells us who leads it.
+        """
+        interval = self.config.heartbeat_interval_ms / 1000.0
+
+        async def send_heartbeat(follower_url: str, commit_index: int, sent_at: float):
+            try:
+                response = await self.client.post(
+                    f"{follower_url}/heartbeat",
+                    json={"commit_index": commit_index, "sent_at": sent_at, "term": self.term,
+                          "leader_url": self.leader_url, "write_quorum": self.write_quorum},
+                    timeout=max(interval, 0.1)
+                )
+                if response.status_code == 409:
+                    detail = response.json()["detail"]
+                    self.supersede(detail["term"], detail["leader_url"])
+            except Exception:
+                pass
+
+        while True:
+            status = await self.store.replication_status()
+            sent_at = time.time()
+            await asyncio.gather(*(send_heartbeat(follower, status["applied_index"], sent_at)
+                                   for follower in self.followers))
+            await asyncio.sleep(interval)
+
+    async def _expiry_loop(self):
+        """Delete keys whose TTL has passed and replicate the deletes like writes."""
+        interval = self.config.expiry_interval_ms / 1000.0
+        limit = self.config.max_expirations_per_tick
+        while True:
+            if self.superseded_by is not None:
+                # The newer leader expires keys now
+                await asyncio.sleep(interval)
+                continue
+            try:
+                expired = await self.store.expire_due(time.time(), limit)
+            except Exception as e:
+                print(f"Error expiring keys: {e}")
+                expired = []
+            if expired:
+                # Nobody waits on these, so replicate them in the background
+                self._run_in_background(asyncio.create_task(
+                    self.replicate_with_quorum([(key, None, version, 0.0) for key, version in expired])
+                ))
+            if len(expired) < limit:
+                await asyncio.sleep(interval)
+            else:
+                # More keys are due: keep going, but let requests run in between
+                await asyncio.sleep(0)
+
+
+def expiry_time(ttl_ms: Optional[int]) -> float:
+    """Absolute expiry time for a TTL, 0 for none. Set once here so every replica agrees."""
+    if ttl_ms is None:
+        return 0.0
+    if ttl_ms <= 0:
+        raise HTTPException(status_code=400, detail="ttl_ms must be positive")
+    return time.time() + ttl_ms / 1000.0
+
+
+def conflict(key: str, version: int, value: Optional[str]) -> HTTPException:
+    """The current version and value come back with the conflict, so a retry needs no read."""
+    return HTTPException(
+        status_code=409,
+        detail={"error": "Condition not met", "key": key, "version": version, "value": value}
+    )